@@ -1,10 +1,18 @@
-from . import concoord_dist
-from . import concoord_disco
-from . import prody_anm
-from . import nolb_nma
-from . import imod_imode
-from . import imod_imove
-from . import imod_imc
+import importlib
 
 name = "flexdyn"
-__all__ = ["concoord_dist", "concoord_disco", "prody_anm", "nolb_nma", "imod_imode", "imod_imove", "imod_imc"]
+__all__ = ["concoord_dist", "concoord_disco", "prody_anm", "nolb_nma", "imod_imode", "imod_imove", "imod_imc", "concoord_violations", "concoord_prune", "imod_pipeline"]
+
+
+def __getattr__(attr: str):
+    # PEP 562: the block modules are imported on first access, so importing one block
+    # (ie: the imod_imode command line) does not import the dependencies of all the others (ie: ProDy)
+    if attr in __all__:
+        module = importlib.import_module(f"{__name__}.{attr}")
+        globals()[attr] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {attr!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""Module containing the batch execution of the FlexDyn blocks over many input structures and the command line interface."""
+from typing import Optional
+import argparse
+import glob
+import importlib
+import inspect
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from pathlib import Path
+from biobb_common.configuration import settings
+from biobb_common.tools import file_utils as fu
+
+
+def expand_inputs(inputs: list[str]) -> list[str]:
+    """Return the paths of the **inputs**, expanding the glob patterns (ie: "pdbs/*.pdb") in sorted order, without duplicates."""
+    paths: list[str] = []
+    for pattern in inputs:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def job_paths(input_path: str, index: int, input_key: str, outputs: dict[str, str], paths: Optional[dict] = None) -> dict[str, str]:
+    """Return the input/output paths of the **index** job of a batch processing **input_path** as **input_key**.
+
+    The **outputs** templates (output argument --> path) are formatted with the ``{stem}``, ``{name}``, ``{parent}``
+    and ``{index}`` of the input path, ie: ``{"output_pdb_path": "ensembles/{stem}_anm.pdb"}``. The **paths** are
+    shared by all the jobs (ie: an input_dat_path common to all the input structures)."""
+    input_file = Path(input_path)
+    fields = {'stem': input_file.stem, 'name': input_file.name, 'parent': str(input_file.parent), 'index': index}
+    return {**(paths or {}), input_key: input_path,
+            **{output_key: template.format(**fields) for output_key, template in outputs.items()}}
+
+
+def block_input_key(block: str) -> str:
+    """Return the first input argument of the **block** (ie: input_pdb_path), the one receiving the batch inputs by default."""
+    launcher = getattr(importlib.import_module(f'biobb_flexdyn.flexdyn.{block}'), block)
+    return next(name for name in inspect.signature(launcher).parameters if name.startswith('input_'))
+
+
+def run_batch(block: str, inputs: list[str], outputs: dict[str, str], properties: Optional[dict] = None,
+              paths: Optional[dict] = None, input_key: Optional[str] = None, num_workers: Optional[int] = None,
+              log_dir: str = 'batch_logs', report_path: Optional[str] = None) -> dict:
+    """Run the **block** (ie: "prody_anm") over every input of **inputs** with a bounded process pool.
+
+    Every worker process imports the block once and runs as many jobs as it is given, so the imports (ie: ProDy)
+    are not repeated for every input. The logs of every job are written to **log_dir** and gathered, with the
+    return code, errors and duration of every job, in the returned report, also written to **report_path** if set.
+
+    Args:
+        block (str): Name of the block module and function, ie: "prody_anm", "imod_imode" or "concoord_dist".
+        inputs (list): Input file paths or glob patterns (ie: "pdbs/*.pdb").
+        outputs (dict): Output argument --> path template, see :func:`job_paths`.
+        properties (dict): Properties of the block, shared by all the jobs.
+        paths (dict): Other input/output arguments of the block, shared by all the jobs.
+        input_key (str): Argument receiving the inputs. If not set, the first input argument of the block.
+        num_workers (int): Number of worker processes. If not set, the number of CPUs.
+        log_dir (str): Directory of the logs of every job.
+        report_path (str): Path to the output JSON report.
+    """
+    input_key = input_key or block_input_key(block)
+    input_paths = expand_inputs(inputs)
+    log_path = Path(fu.create_dir(str(Path(log_dir).resolve())))
+    # The global log of a configuration file can not be sent to the workers, every job writes its own logs
+    properties = {key: value for key, value in (properties or {}).items() if key != 'global_log'}
+
+    start = time.monotonic()
+    jobs = []
+    with ProcessPoolExecutor(max_workers=num_workers or os.cpu_count(), initializer=_init_worker, initargs=(block,)) as executor:
+        futures = {}
+        for index, input_path in enumerate(input_paths):
+            job_name = f'{index:05d}_{Path(input_path).stem}'
+            job_properties = {**properties,
+                              'out_log_path': str(log_path.joinpath(f'{job_name}_log.out')),
+                              'err_log_path': str(log_path.joinpath(f'{job_name}_log.err')),
+                              'can_write_console_log': False}
+            input_paths_job = job_paths(input_path, index, input_key, outputs, paths)
+            futures[executor.submit(_run_job, block, input_paths_job, job_properties)] = (index, input_paths_job, job_properties)
+        for num_done, future in enumerate(as_completed(futures), 1):
+            index, input_paths_job, job_properties = futures[future]
+            job = {'index': index, 'input': input_paths[index], **_job_result(future, input_paths_job, job_properties)}
+            jobs.append(job)
+            if job['return_code']:
+                print(f"Job {job['index']} ({job['input']}) failed with exit code {job['return_code']}{': ' + job['error'] if job['error'] else ''}", file=sys.stderr)
+            print(f"{num_done}/{len(input_paths)} jobs finished", file=sys.stderr)
+
+    jobs.sort(key=lambda job: job['index'])
+    num_failed = sum(1 for job in jobs if job['return_code'])
+    report = {'block': block, 'num_jobs': len(jobs), 'num_succeeded': len(jobs) - num_failed, 'num_failed': num_failed,
+              'num_workers': num_workers or os.cpu_count(), 'wall_time': round(time.monotonic() - start, 6), 'jobs': jobs}
+    if report_path:
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=4)
+    return report
+
+
+def _init_worker(block: str) -> None:
+    # Imported once per worker process, instead of once per job
+    importlib.import_module(f'biobb_flexdyn.flexdyn.{block}')
+
+
+def _run_job(block: str, paths: dict[str, str], properties: dict) -> dict:
+    launcher = getattr(importlib.import_module(f'biobb_flexdyn.flexdyn.{block}'), block)
+    start = time.monotonic()
+    error = None
+    try:
+        return_code = launcher(properties=properties, **paths)
+    except Exception as exception:
+        return_code, error = 1, f'{type(exception).__name__}: {exception}'
+    return {'paths': paths, 'return_code': return_code, 'error': error, 'wall_time': round(time.monotonic() - start, 6),
+            'out_log': _read_log(properties['out_log_path']), 'err_log': _read_log(properties['err_log_path'])}
+
+
+def _job_result(future: Future, paths: dict[str, str], properties: dict) -> dict:
+    """Return the result of the :func:`_run_job` **future**, or a failed job if its worker process crashed
+    (ie: killed by the OOM killer, breaking the pool and all its pending jobs), so that the report is still written."""
+    try:
+        return future.result()
+    except Exception as exception:
+        return {'paths': paths, 'return_code': 1, 'error': f'{type(exception).__name__}: {exception}', 'wall_time': None,
+                'out_log': _read_log(properties['out_log_path']), 'err_log': _read_log(properties['err_log_path'])}
+
+
+def _read_log(log_path: str) -> str:
+    try:
+        return Path(log_path).read_text()
+    except OSError:
+        return ''
+
+
+def main():
+    """Command line execution of this module."""
+    parser = argparse.ArgumentParser(description="Run a FlexDyn block over many input structures with a process pool.",
+                                     formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=99999))
+    parser.add_argument('-c', '--config', required=False, help="Properties of the block: a YAML file, JSON file or JSON string")
+    required_args = parser.add_argument_group('required arguments')
+    required_args.add_argument('--block', required=True, help="Block to be run, ie: prody_anm, imod_imode or concoord_dist")
+    required_args.add_argument('--inputs', required=True, nargs='+', help="Input files or glob patterns, ie: 'pdbs/*.pdb'")
+    required_args.add_argument('--outputs', required=True, nargs='+', metavar='OUTPUT=TEMPLATE',
+                               help="Output path templates formatted with the {stem}, {name}, {parent} and {index} of every input, ie: output_pdb_path=ensembles/{stem}_anm.pdb")
+    parser.add_argument('--paths', nargs='+', default=[], metavar='ARGUMENT=PATH', help="Other arguments of the block shared by all the jobs, ie: input_dat_path=evecs.dat")
+    parser.add_argument('--input_key', help="Argument receiving the inputs. Default: the first input argument of the block")
+    parser.add_argument('--num_workers', type=int, help="Number of worker processes. Default: the number of CPUs")
+    parser.add_argument('--log_dir', default='batch_logs', help="Directory of the logs of every job. Default: batch_logs")
+    parser.add_argument('--report_path', default='batch_report.json', help="Output JSON report. Default: batch_report.json")
+    args = parser.parse_args()
+
+    properties = settings.ConfReader(config=args.config or "{}").get_prop_dic()
+    report = run_batch(args.block, args.inputs, dict(output.split('=', 1) for output in args.outputs), properties,
+                       dict(path.split('=', 1) for path in args.paths), args.input_key, args.num_workers,
+                       args.log_dir, args.report_path)
+    print(f"{report['num_succeeded']} of {report['num_jobs']} jobs succeeded, report written to {args.report_path}")
+    sys.exit(1 if report['num_failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
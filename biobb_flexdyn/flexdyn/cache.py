@@ -0,0 +1,238 @@
+"""Module containing the content-addressed caches of the FlexDyn blocks: the result cache of the launches and the
+file store it is built on."""
+import functools
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+from biobb_common.tools import file_utils as fu
+from biobb_flexdyn.flexdyn.instrumentation import phase
+from biobb_flexdyn.flexdyn.streaming import is_streaming
+
+
+def file_hash(file_path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """Return the sha256 hex digest of the content of **file_path**."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file_handler:
+        for chunk in iter(lambda: file_handler.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_key(*items) -> str:
+    """Return a sha256 hex digest identifying the JSON serializable **items**."""
+    return hashlib.sha256(json.dumps(items, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ContentCache:
+    """Content-addressed on-disk store of files with a size-bounded LRU eviction policy.
+
+    Every entry is a directory named after its key holding one or more files.
+    Looking up an entry refreshes its modification time, which is used as the
+    least-recently-used criterion when the store exceeds **max_size** MB, and
+    entries not used for more than **max_age** days expire.
+    Hit and miss counters are kept in a ``stats.json`` file in the store.
+
+    Args:
+        cache_path (str): Path to the cache directory, created if it does not exist.
+        max_size (float): Maximum size of the cache in MB.
+        out_log (Logger): Local log.
+        global_log (Logger): Global log.
+        max_age (float): Maximum age of the entries in days since they were last used. If None, the entries do not expire.
+    """
+    STATS_FILE = 'stats.json'
+
+    def __init__(self, cache_path: Union[str, Path], max_size: float = 1024,
+                 out_log: Optional[logging.Logger] = None, global_log: Optional[logging.Logger] = None,
+                 max_age: Optional[float] = None) -> None:
+        self.cache_path = Path(fu.create_dir(str(cache_path)))
+        self.max_size = max_size
+        self.max_age = max_age
+        self.out_log = out_log
+        self.global_log = global_log
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Return the entry directory of **key** or None if it is not in the cache or it has expired."""
+        entry = self.cache_path.joinpath(key)
+        hit = entry.is_dir()
+        if hit and self.expired(entry.stat().st_mtime):
+            shutil.rmtree(entry, ignore_errors=True)
+            hit = False
+        if hit:
+            os.utime(entry)
+        stats = self._update_stats('hits' if hit else 'misses')
+        fu.log(f"Cache {'hit' if hit else 'miss'}: {key} (hits: {stats['hits']}, misses: {stats['misses']})", self.out_log, self.global_log)
+        return entry if hit else None
+
+    def store(self, key: str, files: dict[str, Union[str, Path]]) -> Path:
+        """Copy **files** (entry file name --> source path) into the entry of **key** and evict old entries."""
+        entry = self.cache_path.joinpath(key)
+        tmp_entry = Path(fu.create_unique_dir(path=str(self.cache_path), prefix='.tmp_'))
+        for name, file_path in files.items():
+            shutil.copy2(file_path, tmp_entry.joinpath(name))
+        try:
+            # Atomic publication of the entry, a concurrent writer may have stored it first
+            tmp_entry.rename(entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.evict()
+        return entry
+
+    def expired(self, mtime: float) -> bool:
+        """Return whether an entry last used at **mtime** is older than **max_age** days."""
+        return self.max_age is not None and time.time() - mtime > self.max_age * 86400
+
+    def evict(self) -> list[str]:
+        """Remove the expired entries and the least recently used ones until the cache fits in **max_size** MB."""
+        entries = [(entry.stat().st_mtime, _dir_size(entry), entry) for entry in self.cache_path.iterdir()
+                   if entry.is_dir() and not entry.name.startswith('.')]
+        total_size = sum(size for _, size, _ in entries)
+        removed = []
+        for mtime, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total_size <= self.max_size * 1024 * 1024 and not self.expired(mtime):
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+            removed.append(entry.name)
+        if removed:
+            fu.log(f"Cache eviction: removed {len(removed)} entries", self.out_log, self.global_log)
+        return removed
+
+    def _update_stats(self, counter: str) -> dict:
+        stats_path = self.cache_path.joinpath(self.STATS_FILE)
+        try:
+            stats = json.loads(stats_path.read_text())
+        except (OSError, ValueError):
+            stats = {}
+        stats = {'hits': stats.get('hits', 0), 'misses': stats.get('misses', 0)}
+        stats[counter] += 1
+        tmp_stats_path = stats_path.with_name(f'.{stats_path.name}.{os.getpid()}')
+        tmp_stats_path.write_text(json.dumps(stats))
+        os.replace(tmp_stats_path, stats_path)
+        return stats
+
+
+def _dir_size(dir_path: Path) -> int:
+    return sum(f.stat().st_size for f in dir_path.rglob('*') if f.is_file())
+
+
+# Properties that do not change the outputs of a block, so they are not part of its result cache key
+RESULT_CACHE_IGNORED_PROPERTIES = ('cache_path', 'cache_max_size', 'cache_max_age', 'cache_link', 'instrumentation_path',
+                                   'checkpoint_path', 'modes_cache_path', 'modes_cache_max_size')
+
+
+def result_cache(launch: Callable) -> Callable:
+    """Decorator of the launch method (or launch_async coroutine) of the blocks reusing the outputs of a previous
+    execution with the same inputs from the content-addressed cache in the ``cache_path`` property of the block,
+    if set. On a cache hit the outputs are hard linked (``cache_link`` property) or copied from the cache and the
+    launch is skipped, otherwise the outputs of a successful launch are stored in the cache. The launches streaming
+    frames (see :func:`biobb_flexdyn.flexdyn.streaming.is_streaming`) do not use the cache. See :func:`result_cache_key`.
+
+    The cache is shared by all the FlexDyn blocks, keyed by the content of the input files, the properties and the
+    version of the wrapped software. When it exceeds ``cache_max_size`` (MB) the least recently used entries are
+    evicted, as well as the entries not used for ``cache_max_age`` days, if set. The outputs hard linked to a
+    cache entry must not be modified in place."""
+    if inspect.iscoroutinefunction(launch):
+        @functools.wraps(launch)
+        async def wrapper_cache_async(block, *args, **kwargs):
+            cache, key, hit = _result_cache_lookup(block)
+            if hit:
+                return 0
+            return_code = await launch(block, *args, **kwargs)
+            _result_cache_store(block, cache, key, return_code)
+            return return_code
+        return wrapper_cache_async
+
+    @functools.wraps(launch)
+    def wrapper_cache(block, *args, **kwargs):
+        cache, key, hit = _result_cache_lookup(block)
+        if hit:
+            return 0
+        return_code = launch(block, *args, **kwargs)
+        _result_cache_store(block, cache, key, return_code)
+        return return_code
+    return wrapper_cache
+
+
+def result_cache_key(block) -> str:
+    """Return the key of the outputs of the **block** in the result cache: a hash of the content of its input files,
+    the formats of its outputs, its effective properties (the documented ones, with their default values) and the
+    version of the wrapped software (the content of the binaries found in the PATH or the version of the Python
+    packages in the CACHE_PACKAGES of the block, and the container, if any)."""
+    inputs = {input_key: file_hash(input_path) for input_key, input_path in block.io_dict['in'].items()
+              if input_path and Path(input_path).is_file()}
+    outputs = {output_key: Path(output_path).suffix for output_key, output_path in block.io_dict['out'].items() if output_path}
+    properties = {name: getattr(block, name, None) for name, doc in block.doc_properties_dict.items()
+                  if not doc.get('wf_property') and name not in RESULT_CACHE_IGNORED_PROPERTIES}
+    versions = {package: _package_version(package) for package in ('biobb_flexdyn', *getattr(block, 'CACHE_PACKAGES', ()))}
+    for name, value in vars(block).items():
+        if name.endswith('binary_path') and value:
+            binary = shutil.which(value)
+            versions[name] = _binary_hash(binary) if binary and not block.container_path else value
+    return hash_key(type(block).__name__, inputs, outputs, properties, versions, block.container_path, block.container_image,
+                    {name: os.getenv(name) for name in getattr(block, 'CACHE_ENV_VARS', ())})
+
+
+def _result_cache_lookup(block) -> tuple[Optional[ContentCache], Optional[str], bool]:
+    """Return the result cache of the **block** (None if not used), its key and whether the outputs have been restored from it."""
+    if not getattr(block, 'cache_path', None) or is_streaming(block):
+        return None, None, False
+    if block.restart and fu.check_complete_files(list(block.io_dict['out'].values())):
+        # Outputs of a previous execution, not necessarily with these inputs and properties
+        return None, None, False
+    with phase(block, 'result_cache'):
+        cache = ContentCache(block.cache_path, block.cache_max_size, block.out_log, block.global_log, block.cache_max_age)
+        key = result_cache_key(block)
+        entry = cache.lookup(key)
+        if not entry:
+            return cache, key, False
+        for output_key, output_path in block.io_dict['out'].items():
+            if output_path:
+                cached_path = entry.joinpath(output_key + Path(output_path).suffix)
+                Path(output_path).unlink(missing_ok=True)
+                try:
+                    if not block.cache_link:
+                        raise OSError
+                    os.link(cached_path, output_path)
+                except OSError:
+                    # Cache in a different file system or links not requested
+                    shutil.copy2(cached_path, output_path)
+                fu.log(f"Restored {output_path} from the cache", block.out_log)
+    return cache, key, True
+
+
+def _result_cache_store(block, cache: Optional[ContentCache], key: Optional[str], return_code: int) -> None:
+    if not cache or not key or return_code:
+        return
+    files = {output_key + Path(output_path).suffix: output_path for output_key, output_path in block.io_dict['out'].items() if output_path}
+    if not all(Path(output_path).is_file() for output_path in files.values()):
+        # ie: one output file per principal component instead of output_pdb_path
+        fu.log("Outputs not stored in the cache: not all the output files have been created", block.out_log, block.global_log)
+        return
+    with phase(block, 'result_cache'):
+        cache.store(key, files)
+
+
+@functools.lru_cache(maxsize=None)
+def _package_version(package: str) -> Optional[str]:
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _binary_hash(binary: str) -> str:
+    stat = os.stat(binary)
+    return _file_hash_cached(os.path.realpath(binary), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=None)
+def _file_hash_cached(file_path: str, mtime_ns: int, size: int) -> str:
+    # Binaries are hashed once per process while they are not modified
+    return file_hash(file_path)
@@ -0,0 +1,359 @@
+"""Common functions for package biobb_flexdyn.flexdyn"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterator, NamedTuple, Optional, Union
+import numpy as np
+from biobb_common.tools import file_utils as fu
+from biobb_flexdyn.flexdyn.pdb_codec import iter_line_blocks, iter_pdb_chunks
+from biobb_flexdyn.flexdyn.processes import run_commands, run_commands_async
+from biobb_flexdyn.flexdyn.streaming import run_streaming, run_streaming_async
+
+
+def split_count(count: int, parts: int) -> list[int]:
+    """Split **count** items in **parts** shards whose sizes differ at most by one."""
+    return [count // parts + (1 if i < count % parts else 0) for i in range(parts)]
+
+
+def derive_seeds(seed: int, count: int, max_seed: int = 2**31 - 1) -> list[int]:
+    """Return **count** independent seeds deterministically derived from **seed**."""
+    return [int(child.generate_state(1)[0]) % max_seed or 1 for child in np.random.SeedSequence(seed).spawn(count)]
+
+
+# Command line options accepted as the seed_flag property of the blocks wrapping a sampling tool without a documented
+# seed option (imc, NOLB): the property is inserted in the command line, so only these options are allowed
+SEED_FLAGS = ('--seed',)
+
+
+def check_seed_flag(block) -> bool:
+    """Return True if the sampling **block** has a seed_flag property, the command line option of the wrapped tool
+    taking the random seed, raising a ValueError if it is not one of the SEED_FLAGS. If it is not set, the tool
+    seeds itself and the seed property of the **block**, if set, is ignored with a warning."""
+    if block.seed_flag and block.seed_flag not in SEED_FLAGS:
+        raise ValueError(f"Unknown seed_flag {block.seed_flag!r}, expected one of: {', '.join(SEED_FLAGS)}")
+    if not block.seed_flag and block.seed is not None:
+        fu.log("WARNING: the seed property is ignored, set the seed_flag property to pass it", block.out_log, block.global_log)
+    return bool(block.seed_flag)
+
+
+def seeded_processes(block, tool: str, num_processes: int) -> int:
+    """Return the number of **tool** processes sharing the sampling of the **block**: **num_processes** if it has a
+    seed_flag giving every process its own seed, 1 otherwise, as processes seeded by the tool itself (ie: from the
+    clock, or with a fixed default seed) may sample the same structures."""
+    if check_seed_flag(block) or num_processes <= 1:
+        return num_processes
+    fu.log(f"WARNING: the seed_flag property is not set, running a single {tool} process instead of {num_processes} "
+           "so that the structures are not repeated", block.out_log, block.global_log)
+    return 1
+
+
+def seed_options(block, seed: Optional[int]) -> list[str]:
+    """Return the command line options passing **seed** with the seed_flag of the **block**, if both are set."""
+    return [block.seed_flag, str(seed)] if block.seed_flag and seed is not None else []
+
+
+class ChunkManifest:
+    """Checkpoint of an ensemble generated in chunks, so that a relaunch of an interrupted run only generates the missing chunks.
+
+    Every chunk is generated in its own directory inside **checkpoint_dir**, and the completed chunks
+    are recorded in a ``manifest.json`` file as soon as they finish. A manifest of a different run
+    (different **key** or chunks) is discarded together with its chunks.
+
+    Args:
+        checkpoint_dir (str): Path to the checkpoint directory, created if it does not exist.
+        key (str): Key identifying the run (inputs and parameters).
+        chunk_sizes (list): Number of structures of every chunk.
+        seeds (list): Seed of every chunk.
+        out_log (Logger): Local log.
+        global_log (Logger): Global log.
+    """
+    MANIFEST_FILE = 'manifest.json'
+
+    def __init__(self, checkpoint_dir: Union[str, Path], key: str, chunk_sizes: list[int], seeds: list[int],
+                 out_log: Optional[logging.Logger] = None, global_log: Optional[logging.Logger] = None) -> None:
+        self.checkpoint_dir = Path(fu.create_dir(str(checkpoint_dir)))
+        self.key = key
+        self.chunk_sizes = chunk_sizes
+        self.seeds = seeds
+        self.completed: set[int] = set()
+        self._lock = threading.Lock()
+
+        manifest_path = self.checkpoint_dir.joinpath(self.MANIFEST_FILE)
+        try:
+            manifest = json.loads(manifest_path.read_text())
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest and [manifest.get('key'), manifest.get('chunk_sizes'), manifest.get('seeds')] == [key, chunk_sizes, seeds]:
+            self.completed = {int(index) for index in manifest.get('completed', [])}
+            fu.log(f"Resuming from checkpoint {self.checkpoint_dir}: {len(self.completed)}/{len(chunk_sizes)} chunks completed", out_log, global_log)
+        elif manifest:
+            fu.log(f"Discarding checkpoint {self.checkpoint_dir} of a different run", out_log, global_log)
+            for chunk_dir in self.checkpoint_dir.glob('chunk_*'):
+                shutil.rmtree(chunk_dir, ignore_errors=True)
+        self._write()
+
+    def chunk_dir(self, index: int) -> Path:
+        """Return the directory of the chunk **index**."""
+        return self.checkpoint_dir.joinpath(f'chunk_{index:04d}')
+
+    def missing(self) -> list[int]:
+        """Return the indices of the chunks not completed yet."""
+        return [index for index in range(len(self.chunk_sizes)) if index not in self.completed]
+
+    def mark_completed(self, index: int) -> None:
+        """Record the chunk **index** as completed in the manifest."""
+        with self._lock:
+            self.completed.add(index)
+            self._write()
+
+    def _write(self) -> None:
+        manifest = {'key': self.key, 'chunk_sizes': self.chunk_sizes, 'seeds': self.seeds, 'completed': sorted(self.completed)}
+        manifest_path = self.checkpoint_dir.joinpath(self.MANIFEST_FILE)
+        tmp_manifest_path = manifest_path.with_name(f'.{manifest_path.name}.{os.getpid()}')
+        tmp_manifest_path.write_text(json.dumps(manifest, indent=4))
+        os.replace(tmp_manifest_path, manifest_path)
+
+
+def split_chunks(count: int, chunk_size: int) -> list[int]:
+    """Split **count** items in consecutive chunks of at most **chunk_size** items."""
+    return [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+
+
+def concatenate_files(file_paths: list[Union[str, Path]], output_path: Union[str, Path]) -> None:
+    """Concatenate the content of **file_paths** into **output_path**."""
+    with open(output_path, 'wb') as output_file:
+        for file_path in file_paths:
+            with open(file_path, 'rb') as input_file:
+                shutil.copyfileobj(input_file, output_file)
+
+
+# Lines of a PDB file other than the atom records
+NON_ATOM_LINE = re.compile(rb'^(?!ATOM  |HETATM|ANISOU|TER)[^\n]+\n?', re.MULTILINE)
+
+
+def merge_pdb_models(pdb_paths: list[Union[str, Path]], output_path: Union[str, Path],
+                     model_remarks: tuple[str, ...] = ()) -> int:
+    """Merge the multi-model PDB files **pdb_paths** into **output_path** with continuous model numbering.
+
+    The file header (lines before the first MODEL record) is only kept from the first file
+    and END records are written once at the end. Lines matching one of the **model_remarks**
+    regular expressions, whose first group is followed by a model number, are considered part
+    of the next model and renumbered as well. Return the number of models written.
+
+    Args:
+        pdb_paths (list): Paths to the multi-model PDB files to be merged.
+        output_path (str): Path to the merged multi-model PDB file.
+        model_remarks (tuple): Regular expressions of the per-model records to be renumbered.
+    """
+    remark_patterns = [re.compile(pattern) for pattern in model_remarks]
+    num_models = 0
+    end_line = None
+    with open(output_path, 'wb') as output_file:
+        for file_index, pdb_path in enumerate(pdb_paths):
+            in_header = True
+            for block in iter_line_blocks(pdb_path):
+                # Only the records other than atoms are looked at, the atom records between them are copied as they are
+                position = 0
+                for match in NON_ATOM_LINE.finditer(block):
+                    if not (in_header and file_index):
+                        output_file.write(block[position:match.start()])
+                    position = match.end()
+                    line = match.group().decode()
+                    record = line[:6].strip()
+                    if record == 'END':
+                        end_line = line
+                        continue
+                    if record == 'MODEL':
+                        in_header = False
+                        num_models += 1
+                        line = _renumber_record(line, 'MODEL', num_models)
+                    elif record == 'ENDMDL':
+                        line = _renumber_record(line, 'ENDMDL', num_models)
+                    else:
+                        match = next((m for m in (p.match(line) for p in remark_patterns) if m), None)
+                        if match:
+                            number = re.match(r'\s*-?\d+', line[match.end(1):])
+                            if number:
+                                width = len(number.group(0))
+                                line = match.group(1) + str(num_models + 1).rjust(width) + line[match.end(1) + width:]
+                        elif in_header and file_index:
+                            continue
+                    output_file.write(line.encode())
+                if not (in_header and file_index):
+                    output_file.write(block[position:])
+        if end_line:
+            output_file.write(end_line.encode())
+    return num_models
+
+
+def _renumber_record(line: str, record: str, number: int) -> str:
+    """Replace the serial number of a MODEL or ENDMDL **line**, keeping its original layout."""
+    field = line[len(record):].rstrip('\n')
+    if not field.strip():
+        return line
+    stripped = field.strip()
+    tail = field[field.index(stripped) + len(stripped):]
+    if len(field) - len(tail) - len(stripped) > 1:
+        # Right-justified serial (PDB standard: MODEL + 4 blanks + serial in columns 11-14)
+        new_field = str(number).rjust(len(field) - len(tail))
+    else:
+        new_field = field[:len(field) - len(tail) - len(stripped)] + str(number)
+    return record + new_field + tail + '\n'
+
+
+def iter_pdb_coords(pdb_path: Union[str, Path]) -> Iterator[np.ndarray]:
+    """Yield the (n_atoms, 3) coordinates (Angstroms) of every model of a multi-model PDB file."""
+    for chunk in iter_pdb_chunks(pdb_path):
+        yield from chunk
+
+
+def iter_gro_coords(gro_path: Union[str, Path]) -> Iterator[np.ndarray]:
+    """Yield the (n_atoms, 3) coordinates (Angstroms) of every frame of a multi-frame GRO file."""
+    with open(gro_path) as gro_file:
+        while gro_file.readline():
+            num_atoms = int(gro_file.readline())
+            lines = [gro_file.readline() for _ in range(num_atoms)]
+            gro_file.readline()
+            # Fixed columns: x, y and z (nm) in 8 characters fields from column 21
+            yield np.array([[float(line[20:28]), float(line[28:36]), float(line[36:44])] for line in lines]) * 10
+
+
+def iter_coords_chunks(traj_path: Union[str, Path], chunk_size: int) -> Iterator[np.ndarray]:
+    """Yield the coordinates of the PDB or GRO trajectory **traj_path** in (n_frames, n_atoms, 3)
+    arrays of at most **chunk_size** frames."""
+    if Path(traj_path).suffix != '.gro':
+        yield from iter_pdb_chunks(traj_path, chunk_size)
+        return
+    chunk: list[np.ndarray] = []
+    for coords in iter_gro_coords(traj_path):
+        chunk.append(coords)
+        if len(chunk) == chunk_size:
+            yield np.stack(chunk)
+            chunk = []
+    if chunk:
+        yield np.stack(chunk)
+
+
+def memmap_npz_member(npz_path: Union[str, Path], member: str, mmap_mode: str) -> np.ndarray:
+    """Memory-maps the array stored (uncompressed) as **member** of the npz file **npz_path**."""
+    with zipfile.ZipFile(npz_path) as npz_zip:
+        info = npz_zip.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"{npz_path}: {member} is compressed and can not be memory-mapped")
+    with open(npz_path, 'rb') as npz_file:
+        # Local file header: fixed 30 bytes, followed by the file name and the extra field
+        npz_file.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(npz_file.read(4), dtype='<u2')
+        npz_file.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(npz_file)
+        read_array_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_array_header(npz_file)
+        offset = npz_file.tell()
+    if not shape or not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(npz_path, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+class Commands(NamedTuple):
+    """Step yielded by the launch_steps generator of a block (see :func:`run_launch_steps`): the command lines
+    **cmds** to run with at most **num_workers** concurrent processes, calling **on_success** with the index of
+    every command finished with exit code 0, timed as the **phase_name** phase. The generator is sent back the
+    first non-zero exit code or 0."""
+    cmds: list[list[str]]
+    num_workers: int = 1
+    on_success: Optional[Callable[[int], None]] = None
+    phase_name: str = 'run_commands'
+
+    def run(self, block) -> int:
+        return run_commands(block, self.cmds, self.num_workers, self.on_success, self.phase_name)
+
+    async def run_async(self, block) -> int:
+        return await run_commands_async(block, self.cmds, self.num_workers, self.on_success, self.phase_name)
+
+
+class StreamingCommands(NamedTuple):
+    """Step yielded by the launch_steps generator of a block running the command lines **cmds** with
+    :func:`run_streaming`, tailing the **traj_paths** files out of **num_frames** frames. The generator is
+    sent back the exit code and whether the stop condition was met."""
+    cmds: list[list[str]]
+    traj_paths: list[Union[str, Path]]
+    num_frames: Optional[int]
+
+    def run(self, block) -> tuple[int, bool]:
+        return run_streaming(block, self.cmds, self.traj_paths, self.num_frames)
+
+    async def run_async(self, block) -> tuple[int, bool]:
+        return await run_streaming_async(block, self.cmds, self.traj_paths, self.num_frames)
+
+
+LaunchStep = Union[Commands, StreamingCommands]
+LaunchSteps = Generator[LaunchStep, Any, int]
+
+
+def run_biobb_step(block) -> Generator[Commands, int, None]:
+    """Launch step equivalent to ``block.run_biobb()``: create the command line of the **block** and run it,
+    setting the return code of the block."""
+    block.create_cmd_line()
+    block.return_code = yield Commands([block.cmd], phase_name='run_biobb')
+
+
+def run_launch_steps(block, steps: LaunchSteps) -> int:
+    """Run the **steps** generator of a launch of the **block**, running the commands of every step it
+    yields and sending back their results. Return the value returned by the generator."""
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = step.run(block)
+
+
+async def run_launch_steps_async(block, steps: LaunchSteps) -> int:
+    """Asynchronous equivalent of :func:`run_launch_steps` running the commands as asyncio subprocesses, so that
+    no thread is blocked while they run. The Python code between the steps (ie: staging and merging files) runs
+    in the event loop thread. When cancelled, the running commands are terminated, the generator is closed and
+    the temporary files of the **block** are removed before the cancellation is propagated."""
+    result = None
+    try:
+        while True:
+            try:
+                step = steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = await step.run_async(block)
+    except asyncio.CancelledError:
+        steps.close()
+        fu.log("Launch cancelled, removing temporary files", block.out_log, block.global_log)
+        block.remove_tmp_files()
+        raise
+
+
+def launchlogger_async(launch_async: Callable) -> Callable:
+    """Decorator of the launch_async coroutine of the blocks creating the out_log and err_log of every
+    execution, equivalent to the biobb_common launchlogger decorator of the launch method."""
+    @functools.wraps(launch_async)
+    async def wrapper_log(block, *args, **kwargs):
+        fu.create_dir(fu.create_name(path=block.path))
+        if block.disable_logs:
+            return await launch_async(block, *args, **kwargs)
+        block.out_log, block.err_log = fu.get_logs(path=block.path, prefix=block.prefix, step=block.step,
+                                                   can_write_console=block.can_write_console_log,
+                                                   can_write_file=block.can_write_file_log,
+                                                   out_log_path=block.out_log_path, err_log_path=block.err_log_path)
+        try:
+            return await launch_async(block, *args, **kwargs)
+        finally:
+            for log in [block.out_log, block.err_log]:
+                for handler in log.handlers[:]:
+                    handler.close()
+                    log.removeHandler(handler)
+    return wrapper_log
@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
 
 """Module containing the concoord_disco class and the command line interface."""
-from typing import Optional
+from typing import Any, Callable, Generator, Optional
 import os
 import shutil
 from pathlib import Path
+import numpy as np
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import file_hash, hash_key, result_cache
+from biobb_flexdyn.flexdyn.common import (ChunkManifest, Commands, LaunchStep, LaunchSteps, StreamingCommands,
+                                          concatenate_files, derive_seeds, iter_pdb_coords, launchlogger_async,
+                                          merge_pdb_models, run_biobb_step, run_launch_steps, run_launch_steps_async,
+                                          split_chunks, split_count)
+from biobb_flexdyn.flexdyn.instrumentation import copy_file, instrument_launch, instrument_launch_async, phase
+from biobb_flexdyn.flexdyn.streaming import StreamFrame, is_streaming
 
 
 class ConcoordDisco(BiobbObject):
@@ -42,6 +50,14 @@ class ConcoordDisco(BiobbObject):
             * **cutoff** (*float*) - (0.5) Cut-off radius for pairlist (nm) (only valid together with bump)
             * **ref** (*bool*) - (False) Use input coordinates instead of random starting coordinates
             * **scale** (*int*) - (1) Pre-scale coordinates with this factor
+            * **num_workers** (*int*) - (1) Number of concurrent disco processes. The structures are split across the workers, each one running in its own sandbox with a seed deterministically derived from the seed property, and their outputs are merged (the B-factors are recomputed over the merged ensemble).
+            * **chunk_size** (*int*) - (0) Number of structures generated per chunk. If greater than 0, the structures are generated in chunks (at most num_workers at a time) with seeds derived from the seed property, and every completed chunk is recorded in a checkpoint, so that relaunching an interrupted execution only generates the missing chunks. The checkpoint is removed once all the chunks are merged.
+            * **checkpoint_path** (*str*) - (None) Path to the checkpoint directory of the chunks. If not set, a directory named after the inputs and properties is created in the sandbox_path, so that a relaunch with the same inputs and properties finds it.
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -61,6 +77,29 @@ class ConcoordDisco(BiobbObject):
                                 output_bfactor_path='/path/to/disco_out_bfactor.pdb',
                                 properties=prop)
 
+        The structures can be processed while disco is still generating them, stopping the generation once
+        enough have been produced, passing the frame_callback and stop_condition arguments::
+
+            concoord_disco(     input_pdb_path='/path/to/dist_input.pdb',
+                                input_dat_path='/path/to/dist_input.dat',
+                                output_traj_path='/path/to/disco_out_traj.pdb',
+                                output_rmsd_path='/path/to/disco_out_rmsd.dat',
+                                output_bfactor_path='/path/to/disco_out_bfactor.pdb',
+                                properties=prop,
+                                frame_callback=lambda frame: print(frame.index, frame.rate, frame.eta),
+                                stop_condition=lambda frame: frame.index >= 100)
+
+        Many executions can be run concurrently from a single asyncio event loop awaiting the concoord_disco_async
+        function (or the launch_async method); cancelling it terminates disco and removes its temporary files::
+
+            from biobb_flexdyn.flexdyn.concoord_disco import concoord_disco_async
+            await asyncio.gather(*(concoord_disco_async(input_pdb_path='/path/to/dist_input.pdb',
+                                                        input_dat_path='/path/to/dist_input.dat',
+                                                        output_traj_path=f'/path/to/disco_out_traj_{seed}.pdb',
+                                                        output_rmsd_path=f'/path/to/disco_out_rmsd_{seed}.dat',
+                                                        output_bfactor_path=f'/path/to/disco_out_bfactor_{seed}.pdb',
+                                                        properties={**prop, 'seed': seed}) for seed in range(1, 101)))
+
     Info:
         * wrapped_software:
             * name: Concoord
@@ -73,7 +112,9 @@ class ConcoordDisco(BiobbObject):
     """
 
     def __init__(self, input_pdb_path: str, input_dat_path: str, output_traj_path: str,
-                 output_rmsd_path: str, output_bfactor_path: str, properties: Optional[dict] = None, **kwargs) -> None:
+                 output_rmsd_path: str, output_bfactor_path: str, properties: Optional[dict] = None,
+                 frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+                 stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -111,21 +152,98 @@ class ConcoordDisco(BiobbObject):
         self.cutoff = properties.get('cutoff')
         self.ref = properties.get('ref')
         self.scale = properties.get('scale')
+        self.num_workers = properties.get('num_workers', 1)
+        self.chunk_size = properties.get('chunk_size', 0)
+        self.checkpoint_path = properties.get('checkpoint_path')
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
+
+        # Live streaming of the generated structures (see biobb_flexdyn.flexdyn.streaming.StreamFrame)
+        self.frame_callback = frame_callback
+        self.stop_condition = stop_condition
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    # Environment variables changing the outputs, part of the result cache key
+    CACHE_ENV_VARS = ('CONCOORDLIB',)
+
     @launchlogger
+    @instrument_launch
+    @result_cache
     def launch(self):
         """Launches the execution of the FlexDyn ConcoordDisco module."""
+        return run_launch_steps(self, self.launch_steps())
+
+    @launchlogger_async
+    @instrument_launch_async
+    @result_cache
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn ConcoordDisco module as a coroutine, running the disco processes as an asyncio
+        subprocess that is terminated, and its temporary files removed, if the coroutine is cancelled."""
+        return await run_launch_steps_async(self, self.launch_steps())
+
+    def launch_steps(self) -> LaunchSteps:
+        """Execution of the FlexDyn ConcoordDisco module, yielding the commands to be run by :meth:`launch` or :meth:`launch_async`."""
 
         # Setup Biobb
         if self.check_restart():
             return 0
-        self.stage_files()
+        with phase(self, 'stage_files', sandbox_copies='in'):
+            self.stage_files()
 
         # Copy auxiliary files (MARGINS, ATOMS, BONDS) according to the VdW property to the working dir
+        self.copy_concoord_lib(self.stage_io_dict.get("unique_dir", ""))
+
+        if self.chunk_size:
+            yield from self.run_chunks()
+        elif self.num_workers > 1:
+            yield from self.run_shards()
+        elif is_streaming(self):
+            # The frames are always streamed from an NMR-PDB trajectory
+            pdb_traj_path = self.stage_io_dict["out"]["output_traj_path"]
+            if Path(pdb_traj_path).suffix != ".pdb":
+                pdb_traj_path = str(Path(self.stage_io_dict.get('unique_dir', '')).joinpath("disco_stream.pdb"))
+            self.cmd = self.create_disco_cmd(self.stage_io_dict.get('unique_dir', ''),
+                                             self.stage_io_dict["in"]["input_pdb_path"],
+                                             self.stage_io_dict["in"]["input_dat_path"],
+                                             self.stage_io_dict["out"]["output_traj_path"],
+                                             self.stage_io_dict["out"]["output_rmsd_path"],
+                                             self.stage_io_dict["out"]["output_bfactor_path"],
+                                             self.num_structs, self.seed, pdb_traj_path=pdb_traj_path)
+            self.create_cmd_line()
+            self.return_code, stopped = yield StreamingCommands([self.cmd], [pdb_traj_path], self.num_structs or 500)
+            if stopped:
+                self.write_stopped_outputs([pdb_traj_path])
+        else:
+            self.cmd = self.create_disco_cmd(self.stage_io_dict.get('unique_dir', ''),
+                                             self.stage_io_dict["in"]["input_pdb_path"],
+                                             self.stage_io_dict["in"]["input_dat_path"],
+                                             self.stage_io_dict["out"]["output_traj_path"],
+                                             self.stage_io_dict["out"]["output_rmsd_path"],
+                                             self.stage_io_dict["out"]["output_bfactor_path"],
+                                             self.num_structs, self.seed)
+
+            # Run Biobb block
+            yield from run_biobb_step(self)
+
+        # Copy files to host
+        with phase(self, 'copy_to_host', sandbox_copies='out'):
+            self.copy_to_host()
+
+        # remove temporary folder(s)
+        self.remove_tmp_files()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+    def copy_concoord_lib(self, work_dir: str) -> None:
+        """Copy the Concoord parameter files (MARGINS, ATOMS, BONDS) for the selected VdW set to **work_dir**."""
         concoord_lib = os.getenv("CONCOORDLIB")
 
         # MARGINS_li.DAT, MARGINS_oplsaa.DAT, MARGINS_oplsua.DAT, MARGINS_oplsx.DAT, MARGINS_repel.DAT, MARGINS_yamber2.DAT
@@ -137,126 +255,286 @@ class ConcoordDisco(BiobbObject):
         margins_file = str(concoord_lib) + "/MARGINS_" + vdw_values[vdw_index] + ".DAT"
         atoms_file = str(concoord_lib) + "/ATOMS_" + vdw_values[vdw_index] + ".DAT"
         bonds_file = str(concoord_lib) + "/BONDS.DAT"
-        shutil.copy2(margins_file, self.stage_io_dict.get("unique_dir", ""))
-        shutil.copy2(margins_file, self.stage_io_dict.get("unique_dir", "")+"/MARGINS.DAT")
-        shutil.copy2(atoms_file, self.stage_io_dict.get("unique_dir", ""))
-        shutil.copy2(bonds_file, self.stage_io_dict.get("unique_dir", ""))
+        with phase(self, 'copy_concoord_lib'):
+            copy_file(self, margins_file, work_dir)
+            copy_file(self, margins_file, work_dir+"/MARGINS.DAT")
+            copy_file(self, atoms_file, work_dir)
+            copy_file(self, bonds_file, work_dir)
+
+    def create_disco_cmd(self, work_dir: str, pdb_path: str, dat_path: str, traj_path: str, rmsd_path: str,
+                         bfactor_path: str, num_structs: Optional[int], seed: Optional[int],
+                         pdb_traj_path: Optional[str] = None) -> list[str]:
+        """Build the disco command line running in **work_dir** with the given files, number of structures and seed.
+        The trajectory is additionally written in NMR-PDB format to **pdb_traj_path** if it is set."""
+        def relative(file_path: str) -> str:
+            return str(Path(file_path).relative_to(Path(work_dir)))
 
         # Command line
         # (concoord) OROZCO67:biobb_flexdyn hospital$ disco -d biobb_flexdyn/test/reference/flexdyn/dist.dat
         # -p biobb_flexdyn/test/reference/flexdyn/dist.pdb  -op patata.pdb
-        self.cmd = ["cd ", self.stage_io_dict.get('unique_dir', ''), ";", self.binary_path,
-                    #  "-p", str(Path(self.stage_io_dict["in"]["input_pdb_path"]).relative_to(Path.cwd())),
-                    #  "-d", str(Path(self.stage_io_dict["in"]["input_dat_path"]).relative_to(Path.cwd())),
-                    #  "-or", str(Path(self.stage_io_dict["out"]["output_rmsd_path"]).relative_to(Path.cwd())),
-                    #  "-of", str(Path(self.stage_io_dict["out"]["output_bfactor_path"]).relative_to(Path.cwd()))
-                    "-p", str(Path(self.stage_io_dict["in"]["input_pdb_path"]).relative_to(Path(self.stage_io_dict.get('unique_dir', '')))),
-                    "-d", str(Path(self.stage_io_dict["in"]["input_dat_path"]).relative_to(Path(self.stage_io_dict.get('unique_dir', '')))),
-                    "-or", str(Path(self.stage_io_dict["out"]["output_rmsd_path"]).relative_to(Path(self.stage_io_dict.get('unique_dir', '')))),
-                    "-of", str(Path(self.stage_io_dict["out"]["output_bfactor_path"]).relative_to(Path(self.stage_io_dict.get('unique_dir', ''))))
-                    ]
+        cmd = ["cd ", work_dir, ";", self.binary_path,
+               "-p", relative(pdb_path),
+               "-d", relative(dat_path),
+               "-or", relative(rmsd_path),
+               "-of", relative(bfactor_path)
+               ]
 
         # Output structure formats:
-        file_extension = Path(self.stage_io_dict["out"]["output_traj_path"]).suffix
+        file_extension = Path(traj_path).suffix
         if file_extension == ".pdb":
-            self.cmd.append('-on')  # NMR-PDB format (multi-model)
-#            self.cmd.append(str(Path(self.stage_io_dict["out"]["output_traj_path"]).relative_to(Path.cwd())))
-            self.cmd.append(str(Path(self.stage_io_dict["out"]["output_traj_path"]).relative_to(Path(self.stage_io_dict.get('unique_dir', '')))))
+            cmd.append('-on')  # NMR-PDB format (multi-model)
+            cmd.append(relative(traj_path))
         elif file_extension == ".gro":
-            self.cmd.append('-ot')
-#            self.cmd.append(str(Path(self.stage_io_dict["out"]["output_traj_path"]).relative_to(Path.cwd())))
-            self.cmd.append(str(Path(self.stage_io_dict["out"]["output_traj_path"]).relative_to(Path(self.stage_io_dict.get('unique_dir', '')))))
+            cmd.append('-ot')
+            cmd.append(relative(traj_path))
         elif file_extension == ".xtc":
-            self.cmd.append('-ox')
-#            self.cmd.append(str(Path(self.stage_io_dict["out"]["output_traj_path"]).relative_to(Path.cwd())))
-            self.cmd.append(str(Path(self.stage_io_dict["out"]["output_traj_path"]).relative_to(Path(self.stage_io_dict.get('unique_dir', '')))))
+            cmd.append('-ox')
+            cmd.append(relative(traj_path))
         else:
             fu.log("ERROR: output_traj_path ({}) must be a PDB, GRO or XTC formatted file ({})".format(self.io_dict["out"]["output_traj_path"], file_extension), self.out_log, self.global_log)
 
+        if pdb_traj_path and file_extension != ".pdb":
+            cmd.append('-on')
+            cmd.append(relative(pdb_traj_path))
+
         # Properties
-        if self.num_structs:
-            self.cmd.append('-n')
-            self.cmd.append(str(self.num_structs))
+        if num_structs:
+            cmd.append('-n')
+            cmd.append(str(num_structs))
 
         if self.num_iterations:
-            self.cmd.append('-i')
-            self.cmd.append(str(self.num_iterations))
+            cmd.append('-i')
+            cmd.append(str(self.num_iterations))
 
         if self.chirality_check:
-            self.cmd.append('-c')
-            self.cmd.append(str(self.chirality_check))
+            cmd.append('-c')
+            cmd.append(str(self.chirality_check))
 
         if self.bs:
-            self.cmd.append('-bs')
-            self.cmd.append(str(self.bs))
+            cmd.append('-bs')
+            cmd.append(str(self.bs))
 
         if self.cutoff:
-            self.cmd.append('-rc')
-            self.cmd.append(str(self.cutoff))
+            cmd.append('-rc')
+            cmd.append(str(self.cutoff))
 
-        if self.seed:
-            self.cmd.append('-s')
-            self.cmd.append(str(self.seed))
+        if seed:
+            cmd.append('-s')
+            cmd.append(str(seed))
 
         if self.damp:
-            self.cmd.append('-damp')
-            self.cmd.append(str(self.damp))
+            cmd.append('-damp')
+            cmd.append(str(self.damp))
 
         if self.violation:
-            self.cmd.append('-viol')
-            self.cmd.append(str(self.violation))
+            cmd.append('-viol')
+            cmd.append(str(self.violation))
 
         if self.convergence:
-            self.cmd.append('-con')
-            self.cmd.append(str(self.convergence))
+            cmd.append('-con')
+            cmd.append(str(self.convergence))
 
         if self.trials:
-            self.cmd.append('-t')
-            self.cmd.append(str(self.trials))
+            cmd.append('-t')
+            cmd.append(str(self.trials))
 
         if self.dyn:
-            self.cmd.append('-dyn')
-            self.cmd.append(str(self.dyn))
+            cmd.append('-dyn')
+            cmd.append(str(self.dyn))
 
         if self.pairlist_freq:
-            self.cmd.append('-l')
-            self.cmd.append(str(self.pairlist_freq))
+            cmd.append('-l')
+            cmd.append(str(self.pairlist_freq))
 
         if self.scale:
-            self.cmd.append('-is')
-            self.cmd.append(str(self.scale))
+            cmd.append('-is')
+            cmd.append(str(self.scale))
 
         if self.nofit:
-            self.cmd.append('-f')
+            cmd.append('-f')
 
         if self.bump:
-            self.cmd.append('-bump')
+            cmd.append('-bump')
 
         if self.ref:
-            self.cmd.append('-ref')
-
-        # Run Biobb block
-        self.run_biobb()
-
-        # Copy files to host
-        self.copy_to_host()
-
-        # remove temporary folder(s)
-        self.remove_tmp_files()
-
-        self.check_arguments(output_files_created=True, raise_exception=False)
-
-        return self.return_code
+            cmd.append('-ref')
+
+        return cmd
+
+    def run_shards(self) -> Generator[LaunchStep, Any, None]:
+        """Split num_structs across num_workers concurrent disco processes, each one running in its own
+        sandbox with a seed derived from the seed property, and merge their outputs in the main sandbox."""
+        num_structs = self.num_structs or 500
+        shard_sizes = [size for size in split_count(int(num_structs), int(self.num_workers)) if size]
+        shard_seeds = derive_seeds(int(self.seed or 741265), len(shard_sizes))
+        shard_dirs = []
+        for _ in shard_sizes:
+            shard_dirs.append(fu.create_unique_dir(path=str(self.sandbox_path), prefix="sandbox_", out_log=self.out_log))
+            self.tmp_files.append(shard_dirs[-1])
+        yield from self.run_disco_shards(shard_sizes, shard_seeds, shard_dirs)
+
+    def run_chunks(self) -> Generator[LaunchStep, Any, None]:
+        """Generate num_structs in chunks of chunk_size structures, with seeds derived from the seed property,
+        recording the completed chunks in the checkpoint so that a relaunch only generates the missing ones."""
+        num_structs = self.num_structs or 500
+        sizes = split_chunks(int(num_structs), int(self.chunk_size))
+        seeds = derive_seeds(int(self.seed or 741265), len(sizes))
+        key = self.checkpoint_key()
+        checkpoint_dir = self.checkpoint_path or str(Path(self.sandbox_path).joinpath(f"disco_checkpoint_{key[:16]}"))
+        manifest = ChunkManifest(checkpoint_dir, key, sizes, seeds, self.out_log, self.global_log)
+        yield from self.run_disco_shards(sizes, seeds, [str(manifest.chunk_dir(index)) for index in range(len(sizes))], manifest)
+        if not self.return_code:
+            # The run is complete, the checkpoint is no longer needed
+            self.tmp_files.append(checkpoint_dir)
+
+    def checkpoint_key(self) -> str:
+        """Returns the key identifying the chunks of this execution in the checkpoint."""
+        return hash_key(file_hash(self.io_dict['in']['input_pdb_path']), file_hash(self.io_dict['in']['input_dat_path']),
+                        Path(self.io_dict['out']['output_traj_path']).suffix, self.binary_path, self.vdw,
+                        self.num_iterations, self.chirality_check, self.bs, self.nofit, self.violation, self.convergence,
+                        self.trials, self.damp, self.dyn, self.bump, self.pairlist_freq, self.cutoff, self.ref, self.scale)
+
+    def run_disco_shards(self, shard_sizes: list[int], shard_seeds: list[int], shard_dirs: list[str],
+                         manifest: Optional[ChunkManifest] = None) -> Generator[LaunchStep, Any, None]:
+        """Run a disco process for every shard, generating **shard_sizes** structures with **shard_seeds** in
+        **shard_dirs**, and merge their outputs in the main sandbox. With a **manifest**, only the shards not
+        completed yet are run, and every shard is recorded in it as soon as it finishes."""
+        traj_extension = Path(self.stage_io_dict["out"]["output_traj_path"]).suffix
+        pending = manifest.missing() if manifest else list(range(len(shard_sizes)))
+
+        cmds, shards = [], []
+        for shard_index, (shard_size, shard_seed, shard_dir) in enumerate(zip(shard_sizes, shard_seeds, shard_dirs)):
+            shard = {
+                'traj': str(Path(shard_dir).joinpath("disco_trj" + traj_extension)),
+                'pdb_traj': str(Path(shard_dir).joinpath("disco_trj.pdb")),
+                'rmsd': str(Path(shard_dir).joinpath("disco_rmsd.dat")),
+                'bfactor': str(Path(shard_dir).joinpath("disco_bfactor.pdb"))
+            }
+            shards.append(shard)
+            if shard_index not in pending:
+                continue
+            if manifest:
+                # Discard the partial outputs of an interrupted chunk
+                shutil.rmtree(shard_dir, ignore_errors=True)
+                fu.create_dir(shard_dir)
+            with phase(self, 'stage_shards'):
+                copy_file(self, self.stage_io_dict["in"]["input_pdb_path"], shard_dir)
+                copy_file(self, self.stage_io_dict["in"]["input_dat_path"], shard_dir)
+                self.copy_concoord_lib(shard_dir)
+            fu.log(f"Shard {shard_index}: {shard_size} structures, seed {shard_seed}", self.out_log, self.global_log)
+            self.cmd = self.create_disco_cmd(shard_dir,
+                                             str(Path(shard_dir).joinpath(Path(self.stage_io_dict["in"]["input_pdb_path"]).name)),
+                                             str(Path(shard_dir).joinpath(Path(self.stage_io_dict["in"]["input_dat_path"]).name)),
+                                             shard['traj'], shard['rmsd'], shard['bfactor'],
+                                             shard_size, shard_seed, pdb_traj_path=shard['pdb_traj'])
+            self.create_cmd_line()
+            cmds.append(self.cmd)
+
+        stopped = False
+        if is_streaming(self) and not manifest:
+            # The shards run all at once, so the streamed frames come from all of them
+            self.return_code, stopped = yield StreamingCommands(cmds, [shard['pdb_traj'] for shard in shards], sum(shard_sizes))
+        else:
+            if is_streaming(self):
+                fu.log("WARNING: frame streaming is not available when generating the structures in chunks", self.out_log, self.global_log)
+            self.return_code = yield Commands(cmds, int(self.num_workers),
+                                              on_success=(lambda cmd_index: manifest.mark_completed(pending[cmd_index])) if manifest else None)
+        if self.return_code:
+            return
+
+        # Merge the shard outputs
+        with phase(self, 'merge_outputs'):
+            if traj_extension == ".pdb":
+                merge_pdb_models([shard['traj'] for shard in shards], self.stage_io_dict["out"]["output_traj_path"],
+                                 model_remarks=(r'(REMARK\s+Structure\s+)\d',))
+            else:
+                # GRO and XTC trajectories are sequences of self-contained frames (not written yet by stopped shards)
+                concatenate_files([shard['traj'] for shard in shards if not stopped or Path(shard['traj']).exists()],
+                                  self.stage_io_dict["out"]["output_traj_path"])
+            if stopped:
+                self.write_stopped_outputs([shard['pdb_traj'] for shard in shards])
+                return
+            merge_rmsd_files([shard['rmsd'] for shard in shards], self.stage_io_dict["out"]["output_rmsd_path"])
+            write_bfactors([shard['pdb_traj'] for shard in shards], shards[0]['bfactor'], self.stage_io_dict["out"]["output_bfactor_path"])
+
+    def write_stopped_outputs(self, pdb_traj_paths: list[str]) -> None:
+        """Write the RMSD and B-factor outputs of the structures of **pdb_traj_paths** generated before the
+        stop condition was met, as disco only writes them once all the structures have been generated."""
+        write_rmsd_from_models(pdb_traj_paths, self.stage_io_dict["out"]["output_rmsd_path"])
+        write_bfactors(pdb_traj_paths, self.stage_io_dict["in"]["input_pdb_path"], self.stage_io_dict["out"]["output_bfactor_path"])
+        if Path(self.stage_io_dict["out"]["output_traj_path"]).suffix != ".pdb":
+            fu.log(f"WARNING: {self.io_dict['out']['output_traj_path']} may contain more structures than the streamed ones or a partially written last structure", self.out_log, self.global_log)
+
+
+def merge_rmsd_files(rmsd_paths: list[str], output_path: str) -> None:
+    """Concatenate the disco RMSD files **rmsd_paths** renumbering their structures."""
+    num_structs = 0
+    with open(output_path, 'w') as output_file:
+        for rmsd_path in rmsd_paths:
+            with open(rmsd_path) as rmsd_file:
+                for line in rmsd_file:
+                    if not line.strip():
+                        continue
+                    num_structs += 1
+                    output_file.write(f"{num_structs:8d}{line[8:]}")
+
+
+def write_rmsd_from_models(pdb_traj_paths: list[str], output_path: str) -> None:
+    """Write the disco RMSD file of the models of **pdb_traj_paths** from their RMSD remarks."""
+    num_structs = 0
+    with open(output_path, 'w') as output_file:
+        for pdb_traj_path in pdb_traj_paths:
+            with open(pdb_traj_path) as pdb_file:
+                for line in pdb_file:
+                    if line.startswith('REMARK') and 'RMSD to reference structure' in line:
+                        num_structs += 1
+                        output_file.write(f"{num_structs:8d}{float(line.split(':')[1].split()[0]):11.5f}\n")
+
+
+def write_bfactors(pdb_traj_paths: list[str], template_path: str, output_path: str) -> None:
+    """Recompute the disco B-factors (8*pi^2/3 * RMSF^2, in nm^2) over all the models of **pdb_traj_paths**
+    and write them in the B-factor column of a copy of the disco B-factor file **template_path**."""
+    num_models, mean, m2 = 0, None, None
+    for pdb_traj_path in pdb_traj_paths:
+        for coords in iter_pdb_coords(pdb_traj_path):
+            # Welford's online algorithm to keep memory bounded on large ensembles
+            num_models += 1
+            if mean is None:
+                mean, m2 = np.zeros_like(coords), np.zeros(len(coords))
+            delta = coords - mean
+            mean += delta / num_models
+            m2 += (delta * (coords - mean)).sum(1)
+    bfactors = 8 * np.pi**2 / 3 * (m2 / max(num_models, 1)) / 100
+
+    atom_index = 0
+    with open(template_path) as template_file, open(output_path, 'w') as output_file:
+        for line in template_file:
+            if line.startswith(('ATOM', 'HETATM')):
+                line = f"{line[:60]}{bfactors[atom_index]:6.2f}{line[66:]}"
+                atom_index += 1
+            output_file.write(line)
 
 
 def concoord_disco(input_pdb_path: str, input_dat_path: str,
                    output_traj_path: str, output_rmsd_path: str, output_bfactor_path: str,
-                   properties: Optional[dict] = None, **kwargs) -> int:
+                   properties: Optional[dict] = None,
+                   frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+                   stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> int:
     """Create :class:`ConcoordDisco <flexdyn.concoord_disco.ConcoordDisco>`flexdyn.concoord_disco.ConcoordDisco class and
     execute :meth:`launch() <flexdyn.concoord_disco.ConcoordDisco.launch>` method"""
     return ConcoordDisco(**dict(locals())).launch()
 
 
+async def concoord_disco_async(input_pdb_path: str, input_dat_path: str,
+                               output_traj_path: str, output_rmsd_path: str, output_bfactor_path: str,
+                               properties: Optional[dict] = None,
+                               frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+                               stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> int:
+    """Create :class:`ConcoordDisco <flexdyn.concoord_disco.ConcoordDisco>`flexdyn.concoord_disco.ConcoordDisco class and
+    await :meth:`launch_async() <flexdyn.concoord_disco.ConcoordDisco.launch_async>` method"""
+    return await ConcoordDisco(**dict(locals())).launch_async()
+
+
 concoord_disco.__doc__ = ConcoordDisco.__doc__
 main = ConcoordDisco.get_main(concoord_disco, "Structure generation based on a set of geometric constraints extracted with the Concoord Dist tool.")
 
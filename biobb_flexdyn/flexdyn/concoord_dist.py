@@ -3,11 +3,14 @@
 """Module containing the concoord_dist class and the command line interface."""
 from typing import Optional
 import os
-import shutil
 from pathlib import Path
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import result_cache
+from biobb_flexdyn.flexdyn.common import (LaunchSteps, launchlogger_async, run_biobb_step, run_launch_steps,
+                                          run_launch_steps_async)
+from biobb_flexdyn.flexdyn.instrumentation import copy_file, instrument_launch, instrument_launch_async, phase
 
 
 class ConcoordDist(BiobbObject):
@@ -31,6 +34,11 @@ class ConcoordDist(BiobbObject):
             * **min_distances** (*int*) - (50) Minimum number of distances to be defined for each atom
             * **damp** (*float*) - (1.0) Multiply each distance margin by this value
             * **fixed_atoms** (*bool*) - (False) Interpret zero occupancy as atoms to keep fixed
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -89,14 +97,37 @@ class ConcoordDist(BiobbObject):
 
         self.vdw = properties.get('vdw', 1)
         self.bond_angle = properties.get('bond_angle', 1)
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+
+        self.instrumentation_path = properties.get('instrumentation_path')
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    # Environment variables changing the outputs, part of the result cache key
+    CACHE_ENV_VARS = ('CONCOORDLIB',)
+
     @launchlogger
+    @instrument_launch
+    @result_cache
     def launch(self):
         """Launches the execution of the FlexDyn ConcoordDist module."""
+        return run_launch_steps(self, self.launch_steps())
+
+    @launchlogger_async
+    @instrument_launch_async
+    @result_cache
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn ConcoordDist module as a coroutine, running the dist process as an asyncio
+        subprocess that is terminated, and its temporary files removed, if the coroutine is cancelled."""
+        return await run_launch_steps_async(self, self.launch_steps())
+
+    def launch_steps(self) -> LaunchSteps:
+        """Execution of the FlexDyn ConcoordDist module, yielding the commands to be run by :meth:`launch` or :meth:`launch_async`."""
 
         # Set input params
         self.io_dict['in']['stdin_file_path'] = fu.create_stdin_file(f'{self.vdw}\n{self.bond_angle}\n')
@@ -104,13 +135,17 @@ class ConcoordDist(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
-        self.stage_files()
+
+        with phase(self, 'stage_files', sandbox_copies='in'):
+            self.stage_files()
+        self.tmp_files.append(self.io_dict['in'].get("stdin_file_path", ""))
 
         # Copy auxiliary file (HBONDS) to the working dir
         concoord_lib = os.getenv("CONCOORDLIB")
 
         hbonds_file = str(concoord_lib) + "/HBONDS.DAT"
-        shutil.copy2(hbonds_file, self.stage_io_dict.get("unique_dir", ""))
+        with phase(self, 'copy_concoord_lib'):
+            copy_file(self, hbonds_file, self.stage_io_dict.get("unique_dir", ""))
 
         # Command line
         # (concoord) OROZCO67:biobb_flexdyn hospital$ dist -p biobb_flexdyn/test/data/flexdyn/structure.pdb
@@ -183,13 +218,13 @@ class ConcoordDist(BiobbObject):
         self.cmd.append(str(Path(self.stage_io_dict["in"]["stdin_file_path"]).relative_to(Path(self.stage_io_dict.get('unique_dir', '')))))
 
         # Run Biobb block
-        self.run_biobb()
+        yield from run_biobb_step(self)
 
         # Copy files to host
-        self.copy_to_host()
+        with phase(self, 'copy_to_host', sandbox_copies='out'):
+            self.copy_to_host()
 
         # remove temporary folder(s)
-        self.tmp_files.append(self.io_dict['in'].get("stdin_file_path", ""))
         self.remove_tmp_files()
 
         self.check_arguments(output_files_created=True, raise_exception=False)
@@ -205,6 +240,14 @@ def concoord_dist(input_structure_path: str,
     return ConcoordDist(**dict(locals())).launch()
 
 
+async def concoord_dist_async(input_structure_path: str,
+                              output_pdb_path: str, output_gro_path: str, output_dat_path: str,
+                              properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ConcoordDist <flexdyn.concoord_dist.ConcoordDist>`flexdyn.concoord_dist.ConcoordDist class and
+    await :meth:`launch_async() <flexdyn.concoord_dist.ConcoordDist.launch_async>` method"""
+    return await ConcoordDist(**dict(locals())).launch_async()
+
+
 concoord_dist.__doc__ = ConcoordDist.__doc__
 main = ConcoordDist.get_main(concoord_dist, "Structure interpretation and bond definitions from a PDB/GRO file.")
 
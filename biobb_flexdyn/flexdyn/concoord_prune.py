@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""Module containing the concoord_prune class and the command line interface."""
+import asyncio
+from typing import Optional
+import json
+import numpy as np
+from biobb_common.tools import file_utils as fu
+from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import result_cache
+from biobb_flexdyn.flexdyn.instrumentation import instrument_launch, phase
+from biobb_flexdyn.flexdyn.dist_dat import DistDat
+
+
+class ConcoordPrune(BiobbObject):
+    """
+    | biobb_flexdyn ConcoordPrune
+    | Constraint pruning of a Concoord Dist file.
+    | Thin the set of distance constraints extracted with the Concoord Dist tool before sampling with Concoord Disco, whose runtime scales with the number of constraints. Non-bonded pairs can be filtered by a distance band and capped per atom, and pairs between atoms of a fixed region can be dropped.
+
+    Args:
+        input_dat_path (str): Input dat with structure interpretation and bond definitions. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/dist.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330).
+        output_dat_path (str): Output dat with the pruned constraints. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/prune_dist.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330).
+        input_pdb_path (str) (Optional): Input structure file generated by Concoord Dist, required by the fixed_residues and fixed_atoms properties. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/dist.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        output_report_path (str) (Optional): Output JSON file with the number of constraints per section before and after the pruning and the projected disco speedup. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/prune_report.json>`_. Accepted formats: json (edam:format_3464).
+        properties (dict - Python dictionary object containing the tool parameters, not input/output files):
+            * **band_sections** (*list*) - (["non-bonded pairs", "Other close pairs", "other restrictions"]) Titles of the dist.dat sections with non-bonded pairs, filtered by the distance band and the per-atom cap.
+            * **band_min_distance** (*float*) - (0.0) Minimum reference distance (Å) of the non-bonded pairs kept.
+            * **band_max_distance** (*float*) - (None) Maximum reference distance (Å) of the non-bonded pairs kept. If not set, there is no upper limit.
+            * **max_distances_per_atom** (*int*) - (0) Maximum number of non-bonded pairs per atom. A pair is kept if it is among the shortest max_distances_per_atom pairs of both of its atoms. If 0, there is no limit.
+            * **fixed_residues** (*str*) - (None) Comma separated residue numbers or ranges (ie: "10-50,72") of a region kept fixed during the sampling. The constraints between two atoms of the region are removed.
+            * **fixed_atoms** (*bool*) - (False) Add the atoms with zero occupancy in input_pdb_path to the fixed region, as the fixed_atoms property of Concoord Dist.
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_flexdyn.flexdyn.concoord_prune import concoord_prune
+            prop = {
+                'band_max_distance' : 10.0,
+                'max_distances_per_atom' : 20
+            }
+            concoord_prune(     input_dat_path='/path/to/dist.dat',
+                                output_dat_path='/path/to/prune_dist.dat',
+                                output_report_path='/path/to/prune_report.json',
+                                properties=prop)
+
+    Info:
+        * wrapped_software:
+            * name: In house
+            * license: Apache-2.0
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    def __init__(self, input_dat_path: str, output_dat_path: str,
+                 input_pdb_path: Optional[str] = None, output_report_path: Optional[str] = None,
+                 properties: Optional[dict] = None, **kwargs) -> None:
+
+        properties = properties or {}
+
+        # Call parent class constructor
+        super().__init__(properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            'in': {'input_dat_path': input_dat_path,
+                   'input_pdb_path': input_pdb_path},
+            'out': {'output_dat_path': output_dat_path,
+                    'output_report_path': output_report_path}
+        }
+
+        # Properties specific for BB
+        self.properties = properties
+        self.band_sections = properties.get('band_sections', ["non-bonded pairs", "Other close pairs", "other restrictions"])
+        self.band_min_distance = properties.get('band_min_distance', 0.0)
+        self.band_max_distance = properties.get('band_max_distance')
+        self.max_distances_per_atom = properties.get('max_distances_per_atom', 0)
+        self.fixed_residues = properties.get('fixed_residues')
+        self.fixed_atoms = properties.get('fixed_atoms', False)
+
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
+
+        # Check the properties
+        self.check_properties(properties)
+        self.check_arguments()
+
+    @launchlogger
+    @instrument_launch
+    @result_cache
+    def launch(self):
+        """Launches the execution of the FlexDyn ConcoordPrune module."""
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+        with phase(self, 'stage_files', sandbox_copies='in'):
+            self.stage_files()
+
+        dist_dat = DistDat.read(self.stage_io_dict["in"]["input_dat_path"])
+        counts_before = {title: len(section) for title, section in dist_dat.sections.items()}
+
+        fixed = None
+        if self.fixed_residues or self.fixed_atoms:
+            if not self.stage_io_dict["in"].get("input_pdb_path"):
+                fu.log("ERROR: input_pdb_path is required by the fixed_residues and fixed_atoms properties", self.out_log, self.global_log)
+                self.return_code = 1
+                self.remove_tmp_files()
+                return self.return_code
+            fixed = fixed_atoms_mask(self.stage_io_dict["in"]["input_pdb_path"], self.fixed_residues, self.fixed_atoms)
+            fu.log(f"Fixed region: {int(fixed.sum())} atoms", self.out_log, self.global_log)
+
+        for title, section in dist_dat.sections.items():
+            keep = np.ones(len(section), dtype=bool)
+            if fixed is not None:
+                keep &= ~(fixed[section['i'] - 1] & fixed[section['j'] - 1])
+            if title in self.band_sections:
+                keep &= section['distance'] >= self.band_min_distance
+                if self.band_max_distance is not None:
+                    keep &= section['distance'] <= self.band_max_distance
+            dist_dat.sections[title] = section[keep]
+
+        band_titles = [title for title in dist_dat.sections if title in self.band_sections]
+        if self.max_distances_per_atom and band_titles:
+            # The cap is applied over the non-bonded pairs of all the band sections together
+            band_sections = [dist_dat.sections[title] for title in band_titles]
+            keep = cap_pairs_per_atom(np.concatenate([section['i'] for section in band_sections]),
+                                      np.concatenate([section['j'] for section in band_sections]),
+                                      np.concatenate([section['distance'] for section in band_sections]),
+                                      self.max_distances_per_atom)
+            start = 0
+            for title, section in zip(band_titles, band_sections):
+                dist_dat.sections[title] = section[keep[start:start + len(section)]]
+                start += len(section)
+
+        dist_dat.write(self.stage_io_dict["out"]["output_dat_path"])
+
+        counts_after = {title: len(section) for title, section in dist_dat.sections.items()}
+        before, after = sum(counts_before.values()), sum(counts_after.values())
+        # Disco runtime grows linearly with the number of distance constraints
+        speedup = before / after if after else float('inf')
+        fu.log(f"Constraints before pruning: {before}, after pruning: {after} (projected disco speedup: {speedup:.2f}x)", self.out_log, self.global_log)
+        for title in counts_before:
+            if counts_before[title] != counts_after[title]:
+                fu.log(f"  {title}: {counts_before[title]} --> {counts_after[title]}", self.out_log, self.global_log)
+
+        if self.stage_io_dict["out"].get("output_report_path"):
+            report = {'constraints_before': before, 'constraints_after': after, 'projected_speedup': round(speedup, 4),
+                      'sections': {title: {'before': counts_before[title], 'after': counts_after[title]} for title in counts_before}}
+            with open(self.stage_io_dict["out"]["output_report_path"], 'w') as report_file:
+                json.dump(report, report_file, indent=4)
+
+        # Copy files to host
+        with phase(self, 'copy_to_host', sandbox_copies='out'):
+            self.copy_to_host()
+
+        # remove temporary folder(s)
+        self.remove_tmp_files()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn ConcoordPrune module as a coroutine. As it runs no external process, the
+        execution is run in a worker thread of the default executor of the event loop and is not interrupted if cancelled."""
+        return await asyncio.to_thread(self.launch)
+
+
+def fixed_atoms_mask(pdb_path: str, fixed_residues: Optional[str] = None, zero_occupancy: bool = False) -> np.ndarray:
+    """Return the boolean mask of the atoms of the **pdb_path** structure in the **fixed_residues**
+    ranges (ie: "10-50,72") or, if **zero_occupancy**, with zero occupancy."""
+    residues = []
+    occupancies = []
+    with open(pdb_path) as pdb_file:
+        for line in pdb_file:
+            if line.startswith(('ATOM', 'HETATM')):
+                residues.append(int(line[22:26]))
+                occupancies.append(float(line[54:60].strip() or 1.0))
+            elif line.startswith('ENDMDL'):
+                break
+    residues_array = np.array(residues)
+    mask = np.zeros(len(residues_array), dtype=bool)
+    for residue_range in (fixed_residues or '').replace(' ', '').split(','):
+        if residue_range:
+            first, _, last = residue_range.partition('-')
+            mask |= (residues_array >= int(first)) & (residues_array <= int(last or first))
+    if zero_occupancy:
+        mask |= np.array(occupancies) == 0
+    return mask
+
+
+def cap_pairs_per_atom(atoms_i: np.ndarray, atoms_j: np.ndarray, distances: np.ndarray, cap: int) -> np.ndarray:
+    """Return the boolean mask of the pairs (**atoms_i**, **atoms_j**) kept when every atom keeps at most
+    **cap** pairs: a pair is kept if it is among the **cap** shortest ones of both of its atoms."""
+    num_pairs = len(atoms_i)
+    atoms = np.concatenate((atoms_i, atoms_j))
+    pair_index = np.tile(np.arange(num_pairs), 2)
+    # Rank of every pair within the pairs of each of its atoms, sorted by distance
+    order = np.lexsort((np.tile(distances, 2), atoms))
+    sorted_atoms = atoms[order]
+    group_start = np.r_[0, np.flatnonzero(sorted_atoms[1:] != sorted_atoms[:-1]) + 1]
+    ranks = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+    return np.bincount(pair_index[order[ranks < cap]], minlength=num_pairs) == 2
+
+
+def concoord_prune(input_dat_path: str, output_dat_path: str,
+                   input_pdb_path: Optional[str] = None, output_report_path: Optional[str] = None,
+                   properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ConcoordPrune <flexdyn.concoord_prune.ConcoordPrune>`flexdyn.concoord_prune.ConcoordPrune class and
+    execute :meth:`launch() <flexdyn.concoord_prune.ConcoordPrune.launch>` method"""
+    return ConcoordPrune(**dict(locals())).launch()
+
+
+async def concoord_prune_async(input_dat_path: str, output_dat_path: str,
+                               input_pdb_path: Optional[str] = None, output_report_path: Optional[str] = None,
+                               properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ConcoordPrune <flexdyn.concoord_prune.ConcoordPrune>`flexdyn.concoord_prune.ConcoordPrune class and
+    await :meth:`launch_async() <flexdyn.concoord_prune.ConcoordPrune.launch_async>` method"""
+    return await ConcoordPrune(**dict(locals())).launch_async()
+
+
+concoord_prune.__doc__ = ConcoordPrune.__doc__
+main = ConcoordPrune.get_main(concoord_prune, "Prune the distance constraints of a Concoord Dist file before sampling with Concoord Disco.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""Module containing the concoord_violations class and the command line interface."""
+import asyncio
+from typing import Optional
+import numpy as np
+from biobb_common.tools import file_utils as fu
+from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import result_cache
+from biobb_flexdyn.flexdyn.common import iter_coords_chunks
+from biobb_flexdyn.flexdyn.instrumentation import instrument_launch, phase
+from biobb_flexdyn.flexdyn.dist_dat import DistDat
+
+# Frame-pair distances computed at a time: the (frames, pairs, 3) temporaries take 24 bytes per element
+TILE_ELEMENTS = 1 << 20
+
+
+class ConcoordViolations(BiobbObject):
+    """
+    | biobb_flexdyn ConcoordViolations
+    | Constraint violations of a Concoord ensemble.
+    | Score every structure of a Concoord Disco ensemble against the distance bounds of the Concoord Dist constraints, computing the per-frame total violation, the worst pairs and the per-atom violation counts.
+
+    Args:
+        input_traj_path (str): Input multi-model ensemble file, with the atoms numbered as in the dist.dat file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/disco_trj.pdb>`_. Accepted formats: pdb (edam:format_1476), gro (edam:format_2033).
+        input_dat_path (str): Input dat with structure interpretation and bond definitions. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/dist.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330).
+        output_frames_path (str): Output CSV file with the total violation (Å), the number of violated pairs and the maximum violation (Å) of every frame. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/violations_frames.csv>`_. Accepted formats: csv (edam:format_3752).
+        output_pairs_path (str) (Optional): Output CSV file with the pairs with the highest violation summed over all the frames. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/violations_pairs.csv>`_. Accepted formats: csv (edam:format_3752).
+        output_atoms_path (str) (Optional): Output CSV file with the number of violations and the total violation (Å) of every atom. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/violations_atoms.csv>`_. Accepted formats: csv (edam:format_3752).
+        properties (dict - Python dictionary object containing the tool parameters, not input/output files):
+            * **tolerance** (*float*) - (0.0) Distance (Å) beyond the bounds not considered a violation, to absorb the rounding of the ensemble coordinates.
+            * **num_worst_pairs** (*int*) - (20) Number of pairs written to the output_pairs_path file.
+            * **chunk_size** (*int*) - (100) Number of frames read at a time. The frames are scored in tiles of constraints, so the memory used does not grow with the ensemble size nor the number of constraints.
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_flexdyn.flexdyn.concoord_violations import concoord_violations
+            prop = {
+                'tolerance' : 0.01,
+                'num_worst_pairs' : 10
+            }
+            concoord_violations(    input_traj_path='/path/to/disco_out_traj.pdb',
+                                    input_dat_path='/path/to/dist_input.dat',
+                                    output_frames_path='/path/to/violations_frames.csv',
+                                    output_pairs_path='/path/to/violations_pairs.csv',
+                                    output_atoms_path='/path/to/violations_atoms.csv',
+                                    properties=prop)
+
+    Info:
+        * wrapped_software:
+            * name: In house
+            * license: Apache-2.0
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    def __init__(self, input_traj_path: str, input_dat_path: str, output_frames_path: str,
+                 output_pairs_path: Optional[str] = None, output_atoms_path: Optional[str] = None,
+                 properties: Optional[dict] = None, **kwargs) -> None:
+
+        properties = properties or {}
+
+        # Call parent class constructor
+        super().__init__(properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            'in': {'input_traj_path': input_traj_path,
+                   'input_dat_path': input_dat_path},
+            'out': {'output_frames_path': output_frames_path,
+                    'output_pairs_path': output_pairs_path,
+                    'output_atoms_path': output_atoms_path}
+        }
+
+        # Properties specific for BB
+        self.properties = properties
+        self.tolerance = properties.get('tolerance', 0.0)
+        self.num_worst_pairs = properties.get('num_worst_pairs', 20)
+        self.chunk_size = properties.get('chunk_size', 100)
+
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
+
+        # Check the properties
+        self.check_properties(properties)
+        self.check_arguments()
+
+    @launchlogger
+    @instrument_launch
+    @result_cache
+    def launch(self):
+        """Launches the execution of the FlexDyn ConcoordViolations module."""
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+        with phase(self, 'stage_files', sandbox_copies='in'):
+            self.stage_files()
+
+        pairs = DistDat.read(self.stage_io_dict["in"]["input_dat_path"]).pairs()
+        fu.log(f"Scoring {len(pairs)} distance constraints", self.out_log, self.global_log)
+
+        frames = []
+        pair_counts = np.zeros(len(pairs), dtype=np.int64)
+        pair_sums = np.zeros(len(pairs))
+        pair_max = np.zeros(len(pairs))
+        for coords in iter_coords_chunks(self.stage_io_dict["in"]["input_traj_path"], self.chunk_size):
+            if coords.shape[1] < max(pairs['i'].max(initial=0), pairs['j'].max(initial=0)):
+                fu.log(f"ERROR: the ensemble has {coords.shape[1]} atoms, less than the atoms referenced in {self.io_dict['in']['input_dat_path']}", self.out_log, self.global_log)
+                self.return_code = 1
+                self.remove_tmp_files()
+                return self.return_code
+            frame_stats = np.zeros((len(coords), 3))
+            pair_tile = max(1, TILE_ELEMENTS // max(len(coords), 1))
+            for start in range(0, len(pairs), pair_tile):
+                tile = slice(start, start + pair_tile)
+                violations = calc_violations(coords, pairs[tile], self.tolerance)
+                violated = violations > 0
+                frame_stats[:, 0] += violations.sum(axis=1)
+                frame_stats[:, 1] += violated.sum(axis=1)
+                frame_stats[:, 2] = np.maximum(frame_stats[:, 2], violations.max(axis=1, initial=0))
+                pair_counts[tile] += violated.sum(axis=0)
+                pair_sums[tile] += violations.sum(axis=0)
+                pair_max[tile] = np.maximum(pair_max[tile], violations.max(axis=0, initial=0))
+            frames.append(frame_stats)
+
+        frames_array = np.concatenate(frames) if frames else np.empty((0, 3))
+        fu.log(f"Scored {len(frames_array)} frames, mean total violation: {frames_array[:, 0].mean() if len(frames_array) else 0:.4f} Å", self.out_log, self.global_log)
+        np.savetxt(self.stage_io_dict["out"]["output_frames_path"],
+                   np.column_stack((np.arange(1, len(frames_array) + 1), frames_array)),
+                   fmt=['%d', '%.4f', '%d', '%.4f'], delimiter=',', comments='',
+                   header='frame,total_violation,violated_pairs,max_violation')
+
+        if self.stage_io_dict["out"].get("output_pairs_path"):
+            worst = np.argsort(-pair_sums, kind='stable')[:self.num_worst_pairs]
+            worst = worst[pair_sums[worst] > 0]
+            np.savetxt(self.stage_io_dict["out"]["output_pairs_path"],
+                       np.column_stack((pairs['i'][worst], pairs['j'][worst], pairs['lower'][worst], pairs['upper'][worst],
+                                        pair_counts[worst], pair_sums[worst], pair_max[worst])),
+                       fmt=['%d', '%d', '%.4f', '%.4f', '%d', '%.4f', '%.4f'], delimiter=',', comments='',
+                       header='atom_i,atom_j,lower,upper,violated_frames,total_violation,max_violation')
+
+        if self.stage_io_dict["out"].get("output_atoms_path"):
+            num_atoms = max(pairs['i'].max(initial=0), pairs['j'].max(initial=0))
+            atom_counts = (np.bincount(pairs['i'] - 1, weights=pair_counts, minlength=num_atoms)
+                           + np.bincount(pairs['j'] - 1, weights=pair_counts, minlength=num_atoms))
+            atom_sums = (np.bincount(pairs['i'] - 1, weights=pair_sums, minlength=num_atoms)
+                         + np.bincount(pairs['j'] - 1, weights=pair_sums, minlength=num_atoms))
+            np.savetxt(self.stage_io_dict["out"]["output_atoms_path"],
+                       np.column_stack((np.arange(1, num_atoms + 1), atom_counts, atom_sums)),
+                       fmt=['%d', '%d', '%.4f'], delimiter=',', comments='',
+                       header='atom,violations,total_violation')
+
+        # Copy files to host
+        with phase(self, 'copy_to_host', sandbox_copies='out'):
+            self.copy_to_host()
+
+        # remove temporary folder(s)
+        self.remove_tmp_files()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn ConcoordViolations module as a coroutine. As it runs no external process, the
+        execution is run in a worker thread of the default executor of the event loop and is not interrupted if cancelled."""
+        return await asyncio.to_thread(self.launch)
+
+
+def calc_violations(coords: np.ndarray, pairs: np.ndarray, tolerance: float = 0.0) -> np.ndarray:
+    """Return the (n_frames, n_pairs) distance (Å) beyond the lower and upper bounds of the restricted
+    **pairs** (structured array with 1-based atom numbers *i* and *j*, *lower* and *upper*) in the
+    (n_frames, n_atoms, 3) **coords**. Violations not larger than **tolerance** are set to 0.
+
+    The temporaries take 24 bytes per frame and pair, pass a slice of the pairs to bound them (see TILE_ELEMENTS)."""
+    differences = coords[:, pairs['i'] - 1]
+    differences -= coords[:, pairs['j'] - 1]
+    distances = np.sqrt(np.einsum('fpk,fpk->fp', differences, differences))
+    violations = np.maximum(pairs['lower'] - distances, 0) + np.maximum(distances - pairs['upper'], 0)
+    violations[violations <= tolerance] = 0
+    return violations
+
+
+def concoord_violations(input_traj_path: str, input_dat_path: str, output_frames_path: str,
+                        output_pairs_path: Optional[str] = None, output_atoms_path: Optional[str] = None,
+                        properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ConcoordViolations <flexdyn.concoord_violations.ConcoordViolations>`flexdyn.concoord_violations.ConcoordViolations class and
+    execute :meth:`launch() <flexdyn.concoord_violations.ConcoordViolations.launch>` method"""
+    return ConcoordViolations(**dict(locals())).launch()
+
+
+async def concoord_violations_async(input_traj_path: str, input_dat_path: str, output_frames_path: str,
+                                    output_pairs_path: Optional[str] = None, output_atoms_path: Optional[str] = None,
+                                    properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ConcoordViolations <flexdyn.concoord_violations.ConcoordViolations>`flexdyn.concoord_violations.ConcoordViolations class and
+    await :meth:`launch_async() <flexdyn.concoord_violations.ConcoordViolations.launch_async>` method"""
+    return await ConcoordViolations(**dict(locals())).launch_async()
+
+
+concoord_violations.__doc__ = ConcoordViolations.__doc__
+main = ConcoordViolations.get_main(concoord_violations, "Score a Concoord ensemble against the distance bounds of the Concoord Dist constraints.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Module containing the DistDat class to read and write Concoord dist.dat constraint files."""
+from pathlib import Path
+from typing import Optional, Union
+import numpy as np
+from biobb_flexdyn.flexdyn.common import memmap_npz_member
+
+# Fixed-width columns of the dist.dat restricted pairs: (name, type, text width)
+PAIR_FIELDS = (('i', np.int32, 8), ('j', np.int32, 8),
+               ('distance', np.float64, 10), ('lower', np.float64, 10), ('upper', np.float64, 10))
+# 1-3 restricted pairs add the central atom of the angle, the angle value and its margin
+ANGLE_FIELDS = PAIR_FIELDS + (('k', np.int32, 6), ('angle', np.float64, 10), ('angle_margin', np.float64, 10))
+
+PAIR_DTYPE = np.dtype([(name, dtype) for name, dtype, _ in PAIR_FIELDS])
+ANGLE_DTYPE = np.dtype([(name, dtype) for name, dtype, _ in ANGLE_FIELDS])
+# Decimal digits of the distance and angle columns
+DECIMALS = 4
+_NUMBER_CHARACTERS = np.zeros(256, dtype=bool)
+_NUMBER_CHARACTERS[[ord(character) for character in ' -0123456789']] = True
+
+
+def _fields(dtype: np.dtype) -> tuple:
+    return ANGLE_FIELDS if len(dtype.names or ()) == len(ANGLE_FIELDS) else PAIR_FIELDS
+
+
+def _line_format(dtype: np.dtype) -> str:
+    return ''.join(f'%{width}d' if np.dtype(field_type).kind == 'i' else f'%{width}.{DECIMALS}f'
+                   for _, field_type, width in _fields(dtype)) + '\n'
+
+
+class DistDat:
+    """
+    | biobb_flexdyn DistDat
+    | Concoord dist.dat constraint file as NumPy structured arrays.
+    | The restricted pairs of every ``#`` section of the file are stored in a structured array with fields *i*, *j* (1-based atom numbers), *distance*, *lower* and *upper* (Angstroms). 1-3 restricted pairs have the extra fields *k*, *angle* and *angle_margin*. The text written back is byte-identical to the parsed file, and the arrays can be saved to a binary npz sidecar that is memory-mapped when loaded.
+
+    Args:
+        header (list): Comment lines (without the trailing new line) at the top of the file, before the first section.
+        sections (dict): Section title (without the leading ``#``) --> structured array of restricted pairs.
+        trailing_newline (bool): (True) Whether the last line of the file ends with a new line.
+
+    Examples:
+        This is a use example of how to use the class from Python::
+
+            from biobb_flexdyn.flexdyn.dist_dat import DistDat
+            dist_dat = DistDat.read('/path/to/dist.dat')
+            pairs = dist_dat.sections['1-2 restricted pairs']
+            dist_dat.save('/path/to/dist.npz')
+            dist_dat = DistDat.load('/path/to/dist.npz')
+            dist_dat.write('/path/to/dist.dat')
+    """
+
+    def __init__(self, header: Optional[list[str]] = None, sections: Optional[dict[str, np.ndarray]] = None,
+                 trailing_newline: bool = True) -> None:
+        self.header = list(header or [])
+        self.sections = dict(sections or {})
+        self.trailing_newline = trailing_newline
+
+    def __len__(self) -> int:
+        return sum(len(section) for section in self.sections.values())
+
+    def pairs(self) -> np.ndarray:
+        """Returns the restricted pairs of all the sections in a single structured array of PAIR_DTYPE."""
+        return np.concatenate([section[list(PAIR_DTYPE.names)].astype(PAIR_DTYPE) for section in self.sections.values()]
+                              or [np.empty(0, dtype=PAIR_DTYPE)])
+
+    @classmethod
+    def read(cls, dat_path: Union[str, Path]) -> 'DistDat':
+        """Parses the dist.dat text file **dat_path**."""
+        data = Path(dat_path).read_bytes()
+        trailing_newline = data.endswith(b'\n')
+        if not trailing_newline:
+            data += b'\n'
+
+        header: list[str] = []
+        sections: dict[str, np.ndarray] = {}
+        title = None
+        header_open = False
+        position = 0
+        while position < len(data):
+            if data[position:position + 1] == b'#':
+                end = data.index(b'\n', position)
+                line = data[position + 1:end].decode()
+                if not sections and (header_open or not header and line.startswith('-')):
+                    # File header: the comment block delimited by dashed lines
+                    header.append('#' + line)
+                    header_open = len(header) == 1 or not line.startswith('-')
+                else:
+                    title = line
+                    sections[title] = np.empty(0, dtype=PAIR_DTYPE)
+                position = end + 1
+                continue
+            # Data block: every line up to the next comment line
+            end = data.find(b'\n#', position)
+            end = len(data) if end == -1 else end + 1
+            if title is None:
+                raise ValueError(f"{dat_path}: restricted pairs found before the first section title")
+            sections[title] = _parse_block(data[position:end])
+            position = end
+        return cls(header, sections, trailing_newline)
+
+    def write(self, dat_path: Union[str, Path]) -> None:
+        """Writes the dist.dat text file **dat_path** in the fixed-column format read by disco."""
+        with open(dat_path, 'wb') as dat_file:
+            dat_file.write(''.join(line + '\n' for line in self.header).encode())
+            for title, section in self.sections.items():
+                dat_file.write(f'#{title}\n'.encode())
+                if len(section):
+                    dat_file.write(_format_block(section))
+        if not self.trailing_newline:
+            with open(dat_path, 'rb+') as dat_file:
+                dat_file.seek(-1, 2)
+                dat_file.truncate()
+
+    def save(self, npz_path: Union[str, Path]) -> None:
+        """Saves the arrays to the uncompressed npz sidecar **npz_path**, that can be memory-mapped by :meth:`load`."""
+        arrays = {f'section_{index:04d}': section for index, section in enumerate(self.sections.values())}
+        np.savez(npz_path, header=np.array(self.header, dtype=str), titles=np.array(list(self.sections), dtype=str),
+                 trailing_newline=np.array(self.trailing_newline), **arrays)
+
+    @classmethod
+    def load(cls, npz_path: Union[str, Path], mmap_mode: Optional[str] = 'r') -> 'DistDat':
+        """Loads the npz sidecar **npz_path** written by :meth:`save`, memory-mapping the section arrays
+        (read-only by default) unless **mmap_mode** is None."""
+        with np.load(npz_path) as npz:
+            header = npz['header'].tolist()
+            titles = npz['titles'].tolist()
+            trailing_newline = bool(npz['trailing_newline'])
+            if mmap_mode is None:
+                sections = [npz[f'section_{index:04d}'] for index in range(len(titles))]
+        if mmap_mode is not None:
+            sections = [memmap_npz_member(npz_path, f'section_{index:04d}.npy', mmap_mode) for index in range(len(titles))]
+        return cls(header, dict(zip(titles, sections)), trailing_newline)
+
+
+def _parse_block(block: bytes) -> np.ndarray:
+    """Parses a block of restricted pairs lines, all with the same number of columns."""
+    first_line = block[:block.index(b'\n')]
+    dtype = ANGLE_DTYPE if len(first_line.split()) == len(ANGLE_FIELDS) else PAIR_DTYPE
+    fields = _fields(dtype)
+    line_length = sum(width for _, _, width in fields) + 1
+    raw = np.frombuffer(block, dtype=np.uint8)
+    section = np.empty(len(raw) // line_length, dtype=dtype)
+    if len(raw) % line_length == 0 and np.all(raw[line_length - 1::line_length] == ord('\n')):
+        # Fixed-width lines: decode the digits of every column in bulk
+        lines = raw.reshape(-1, line_length)
+        offset = 0
+        for name, field_type, width in fields:
+            values = _decode_column(lines[:, offset:offset + width], 0 if np.dtype(field_type).kind == 'i' else DECIMALS)
+            if values is None:
+                break
+            section[name] = values
+            offset += width
+        else:
+            return section
+    # Overflowing columns: whitespace separated parsing
+    values = np.array(block.split(), dtype=np.float64).reshape(-1, len(fields))
+    section = np.empty(len(values), dtype=dtype)
+    for column, (name, _, _) in enumerate(fields):
+        section[name] = values[:, column]
+    return section
+
+
+def _format_block(section: np.ndarray) -> bytes:
+    """Formats the restricted pairs of **section** as fixed-width lines."""
+    fields = _fields(section.dtype)
+    lines = np.full((len(section), sum(width for _, _, width in fields) + 1), ord(' '), dtype=np.uint8)
+    lines[:, -1] = ord('\n')
+    offset = 0
+    for name, field_type, width in fields:
+        column = _encode_column(section[name], width, 0 if np.dtype(field_type).kind == 'i' else DECIMALS)
+        if column is None:
+            # Values not fitting in the column or rounding ties: printf-style formatting
+            line_format = _line_format(section.dtype)
+            return ''.join(map(line_format.__mod__, zip(*(section[name].tolist() for name in section.dtype.names)))).encode()
+        lines[:, offset:offset + width] = column
+        offset += width
+    return lines.tobytes()
+
+
+def _decode_column(column: np.ndarray, decimals: int) -> Optional[np.ndarray]:
+    """Decodes the right-aligned numbers of the (n_lines, width) characters array **column**,
+    or returns None if they are not in the fixed-width format."""
+    width = column.shape[1]
+    point = width - decimals - 1 if decimals else width
+    if decimals and not np.all(column[:, point] == ord('.')):
+        return None
+    # Only blanks, digits and minus signs around the decimal point
+    if not np.all(_NUMBER_CHARACTERS[column[:, :point]]) or not np.all(_NUMBER_CHARACTERS[column[:, point + 1:]]):
+        return None
+    # Blanks and minus signs count as zero digits, the decimal point has no weight.
+    # Exact float arithmetic: integers below 2**53
+    powers = 10.0 ** np.arange(width - 1, -1, -1)
+    if decimals:
+        powers = np.r_[powers[1:point + 1], 0, powers[point + 1:]]
+    values = (np.maximum(column, np.uint8(ord('0'))) - np.uint8(ord('0'))).astype(np.float64) @ powers
+    minus = column[:, :point] == ord('-')
+    if minus.any():
+        values[minus.any(axis=1)] *= -1
+    return values / 10 ** decimals if decimals else values.astype(np.int64)
+
+
+def _encode_column(values: np.ndarray, width: int, decimals: int) -> Optional[np.ndarray]:
+    """Encodes **values** as right-aligned numbers with **decimals** digits in a (n_values, width)
+    characters array, or returns None if the printf-style formatting can not be reproduced."""
+    values = np.asarray(values)
+    if decimals:
+        if not np.all(np.isfinite(values)):
+            return None
+        scaled = np.abs(values) * 10 ** decimals
+        units = np.rint(scaled)
+        # Rounding ties of the scaled value could be resolved differently than printf on the exact value
+        if np.any(np.abs(np.abs(scaled - units) - 0.5) < 1e-6):
+            return None
+        units = units.astype(np.int64)
+        negative = np.signbit(values)
+    else:
+        units = np.abs(values.astype(np.int64))
+        negative = values < 0
+    num_digits = np.maximum(np.searchsorted(10 ** np.arange(1, 19, dtype=np.int64), units, side='right') + 1, decimals + 1)
+    if np.any(num_digits + bool(decimals) + negative > width):
+        return None
+    column = np.full((len(values), width), ord(' '), dtype=np.uint8)
+    remaining = units.copy()
+    position = width
+    for digit in range(int(num_digits.max(initial=1))):
+        position -= 1
+        if decimals and digit == decimals:
+            column[:, position] = ord('.')
+            position -= 1
+        shown = digit < num_digits
+        column[shown, position] = ord('0') + remaining[shown] % 10
+        remaining //= 10
+    # Minus sign in front of the first digit
+    negative_rows = np.flatnonzero(negative)
+    column[negative_rows, (width - 1 - num_digits - bool(decimals))[negative_rows]] = ord('-')
+    return column
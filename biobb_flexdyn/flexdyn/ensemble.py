@@ -0,0 +1,214 @@
+"""Module containing the Ensemble class holding the structures generated by the FlexDyn blocks as NumPy arrays."""
+import shutil
+from pathlib import Path
+from typing import Iterator, Optional, Union
+import numpy as np
+from biobb_flexdyn.flexdyn.common import iter_coords_chunks, memmap_npz_member
+from biobb_flexdyn.flexdyn.pdb_codec import PdbTemplate, PdbWriter, count_pdb_models, parse_pdb_number
+from biobb_flexdyn.flexdyn.trajectory import (TRAJECTORY_FORMATS, count_trajectory_frames, is_binary_trajectory, iter_trajectory_chunks,
+                                              open_trajectory_writer)
+
+# Per-atom fields of the topology shared by all the frames
+TOPOLOGY_DTYPE = np.dtype([('record', 'U6'), ('serial', np.int32), ('name', 'U4'), ('altloc', 'U1'), ('resname', 'U4'),
+                           ('chain', 'U1'), ('resnum', np.int32), ('icode', 'U1'), ('element', 'U2')])
+# Output argument holding the ensemble of every block
+TRAJECTORY_OUTPUTS = {'ProdyANM': 'output_pdb_path', 'Nolb_nma': 'output_pdb_path', 'ImodImc': 'output_traj_path',
+                      'ImodImove': 'output_pdb_path', 'ConcoordDisco': 'output_traj_path'}
+# Frames converted to float32 at a time when reading a trajectory
+CHUNK_SIZE = 1000
+
+
+class Ensemble:
+    """
+    | biobb_flexdyn Ensemble
+    | Structural ensemble as NumPy arrays.
+    | The frames of the multi-model PDB (or multi-frame GRO, XTC, DCD and NPZ) files written by prody_anm, nolb_nma, imod_imc, imod_imove and concoord_disco are stored in a contiguous (n_frames, n_atoms, 3) float32 array (Angstroms), that can be a memory-mapped file, and their atoms in a single topology structured array of TOPOLOGY_DTYPE, parsed once from the first frame. Slicing the frames returns a new Ensemble sharing the topology and a view of the coordinates, without copying them.
+
+    Args:
+        topology (np.ndarray): (n_atoms,) structured array of TOPOLOGY_DTYPE.
+        coords (np.ndarray): (n_frames, n_atoms, 3) coordinates (Angstroms), converted to float32 if needed.
+
+    Examples:
+        This is a use example of how to use the class from Python::
+
+            from biobb_flexdyn.flexdyn.ensemble import Ensemble
+            ensemble = Ensemble.read('/path/to/nolb_output.pdb', mmap_path='/path/to/nolb_output.npy')
+            print(len(ensemble), ensemble.num_atoms, ensemble.topology['name'][:5])
+            first_half = ensemble[:len(ensemble) // 2]
+            ensemble.save('/path/to/nolb_output.npz')
+            ensemble = Ensemble.load('/path/to/nolb_output.npz')
+    """
+
+    def __init__(self, topology: np.ndarray, coords: np.ndarray) -> None:
+        self.topology = topology
+        self.coords = coords if coords.dtype == np.float32 else coords.astype(np.float32)
+        if self.coords.ndim != 3 or self.coords.shape[1:] != (len(self.topology), 3):
+            raise ValueError(f"coords of shape {self.coords.shape} do not match the (n_frames, {len(self.topology)}, 3) frames of the topology")
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        return iter(self.coords)
+
+    def __getitem__(self, index) -> Union[np.ndarray, 'Ensemble']:
+        """Returns the (n_atoms, 3) coordinates of a frame for an integer **index**, or an Ensemble with the
+        frames of a slice (a view of the coordinates) or of a sequence of indices (a copy of the coordinates)."""
+        if isinstance(index, (int, np.integer)):
+            return self.coords[index]
+        return Ensemble(self.topology, self.coords[index])
+
+    @property
+    def num_frames(self) -> int:
+        """Number of frames."""
+        return self.coords.shape[0]
+
+    @property
+    def num_atoms(self) -> int:
+        """Number of atoms of every frame."""
+        return self.coords.shape[1]
+
+    def select(self, atoms: Union[np.ndarray, list[int], slice]) -> 'Ensemble':
+        """Returns a new Ensemble with the **atoms** (boolean mask, 0-based indices or slice) of every frame."""
+        return Ensemble(self.topology[atoms], self.coords[:, atoms])
+
+    @classmethod
+    def read(cls, traj_path: Union[str, Path], mmap_path: Optional[Union[str, Path]] = None,
+             chunk_size: int = CHUNK_SIZE, top_path: Optional[Union[str, Path]] = None) -> 'Ensemble':
+        """Parses the multi-model PDB, multi-frame GRO, XTC, DCD or NPZ file **traj_path**.
+
+        The coordinates of PDB, GRO, XTC and DCD files are read **chunk_size** frames at a time. If **mmap_path** is
+        set, they are written to that .npy file and memory-mapped, so the whole ensemble is never held in memory. The
+        topology of XTC and DCD files is read from the PDB file **top_path**, NPZ files written by :meth:`save` or the
+        blocks hold their own topology and their coordinates are memory-mapped."""
+        suffix = Path(traj_path).suffix.lower()
+        if suffix == '.npz':
+            ensemble = cls.load(traj_path)
+            return ensemble if top_path is None else cls(read_pdb_topology(top_path), ensemble.coords)
+        if is_binary_trajectory(traj_path):
+            if not top_path:
+                raise ValueError(f"{traj_path}: the topology PDB file (top_path) is required to read {suffix} trajectories")
+            topology, num_frames = read_pdb_topology(top_path), count_trajectory_frames(traj_path)
+            chunks = iter_trajectory_chunks(traj_path, chunk_size)
+        elif suffix == '.pdb':
+            topology, num_frames = read_pdb_topology(traj_path), count_pdb_models(traj_path)
+            chunks = iter_coords_chunks(traj_path, chunk_size)
+        elif suffix == '.gro':
+            topology, num_frames = _read_gro_topology(traj_path)
+            chunks = iter_coords_chunks(traj_path, chunk_size)
+        else:
+            raise ValueError(f"{traj_path}: the ensemble must be a PDB, GRO or {', '.join(TRAJECTORY_FORMATS)} formatted file")
+
+        shape = (num_frames, len(topology), 3)
+        coords = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.float32, shape=shape) if mmap_path else np.empty(shape, dtype=np.float32)
+        frame = 0
+        for chunk in chunks:
+            if chunk.shape[1] != len(topology):
+                raise ValueError(f"{traj_path}: frames {frame + 1}-{frame + len(chunk)} have {chunk.shape[1]} atoms, {len(topology)} expected")
+            coords[frame:frame + len(chunk)] = chunk
+            frame += len(chunk)
+        if frame != num_frames:
+            raise ValueError(f"{traj_path}: {frame} frames read, {num_frames} expected")
+        if mmap_path:
+            coords.flush()
+        return cls(topology, coords)
+
+    @classmethod
+    def from_block(cls, block, mmap_path: Optional[Union[str, Path]] = None) -> 'Ensemble':
+        """Reads the ensemble written by the launched **block** (ProdyANM, Nolb_nma, ImodImc, ImodImove or ConcoordDisco)."""
+        output = TRAJECTORY_OUTPUTS.get(type(block).__name__)
+        if not output:
+            raise ValueError(f"{type(block).__name__} does not write an ensemble, expected one of: {', '.join(TRAJECTORY_OUTPUTS)}")
+        return cls.read(block.io_dict['out'][output], mmap_path, top_path=block.io_dict['out'].get('output_top_path'))
+
+    def write(self, traj_path: Union[str, Path], chunk_size: int = CHUNK_SIZE) -> None:
+        """Writes the frames to the multi-model PDB, XTC, DCD or NPZ trajectory **traj_path**, **chunk_size** frames at a time."""
+        if Path(traj_path).suffix.lower() == '.pdb':
+            writer = PdbWriter(traj_path, PdbTemplate.from_topology(self.topology))
+        else:
+            writer = open_trajectory_writer(traj_path, self.num_atoms, self.topology)
+        with writer:
+            for start in range(0, len(self), chunk_size):
+                writer.write(self.coords[start:start + chunk_size])
+
+    def save(self, npz_path: Union[str, Path]) -> None:
+        """Saves the arrays to the uncompressed npz sidecar **npz_path**, that can be memory-mapped by :meth:`load`."""
+        np.savez(npz_path, coords=np.ascontiguousarray(self.coords), topology=self.topology)
+
+    @classmethod
+    def load(cls, npz_path: Union[str, Path], mmap_mode: Optional[str] = 'r') -> 'Ensemble':
+        """Loads the npz sidecar **npz_path** written by :meth:`save`, memory-mapping the coordinates
+        (read-only by default) unless **mmap_mode** is None."""
+        with np.load(npz_path) as npz:
+            topology = npz['topology']
+            coords = npz['coords'] if mmap_mode is None else None
+        if mmap_mode is not None:
+            coords = memmap_npz_member(npz_path, 'coords.npy', mmap_mode)
+        return cls(topology, coords)
+
+
+def read_pdb_topology(pdb_path: Union[str, Path]) -> np.ndarray:
+    """Returns the topology of the first model of the (multi-model) **pdb_path**, without reading the other models.
+    Serials and residue numbers beyond the PDB columns are read as hybrid-36 or hexadecimal numbers (see
+    :func:`parse_pdb_number <flexdyn.pdb_codec.parse_pdb_number>`), the unreadable ones (ie: *****) being replaced
+    by the position of the atom record and by the residue number of the previous atom."""
+    atoms: list[tuple] = []
+    with open(pdb_path) as pdb_file:
+        for line in pdb_file:
+            if line.startswith('ENDMDL'):
+                break
+            if line.startswith(('ATOM', 'HETATM')):
+                serial = parse_pdb_number(line[6:11])
+                resnum = parse_pdb_number(line[22:26])
+                if serial is None:
+                    serial = len(atoms) + 1
+                if resnum is None:
+                    resnum = atoms[-1][6] if atoms else 0
+                atoms.append((line[0:6].strip(), serial, line[12:16].strip(), line[16].strip(), line[17:21].strip(),
+                              line[21].strip(), resnum, line[26].strip(), line[76:78].strip()))
+    return np.array(atoms, dtype=TOPOLOGY_DTYPE)
+
+
+def write_topology_pdb(pdb_path: Union[str, Path], top_path: Union[str, Path]) -> None:
+    """Writes the header and the first model of the multi-model **pdb_path** to **top_path**, as a single structure PDB
+    file giving the atoms of the frames of the XTC and DCD trajectories."""
+    with open(pdb_path) as pdb_file, open(top_path, 'w') as top_file:
+        for line in pdb_file:
+            if line.startswith('ENDMDL'):
+                break
+            if not line.startswith(('MODEL', 'NUMMDL', 'END')):
+                top_file.write(line)
+        top_file.write('END\n')
+
+
+def write_trajectory(pdb_path: Union[str, Path], traj_path: Union[str, Path], top_path: Optional[Union[str, Path]] = None,
+                     chunk_size: int = CHUNK_SIZE) -> None:
+    """Streaming converter of the multi-model **pdb_path** (ie: written by the NOLB, imc or imove binaries) to the
+    PDB, XTC, DCD or NPZ **traj_path**, reading and writing **chunk_size** frames at a time. The first model
+    is written to the PDB file **top_path** if set."""
+    if top_path:
+        write_topology_pdb(pdb_path, top_path)
+    if not is_binary_trajectory(traj_path):
+        if Path(pdb_path).resolve() != Path(traj_path).resolve():
+            shutil.copy2(pdb_path, traj_path)
+        return
+    topology = read_pdb_topology(pdb_path)
+    with open_trajectory_writer(traj_path, len(topology), topology) as writer:
+        for chunk in iter_coords_chunks(pdb_path, chunk_size):
+            writer.write(chunk)
+
+
+def _read_gro_topology(gro_path: Union[str, Path]) -> tuple[np.ndarray, int]:
+    """Returns the topology of the first frame of the multi-frame **gro_path** and its number of frames."""
+    with open(gro_path) as gro_file:
+        gro_file.readline()
+        num_atoms = int(gro_file.readline())
+        # Fixed columns: residue number, residue name, atom name and atom number in 5 characters fields
+        atoms = [(line[10:15].strip(), line[5:10].strip(), int(line[0:5]), int(line[15:20]))
+                 for line in (gro_file.readline() for _ in range(num_atoms))]
+        num_lines = 2 + num_atoms + sum(1 for _ in gro_file)
+    topology = np.zeros(num_atoms, dtype=TOPOLOGY_DTYPE)
+    topology['record'] = 'ATOM'
+    topology['name'], topology['resname'], topology['resnum'], topology['serial'] = zip(*atoms) if atoms else ((), (), (), ())
+    # Title, number of atoms, atoms and box lines per frame, the box of the last frame may be missing (ie: dist.gro)
+    return topology, (num_lines + 1) // (num_atoms + 3)
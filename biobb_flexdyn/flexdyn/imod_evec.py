@@ -0,0 +1,120 @@
+"""Module containing the ImodEvec class to read and write iMOD eigenvector files."""
+import re
+from pathlib import Path
+from typing import Optional, Sequence, Union
+import numpy as np
+from biobb_flexdyn.flexdyn.common import memmap_npz_member
+
+# Number of coefficients per line and printf formats of the iMOD eigenvector files
+COLUMNS = 7
+EIGENVALUE_FORMAT = '%d       %.10e\n'
+COEFFICIENT_FORMAT = ' %17.10e'
+_SIZE_LINE = re.compile(r'\s*(\d+)\s+(\d+)\s+Contains\s+(\d+)\s+eigenvectors')
+
+
+class ImodEvec:
+    """
+    | biobb_flexdyn ImodEvec
+    | iMOD eigenvector file as NumPy arrays.
+    | The modes of the eigenvector files written by imode (ie: imods_evecs_ic.evec) and read by imc and imove are stored in a (n_modes, n_dof) float64 array and their eigenvalues in a (n_modes,) array. The text written back is byte-identical to the parsed file, and the arrays can be saved to a binary npz sidecar that is memory-mapped when loaded. Modes can be selected, truncated or re-weighted and written back for imc and imove without recomputing them with imode.
+
+    Args:
+        eigenvectors (np.ndarray): (n_modes, n_dof) mode coefficients.
+        eigenvalues (np.ndarray): (n_modes,) eigenvalues.
+        title (str): ("COVAR") Title of the eigenvector file.
+        size (tuple): (None) Pair of sizes in the second line of the file. If not set, both are the number of degrees of freedom.
+
+    Examples:
+        This is a use example of how to use the class from Python::
+
+            from biobb_flexdyn.flexdyn.imod_evec import ImodEvec
+            evec = ImodEvec.read('/path/to/imod_imode_evecs.dat')
+            print(evec.eigenvectors.shape, evec.eigenvalues[:5])
+            evec.select(range(5)).write('/path/to/imod_evecs_5.dat')
+            evec.save('/path/to/imod_evecs.npz')
+            evec = ImodEvec.load('/path/to/imod_evecs.npz')
+    """
+
+    def __init__(self, eigenvectors: np.ndarray, eigenvalues: np.ndarray, title: str = 'COVAR',
+                 size: Optional[tuple[int, int]] = None) -> None:
+        self.eigenvectors = eigenvectors
+        self.eigenvalues = eigenvalues
+        if len(self.eigenvectors) != len(self.eigenvalues):
+            raise ValueError(f"{len(self.eigenvectors)} eigenvectors and {len(self.eigenvalues)} eigenvalues")
+        self.title = title
+        self.size = tuple(size) if size else (self.num_dof, self.num_dof)
+
+    def __len__(self) -> int:
+        return len(self.eigenvalues)
+
+    @property
+    def num_dof(self) -> int:
+        """Number of degrees of freedom (coefficients) of every mode."""
+        return self.eigenvectors.shape[1] if self.eigenvectors.ndim == 2 else 0
+
+    def select(self, modes: Union[Sequence[int], slice, range]) -> 'ImodEvec':
+        """Returns a new ImodEvec with the **modes** (0-based indices or slice), renumbered from 1 when written."""
+        if isinstance(modes, range):
+            modes = list(modes)
+        return ImodEvec(self.eigenvectors[modes], self.eigenvalues[modes], self.title, self.size)
+
+    @classmethod
+    def read(cls, evec_path: Union[str, Path]) -> 'ImodEvec':
+        """Parses the iMOD eigenvector text file **evec_path**."""
+        text = Path(evec_path).read_text()
+        title_line, size_line, body = text.split('\n', 2)
+        title = title_line.split(':', 1)[1].strip() if ':' in title_line else title_line.strip()
+        size_match = _SIZE_LINE.match(size_line)
+        if not size_match:
+            raise ValueError(f"{evec_path}: unexpected eigenvector file header: {size_line}")
+        num_modes = int(size_match.group(3))
+
+        blocks = body.split('****\n')[1:]
+        if len(blocks) != num_modes:
+            raise ValueError(f"{evec_path}: {len(blocks)} modes found, {num_modes} expected")
+        eigenvalues = np.empty(num_modes)
+        eigenvectors = None
+        for index, block in enumerate(blocks):
+            eigenvalue_line, coefficients = block.split('\n', 1)
+            eigenvalues[index] = float(eigenvalue_line.split()[1])
+            values = np.fromstring(coefficients, sep=' ')
+            if eigenvectors is None:
+                eigenvectors = np.empty((num_modes, len(values)))
+            elif len(values) != eigenvectors.shape[1]:
+                raise ValueError(f"{evec_path}: mode {index + 1} has {len(values)} coefficients, {eigenvectors.shape[1]} expected")
+            eigenvectors[index] = values
+        if eigenvectors is None:
+            eigenvectors = np.empty((0, int(size_match.group(1))))
+        return cls(eigenvectors, eigenvalues, title, (int(size_match.group(1)), int(size_match.group(2))))
+
+    def write(self, evec_path: Union[str, Path]) -> None:
+        """Writes the iMOD eigenvector text file **evec_path** read by imc and imove."""
+        num_rows, remainder = divmod(self.num_dof, COLUMNS)
+        row_format = COEFFICIENT_FORMAT * COLUMNS + '\n'
+        rows_format = row_format * num_rows + (COEFFICIENT_FORMAT * remainder + '\n' if remainder else '')
+        with open(evec_path, 'w') as evec_file:
+            evec_file.write(f" Eigenvector file: {self.title}\n")
+            evec_file.write(f" {self.size[0]} {self.size[1]} Contains {len(self)} eigenvectors\n")
+            for index, (eigenvalue, eigenvector) in enumerate(zip(self.eigenvalues.tolist(), self.eigenvectors)):
+                evec_file.write('****\n')
+                evec_file.write(EIGENVALUE_FORMAT % (index + 1, eigenvalue))
+                evec_file.write(rows_format % tuple(eigenvector.tolist()))
+
+    def save(self, npz_path: Union[str, Path]) -> None:
+        """Saves the arrays to the uncompressed npz sidecar **npz_path**, that can be memory-mapped by :meth:`load`."""
+        np.savez(npz_path, eigenvectors=np.ascontiguousarray(self.eigenvectors, dtype=np.float64),
+                 eigenvalues=np.asarray(self.eigenvalues, dtype=np.float64),
+                 title=np.array(self.title), size=np.array(self.size))
+
+    @classmethod
+    def load(cls, npz_path: Union[str, Path], mmap_mode: Optional[str] = 'r') -> 'ImodEvec':
+        """Loads the npz sidecar **npz_path** written by :meth:`save`, memory-mapping the eigenvectors
+        (read-only by default) unless **mmap_mode** is None."""
+        with np.load(npz_path) as npz:
+            eigenvalues = npz['eigenvalues']
+            title = str(npz['title'])
+            size = tuple(npz['size'].tolist())
+            eigenvectors = npz['eigenvectors'] if mmap_mode is None else None
+        if mmap_mode is not None:
+            eigenvectors = memmap_npz_member(npz_path, 'eigenvectors.npy', mmap_mode)
+        return cls(eigenvectors, eigenvalues, title, size)
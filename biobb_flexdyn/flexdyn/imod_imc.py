@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
 """Module containing the imode class and the command line interface."""
-from typing import Optional
-import shutil
+from typing import Any, Callable, Generator, Optional
 from pathlib import PurePath
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import result_cache
+from biobb_flexdyn.flexdyn.common import (Commands, LaunchStep, LaunchSteps, StreamingCommands, derive_seeds,
+                                          launchlogger_async, merge_pdb_models, run_biobb_step, run_launch_steps,
+                                          run_launch_steps_async, seed_options, seeded_processes, split_count)
+from biobb_flexdyn.flexdyn.instrumentation import copy_file, instrument_launch, instrument_launch_async, phase
+from biobb_flexdyn.flexdyn.streaming import StreamFrame, is_streaming
+from biobb_flexdyn.flexdyn.ensemble import write_trajectory
+from biobb_flexdyn.flexdyn.trajectory import is_binary_trajectory
 
 
 class ImodImc(BiobbObject):
@@ -18,11 +25,20 @@ class ImodImc(BiobbObject):
     Args:
         input_pdb_path (str): Input PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure_cleaned.pdb>`_. Accepted formats: pdb (edam:format_1476).
         input_dat_path (str): Input dat with normal modes. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/imod_imode_evecs.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330).
-        output_traj_path (str): Output multi-model PDB file with the generated ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/imod_imc_output.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        output_traj_path (str): Output multi-model PDB file, or XTC, DCD or NPZ trajectory, with the generated ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/imod_imc_output.pdb>`_. Accepted formats: pdb (edam:format_1476), xtc (edam:format_3875), dcd (edam:format_3878), npz (edam:format_4003).
+        output_top_path (str) (Optional): Output PDB file with the first structure of the ensemble, giving the atoms of the frames of the XTC and DCD trajectories. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure.pdb>`_. Accepted formats: pdb (edam:format_1476).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **num_structs** (*int*) - (500) Number of structures to be generated
             * **num_modes** (*int*) - (5) Number of eigenvectors to be employed
             * **amplitude** (*int*) - (1) Amplitude linear factor to scale motion
+            * **seed** (*int*) - (None) Random seed of the Monte-Carlo sampling, passed to imc with the seed_flag option. Ignored if seed_flag is not set.
+            * **seed_flag** (*str*) - (None) imc command line option taking the random seed, if the installed imc has one. If not set, no seed is passed and imc seeds itself. Values: --seed (option of the imc builds taking a seed)
+            * **num_workers** (*int*) - (1) Number of concurrent imc processes. The structures are split across the workers, each one running in its own temporary folder with a seed deterministically derived from the seed property, and their ensembles are merged with continuous model numbering. Requires seed_flag: if it is not set, a single imc process is run, as processes seeded by imc itself may repeat the same structures.
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -39,6 +55,25 @@ class ImodImc(BiobbObject):
                           output_traj_path='/path/to/output_ensemble.pdb',
                           properties=prop)
 
+        The structures can be processed while imc is still generating them, stopping the generation once
+        enough have been produced, passing the frame_callback and stop_condition arguments::
+
+            imod_imc(   input_pdb_path='/path/to/structure.pdb',
+                          input_dat_path='/path/to/input_evecs.dat',
+                          output_traj_path='/path/to/output_ensemble.pdb',
+                          properties=prop,
+                          frame_callback=lambda frame: print(frame.index, frame.rate, frame.eta),
+                          stop_condition=lambda frame: frame.index >= 100)
+
+        Many executions can be run concurrently from a single asyncio event loop awaiting the imod_imc_async
+        function (or the launch_async method); cancelling it terminates imc and removes its temporary files::
+
+            from biobb_flexdyn.flexdyn.imod_imc import imod_imc_async
+            await asyncio.gather(*(imod_imc_async(input_pdb_path='/path/to/structure.pdb',
+                                                  input_dat_path='/path/to/input_evecs.dat',
+                                                  output_traj_path=f'/path/to/output_ensemble_{seed}.pdb',
+                                                  properties={**prop, 'seed': seed}) for seed in range(1, 101)))
+
     Info:
         * wrapped_software:
             * name: iMODS
@@ -51,7 +86,10 @@ class ImodImc(BiobbObject):
     """
 
     def __init__(self, input_pdb_path: str, input_dat_path: str, output_traj_path: str,
-                 properties: Optional[dict] = None, **kwargs) -> None:
+                 output_top_path: Optional[str] = None,
+                 properties: Optional[dict] = None,
+                 frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+                 stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -62,7 +100,8 @@ class ImodImc(BiobbObject):
         # Input/Output files
         self.io_dict = {
             'in': {'input_pdb_path': input_pdb_path, 'input_dat_path': input_dat_path},
-            'out': {'output_traj_path': output_traj_path}
+            'out': {'output_traj_path': output_traj_path,
+                    'output_top_path': output_top_path}
         }
 
         # Properties specific for BB
@@ -72,14 +111,40 @@ class ImodImc(BiobbObject):
         self.num_structs = properties.get('num_structs', 500)
         self.num_modes = properties.get('num_modes', 5)
         self.amplitude = properties.get('amplitude', 1.0)
+        self.seed = properties.get('seed')
+        self.seed_flag = properties.get('seed_flag')
+        self.num_workers = properties.get('num_workers', 1)
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
+
+        # Live streaming of the generated structures (see biobb_flexdyn.flexdyn.streaming.StreamFrame)
+        self.frame_callback = frame_callback
+        self.stop_condition = stop_condition
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
     @launchlogger
+    @instrument_launch
+    @result_cache
     def launch(self):
         """Launches the execution of the FlexDyn iMOD imc module."""
+        return run_launch_steps(self, self.launch_steps())
+
+    @launchlogger_async
+    @instrument_launch_async
+    @result_cache
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn iMOD imc module as a coroutine, running the imc processes as an asyncio
+        subprocess that is terminated, and its temporary files removed, if the coroutine is cancelled."""
+        return await run_launch_steps_async(self, self.launch_steps())
+
+    def launch_steps(self) -> LaunchSteps:
+        """Execution of the FlexDyn iMOD imc module, yielding the commands to be run by :meth:`launch` or :meth:`launch_async`."""
 
         # Setup Biobb
         if self.check_restart():
@@ -92,77 +157,149 @@ class ImodImc(BiobbObject):
         #   Generating a temporary folder and working inside this folder (sandbox) fixes this problem.
         #   The problem was found in Galaxy executions, launching Singularity containers (May 2023).
 
+        num_workers = seeded_processes(self, 'imc', int(self.num_workers))
+        if num_workers > 1:
+            yield from self.run_workers(num_workers)
+            self.remove_tmp_files()
+            self.check_arguments(output_files_created=True, raise_exception=False)
+            return self.return_code
+
         # Creating temporary folder
-        tmp_folder = fu.create_unique_dir()
-        fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+        with phase(self, 'stage_files'):
+            tmp_folder = fu.create_unique_dir()
+            fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+            self.tmp_files.append(tmp_folder)
 
-        shutil.copy2(self.io_dict["in"]["input_pdb_path"], tmp_folder)
-        shutil.copy2(self.io_dict["in"]["input_dat_path"], tmp_folder)
+            copy_file(self, self.io_dict["in"]["input_pdb_path"], tmp_folder)
+            copy_file(self, self.io_dict["in"]["input_dat_path"], tmp_folder)
 
         # Output temporary file
         # out_file_prefix = Path(self.stage_io_dict.get("unique_dir", "")).joinpath("imod_ensemble")
         # out_file = Path(self.stage_io_dict.get("unique_dir", "")).joinpath("imod_ensemble.pdb")
-        out_file_prefix = "imod_ensemble"  # Needed as imod is appending the .pdb extension
         out_file = "imod_ensemble.pdb"
 
-        # Command line
-        # imc 1ake_backbone.pdb  1ake_backbone_evecs.dat -o 1ake_backbone.ensemble.pdb -c 500
-        # self.cmd = [self.binary_path,
-        #             str(Path(self.stage_io_dict["in"]["input_pdb_path"]).relative_to(Path.cwd())),
-        #             str(Path(self.stage_io_dict["in"]["input_dat_path"]).relative_to(Path.cwd())),
-        #             "-o", str(out_file_prefix)
-        #             ]
-
-        self.cmd = ['cd', tmp_folder, ';',
-                    self.binary_path,
-                    PurePath(self.io_dict["in"]["input_pdb_path"]).name,
-                    PurePath(self.io_dict["in"]["input_dat_path"]).name,
-                    '-o', out_file_prefix
-                    ]
-
-        # Properties
-        if self.num_structs:
-            self.cmd.append('-c')
-            self.cmd.append(str(self.num_structs))
-
-        if self.num_modes:
-            self.cmd.append('-n')
-            self.cmd.append(str(self.num_modes))
-
-        if self.amplitude:
-            self.cmd.append('-a')
-            self.cmd.append(str(self.amplitude))
+        self.cmd = self.create_imc_cmd(tmp_folder, self.num_structs, self.seed)
 
         # Run Biobb block
-        self.run_biobb()
+        if is_streaming(self):
+            self.create_cmd_line()
+            self.return_code, _ = yield StreamingCommands([self.cmd], [PurePath(tmp_folder).joinpath(out_file)], self.num_structs)
+        else:
+            yield from run_biobb_step(self)
 
         # Copying generated output file to the final (user-given) file name
         # shutil.copy2(out_file, self.stage_io_dict["out"]["output_traj_path"])
 
-        # Copy outputs from temporary folder to output path
-        shutil.copy2(PurePath(tmp_folder).joinpath(out_file), PurePath(self.io_dict["out"]["output_traj_path"]))
+        # Copy outputs from temporary folder to output path, converted to XTC, DCD or NPZ if needed
+        with phase(self, 'copy_to_host'):
+            write_trajectory(PurePath(tmp_folder).joinpath(out_file), self.io_dict["out"]["output_traj_path"], self.io_dict["out"].get("output_top_path"))
 
         # Copy files to host
         # self.copy_to_host()
 
         # remove temporary folder(s)
-        self.tmp_files.append(tmp_folder)
         self.remove_tmp_files()
 
         self.check_arguments(output_files_created=True, raise_exception=False)
 
         return self.return_code
 
+    def create_imc_cmd(self, tmp_folder: str, num_structs: Optional[int], seed: Optional[int]) -> list[str]:
+        """Build the imc command line generating **num_structs** structures with **seed** in **tmp_folder**."""
+        out_file_prefix = "imod_ensemble"  # Needed as imod is appending the .pdb extension
+
+        # Command line
+        # imc 1ake_backbone.pdb  1ake_backbone_evecs.dat -o 1ake_backbone.ensemble.pdb -c 500
+        # self.cmd = [self.binary_path,
+        #             str(Path(self.stage_io_dict["in"]["input_pdb_path"]).relative_to(Path.cwd())),
+        #             str(Path(self.stage_io_dict["in"]["input_dat_path"]).relative_to(Path.cwd())),
+        #             "-o", str(out_file_prefix)
+        #             ]
+
+        cmd = ['cd', tmp_folder, ';',
+               self.binary_path,
+               PurePath(self.io_dict["in"]["input_pdb_path"]).name,
+               PurePath(self.io_dict["in"]["input_dat_path"]).name,
+               '-o', out_file_prefix
+               ]
+
+        # Properties
+        if num_structs:
+            cmd.append('-c')
+            cmd.append(str(num_structs))
+
+        if self.num_modes:
+            cmd.append('-n')
+            cmd.append(str(self.num_modes))
+
+        if self.amplitude:
+            cmd.append('-a')
+            cmd.append(str(self.amplitude))
+
+        cmd.extend(seed_options(self, seed))
+
+        return cmd
+
+    def run_workers(self, num_workers: int) -> Generator[LaunchStep, Any, None]:
+        """Split num_structs across **num_workers** concurrent imc processes, each one running in its own short-path
+        temporary folder with a seed derived from the seed property, and merge their ensembles in output_traj_path."""
+        worker_sizes = [size for size in split_count(int(self.num_structs), num_workers) if size]
+        worker_seeds = derive_seeds(int(self.seed or 0), len(worker_sizes))
+
+        cmds, out_files = [], []
+        for worker_index, (worker_size, worker_seed) in enumerate(zip(worker_sizes, worker_seeds)):
+            # Short paths, as in the single process execution
+            with phase(self, 'stage_files'):
+                tmp_folder = fu.create_unique_dir()
+                fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+                self.tmp_files.append(tmp_folder)
+                copy_file(self, self.io_dict["in"]["input_pdb_path"], tmp_folder)
+                copy_file(self, self.io_dict["in"]["input_dat_path"], tmp_folder)
+            fu.log(f"Worker {worker_index}: {worker_size} structures, seed {worker_seed}", self.out_log, self.global_log)
+            self.cmd = self.create_imc_cmd(tmp_folder, worker_size, worker_seed)
+            self.create_cmd_line()
+            cmds.append(self.cmd)
+            out_files.append(PurePath(tmp_folder).joinpath("imod_ensemble.pdb"))
+
+        if is_streaming(self):
+            # The workers run all at once, so the streamed frames come from all of them
+            self.return_code, _ = yield StreamingCommands(cmds, out_files, int(self.num_structs))
+        else:
+            self.return_code = yield Commands(cmds, num_workers)
+        if self.return_code:
+            return
+
+        # Binary trajectories are converted from the merged PDB file
+        traj_path = self.io_dict["out"]["output_traj_path"]
+        merged_path = str(PurePath(out_files[0]).with_name("imod_merged.pdb")) if is_binary_trajectory(traj_path) else traj_path
+        with phase(self, 'merge_outputs'):
+            num_models = merge_pdb_models(out_files, merged_path)
+            write_trajectory(merged_path, traj_path, self.io_dict["out"].get("output_top_path"))
+        fu.log(f"Merged {num_models} structures from {len(out_files)} workers", self.out_log, self.global_log)
+
 
 def imod_imc(input_pdb_path: str, input_dat_path: str, output_traj_path: str,
-             properties: Optional[dict] = None, **kwargs) -> int:
+             output_top_path: Optional[str] = None,
+             properties: Optional[dict] = None,
+             frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+             stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> int:
     """Create :class:`ImodImc <flexdyn.imod_imc.ImodImc>`flexdyn.imod_imc.ImodImc class and
     execute :meth:`launch() <flexdyn.imod_imc.ImodImc.launch>` method"""
     return ImodImc(**dict(locals())).launch()
 
 
+async def imod_imc_async(input_pdb_path: str, input_dat_path: str, output_traj_path: str,
+                         output_top_path: Optional[str] = None,
+                         properties: Optional[dict] = None,
+                         frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+                         stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> int:
+    """Create :class:`ImodImc <flexdyn.imod_imc.ImodImc>`flexdyn.imod_imc.ImodImc class and
+    await :meth:`launch_async() <flexdyn.imod_imc.ImodImc.launch_async>` method"""
+    return await ImodImc(**dict(locals())).launch_async()
+
+
 imod_imc.__doc__ = ImodImc.__doc__
-main = ImodImc.get_main(imod_imc, "Compute a Monte-Carlo IC-NMA based conformational ensemble using the imc tool from the iMODS package.")
+main = ImodImc.get_main(imod_imc, "Compute a Monte-Carlo IC-NMA based conformational ensemble using the imc tool from the iMODS package.", custom_flags={"output_traj_path": "-o"})
 
 if __name__ == '__main__':
     main()
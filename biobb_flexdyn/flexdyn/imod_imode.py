@@ -2,11 +2,14 @@
 
 """Module containing the imode class and the command line interface."""
 from typing import Optional
-import shutil
 from pathlib import PurePath
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import result_cache
+from biobb_flexdyn.flexdyn.common import (LaunchSteps, launchlogger_async, run_biobb_step, run_launch_steps,
+                                          run_launch_steps_async)
+from biobb_flexdyn.flexdyn.instrumentation import copy_file, instrument_launch, instrument_launch_async, phase
 
 
 class ImodImode(BiobbObject):
@@ -20,6 +23,11 @@ class ImodImode(BiobbObject):
         output_dat_path (str): Output dat with normal modes. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/imod_imode_evecs.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **cg** (*int*) - (2) Coarse-Grained model. Values: 0 (CA), 1 (C5), 2 (Heavy atoms).
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -67,13 +75,33 @@ class ImodImode(BiobbObject):
 
         self.cg = properties.get('cg', 2)
 
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
+
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
     @launchlogger
+    @instrument_launch
+    @result_cache
     def launch(self):
         """Launches the execution of the FlexDyn iMOD imode module."""
+        return run_launch_steps(self, self.launch_steps())
+
+    @launchlogger_async
+    @instrument_launch_async
+    @result_cache
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn iMOD imode module as a coroutine, running imode as an asyncio
+        subprocess that is terminated, and its temporary files removed, if the coroutine is cancelled."""
+        return await run_launch_steps_async(self, self.launch_steps())
+
+    def launch_steps(self) -> LaunchSteps:
+        """Execution of the FlexDyn iMOD imode module, yielding the commands to be run by :meth:`launch` or :meth:`launch_async`."""
 
         # Setup Biobb
         if self.check_restart():
@@ -87,10 +115,12 @@ class ImodImode(BiobbObject):
         #   The problem was found in Galaxy executions, launching Singularity containers (May 2023).
 
         # Creating temporary folder
-        tmp_folder = fu.create_unique_dir()
-        fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+        with phase(self, 'stage_files'):
+            tmp_folder = fu.create_unique_dir()
+            fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+            self.tmp_files.append(tmp_folder)
 
-        shutil.copy2(self.io_dict["in"]["input_pdb_path"], tmp_folder)
+            copy_file(self, self.io_dict["in"]["input_pdb_path"], tmp_folder)
 
         # Output temporary file
         # out_file_prefix = Path(self.stage_io_dict.get("unique_dir", "")).joinpath("imods_evecs")
@@ -114,19 +144,19 @@ class ImodImode(BiobbObject):
                     ]
 
         # Run Biobb block
-        self.run_biobb()
+        yield from run_biobb_step(self)
 
         # Copying generated output file to the final (user-given) file name
         # shutil.copy2(out_file, self.stage_io_dict["out"]["output_dat_path"])
 
         # Copy outputs from temporary folder to output path
-        shutil.copy2(PurePath(tmp_folder).joinpath(out_file), PurePath(self.io_dict["out"]["output_dat_path"]))
+        with phase(self, 'copy_to_host'):
+            copy_file(self, PurePath(tmp_folder).joinpath(out_file), PurePath(self.io_dict["out"]["output_dat_path"]))
 
         # Copy files to host
         # self.copy_to_host()
 
         # remove temporary folder(s)
-        self.tmp_files.append(tmp_folder)
         self.remove_tmp_files()
 
         self.check_arguments(output_files_created=True, raise_exception=False)
@@ -141,6 +171,13 @@ def imod_imode(input_pdb_path: str, output_dat_path: str,
     return ImodImode(**dict(locals())).launch()
 
 
+async def imod_imode_async(input_pdb_path: str, output_dat_path: str,
+                           properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ImodImode <flexdyn.imod_imode.ImodImode>`flexdyn.imod_imode.ImodImode class and
+    await :meth:`launch_async() <flexdyn.imod_imode.ImodImode.launch_async>` method"""
+    return await ImodImode(**dict(locals())).launch_async()
+
+
 imod_imode.__doc__ = ImodImode.__doc__
 main = ImodImode.get_main(imod_imode, "Compute the normal modes of a macromolecule using the imode tool from the iMODS package.")
 
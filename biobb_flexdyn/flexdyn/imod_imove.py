@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
 """Module containing the imode class and the command line interface."""
-from typing import Optional
-import shutil
+from typing import Optional, Union
+import zipfile
 from pathlib import PurePath
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import result_cache
+from biobb_flexdyn.flexdyn.common import (Commands, LaunchSteps, launchlogger_async, run_biobb_step, run_launch_steps,
+                                          run_launch_steps_async)
+from biobb_flexdyn.flexdyn.instrumentation import copy_file, instrument_launch, instrument_launch_async, phase
+from biobb_flexdyn.flexdyn.ensemble import write_topology_pdb, write_trajectory
 
 
 class ImodImove(BiobbObject):
@@ -18,10 +23,17 @@ class ImodImove(BiobbObject):
     Args:
         input_pdb_path (str): Input PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure_cleaned.pdb>`_. Accepted formats: pdb (edam:format_1476).
         input_dat_path (str): Input dat with normal modes. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/imod_imode_evecs.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330).
-        output_pdb_path (str): Output multi-model PDB file with the generated animation by Principal Component. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/imod_imove_output.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        output_pdb_path (str): Output multi-model PDB file, or XTC, DCD or NPZ trajectory, with the generated animation by Principal Component. When several principal components are animated, one file per component is written next to it (ie: output_pc1.pdb, output_pc2.pdb), or all of them are archived in it if it is a ZIP file. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/imod_imove_output.pdb>`_. Accepted formats: pdb (edam:format_1476), xtc (edam:format_3875), dcd (edam:format_3878), npz (edam:format_4003), zip (edam:format_3987).
+        output_top_path (str) (Optional): Output PDB file with the first structure of the ensemble, giving the atoms of the frames of the XTC and DCD trajectories. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure.pdb>`_. Accepted formats: pdb (edam:format_1476).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
-            * **pc** (*int*) - (1) Principal Component.
+            * **pc** (*int*) - (1) Principal Component. A list of principal components (ie: [1, 2, 3]) or a string with comma separated components or ranges (ie: "1-20") animates all of them in a single temporary folder.
             * **num_frames** (*int*) - (11) Number of frames to be generated
+            * **num_workers** (*int*) - (1) Number of concurrent imove processes when animating several principal components.
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -38,6 +50,17 @@ class ImodImove(BiobbObject):
                           output_pdb_path='/path/to/output_anim.pdb',
                           properties=prop)
 
+        Several principal components can be animated at once, archiving the animations in a ZIP file::
+
+            prop = {
+                'pc' : '1-20',
+                'num_workers' : 4
+            }
+            imod_imove(   input_pdb_path='/path/to/structure.pdb',
+                          input_dat_path='/path/to/input_evecs.dat',
+                          output_pdb_path='/path/to/output_anim.zip',
+                          properties=prop)
+
     Info:
         * wrapped_software:
             * name: iMODS
@@ -50,6 +73,7 @@ class ImodImove(BiobbObject):
     """
 
     def __init__(self, input_pdb_path: str, input_dat_path: str, output_pdb_path: str,
+                 output_top_path: Optional[str] = None,
                  properties: Optional[dict] = None, **kwargs) -> None:
 
         properties = properties or {}
@@ -61,7 +85,8 @@ class ImodImove(BiobbObject):
         # Input/Output files
         self.io_dict = {
             'in': {'input_pdb_path': input_pdb_path, 'input_dat_path': input_dat_path},
-            'out': {'output_pdb_path': output_pdb_path}
+            'out': {'output_pdb_path': output_pdb_path,
+                    'output_top_path': output_top_path}
         }
 
         # Properties specific for BB
@@ -70,14 +95,35 @@ class ImodImove(BiobbObject):
 
         self.pc = properties.get('pc', 1)
         self.num_frames = properties.get('num_frames', 11)
+        self.num_workers = properties.get('num_workers', 1)
+
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
     @launchlogger
+    @instrument_launch
+    @result_cache
     def launch(self):
         """Launches the execution of the FlexDyn iMOD imove module."""
+        return run_launch_steps(self, self.launch_steps())
+
+    @launchlogger_async
+    @instrument_launch_async
+    @result_cache
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn iMOD imove module as a coroutine, running the imove processes as an asyncio
+        subprocess that is terminated, and its temporary files removed, if the coroutine is cancelled."""
+        return await run_launch_steps_async(self, self.launch_steps())
+
+    def launch_steps(self) -> LaunchSteps:
+        """Execution of the FlexDyn iMOD imove module, yielding the commands to be run by :meth:`launch` or :meth:`launch_async`."""
 
         # Setup Biobb
         if self.check_restart():
@@ -91,12 +137,63 @@ class ImodImove(BiobbObject):
         #   The problem was found in Galaxy executions, launching Singularity containers (May 2023).
 
         # Creating temporary folder
-        tmp_folder = fu.create_unique_dir()
-        fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+        with phase(self, 'stage_files'):
+            tmp_folder = fu.create_unique_dir()
+            fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+            self.tmp_files.append(tmp_folder)
+
+            copy_file(self, self.io_dict["in"]["input_pdb_path"], tmp_folder)
+            copy_file(self, self.io_dict["in"]["input_dat_path"], tmp_folder)
+
+        pcs = parse_pcs(self.pc)
+        output_path = PurePath(self.io_dict["out"]["output_pdb_path"])
+        if len(pcs) == 1 and output_path.suffix != '.zip':
+            # imove always writes PDB files, converted to XTC, DCD or NPZ if needed
+            out_files = [f"{output_path.stem}.pdb"]
+        else:
+            out_files = [f"{output_path.stem}_pc{pc}.pdb" for pc in pcs]
 
-        shutil.copy2(self.io_dict["in"]["input_pdb_path"], tmp_folder)
-        shutil.copy2(self.io_dict["in"]["input_dat_path"], tmp_folder)
+        # Run Biobb block
+        if len(out_files) == 1:
+            self.cmd = self.create_imove_cmd(tmp_folder, out_files[0], pcs[0])
+            yield from run_biobb_step(self)
+        else:
+            cmds = []
+            for pc, out_file in zip(pcs, out_files):
+                self.cmd = self.create_imove_cmd(tmp_folder, out_file, pc)
+                self.create_cmd_line()
+                cmds.append(self.cmd)
+            fu.log(f"Animating {len(pcs)} principal components with {self.num_workers} concurrent processes", self.out_log, self.global_log)
+            self.return_code = yield Commands(cmds, int(self.num_workers))
 
+        # Copy outputs from temporary folder to output path
+        if not self.return_code:
+            with phase(self, 'copy_to_host'):
+                if output_path.suffix == '.zip':
+                    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+                        for out_file in out_files:
+                            zip_file.write(PurePath(tmp_folder).joinpath(out_file), out_file)
+                    if self.io_dict["out"].get("output_top_path"):
+                        write_topology_pdb(PurePath(tmp_folder).joinpath(out_files[0]), self.io_dict["out"]["output_top_path"])
+                else:
+                    for index, out_file in enumerate(out_files):
+                        # All the components share the topology, written once
+                        write_trajectory(PurePath(tmp_folder).joinpath(out_file), output_path.with_name(PurePath(out_file).stem + output_path.suffix),
+                                         None if index else self.io_dict["out"].get("output_top_path"))
+
+        # Copy files to host
+        # self.copy_to_host()
+
+        # remove temporary folder(s)
+        self.remove_tmp_files()
+
+        # One output file per principal component instead of output_pdb_path
+        self.check_arguments(output_files_created=len(out_files) == 1 or output_path.suffix == '.zip', raise_exception=False)
+
+        return self.return_code
+
+    def create_imove_cmd(self, tmp_folder: str, out_file: str, pc: int) -> list[str]:
+        """Build the imove command line animating the principal component **pc** to **out_file** in **tmp_folder**."""
         # Command line
         # imove 1ake_backbone.pdb  1ake_backbone_evecs.dat -o 1ake_backbone.ensemble.pdb 1 -c 500
         # self.cmd = [self.binary_path,
@@ -106,46 +203,53 @@ class ImodImove(BiobbObject):
         #             str(self.pc)
         #             ]
 
-        self.cmd = ['cd', tmp_folder, ';',
-                    self.binary_path,
-                    PurePath(self.io_dict["in"]["input_pdb_path"]).name,
-                    PurePath(self.io_dict["in"]["input_dat_path"]).name,
-                    PurePath(self.io_dict["out"]["output_pdb_path"]).name,
-                    str(self.pc)
-                    ]
+        cmd = ['cd', tmp_folder, ';',
+               self.binary_path,
+               PurePath(self.io_dict["in"]["input_pdb_path"]).name,
+               PurePath(self.io_dict["in"]["input_dat_path"]).name,
+               out_file,
+               str(pc)
+               ]
 
         # Properties
         if self.num_frames:
-            self.cmd.append('-c')
-            self.cmd.append(str(self.num_frames))
+            cmd.append('-c')
+            cmd.append(str(self.num_frames))
 
-        # Run Biobb block
-        self.run_biobb()
+        return cmd
 
-        # Copy outputs from temporary folder to output path
-        shutil.copy2(PurePath(tmp_folder).joinpath(PurePath(self.io_dict["out"]["output_pdb_path"]).name), PurePath(self.io_dict["out"]["output_pdb_path"]))
 
-        # Copy files to host
-        # self.copy_to_host()
-
-        # remove temporary folder(s)
-        self.tmp_files.append(tmp_folder)
-        self.remove_tmp_files()
-
-        self.check_arguments(output_files_created=True, raise_exception=False)
-
-        return self.return_code
+def parse_pcs(pc: Union[int, str, list]) -> list[int]:
+    """Return the principal components of **pc**: a number, a list of numbers or a string with
+    comma separated numbers or ranges (ie: "1-5,8")."""
+    if isinstance(pc, (list, tuple, range)):
+        return [int(item) for item in pc]
+    pcs = []
+    for pc_range in str(pc).replace(' ', '').split(','):
+        if pc_range:
+            first, _, last = pc_range.partition('-')
+            pcs.extend(range(int(first), int(last or first) + 1))
+    return pcs
 
 
 def imod_imove(input_pdb_path: str, input_dat_path: str, output_pdb_path: str,
+               output_top_path: Optional[str] = None,
                properties: Optional[dict] = None, **kwargs) -> int:
     """Create :class:`ImodImove <flexdyn.imod_imove.ImodImove>`flexdyn.imod_imove.ImodImove class and
     execute :meth:`launch() <flexdyn.imod_imove.ImodImove.launch>` method"""
     return ImodImove(**dict(locals())).launch()
 
 
+async def imod_imove_async(input_pdb_path: str, input_dat_path: str, output_pdb_path: str,
+                           output_top_path: Optional[str] = None,
+                           properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ImodImove <flexdyn.imod_imove.ImodImove>`flexdyn.imod_imove.ImodImove class and
+    await :meth:`launch_async() <flexdyn.imod_imove.ImodImove.launch_async>` method"""
+    return await ImodImove(**dict(locals())).launch_async()
+
+
 imod_imove.__doc__ = ImodImove.__doc__
-main = ImodImove.get_main(imod_imove, "Animate the normal modes of a macromolecule using the imove tool from the iMODS package.")
+main = ImodImove.get_main(imod_imove, "Animate the normal modes of a macromolecule using the imove tool from the iMODS package.", custom_flags={"output_pdb_path": "-o"})
 
 if __name__ == '__main__':
     main()
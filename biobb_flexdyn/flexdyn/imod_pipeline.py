@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""Module containing the imod_pipeline class and the command line interface."""
+from typing import Optional
+import zipfile
+from pathlib import PurePath
+from biobb_common.tools import file_utils as fu
+from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import result_cache
+from biobb_flexdyn.flexdyn.common import (Commands, LaunchSteps, derive_seeds, launchlogger_async, merge_pdb_models,
+                                          run_biobb_step, run_launch_steps, run_launch_steps_async, seed_options,
+                                          seeded_processes, split_count)
+from biobb_flexdyn.flexdyn.instrumentation import copy_file, instrument_launch, instrument_launch_async, phase
+from biobb_flexdyn.flexdyn.imod_imove import parse_pcs
+
+
+class ImodPipeline(BiobbObject):
+    """
+    | biobb_flexdyn ImodPipeline
+    | Wrapper of the imode, imc and imove tools
+    | Compute the normal modes of a macromolecule with imode and, from them, a Monte-Carlo IC-NMA based conformational ensemble with imc and/or the animations of principal components with imove, all of them in a single temporary folder.
+
+    Args:
+        input_pdb_path (str): Input PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure_cleaned.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        output_dat_path (str) (Optional): Output dat with normal modes. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/imod_imode_evecs.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330).
+        output_traj_path (str) (Optional): Output multi-model PDB file with the ensemble generated by imc. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/imod_imc_output.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        output_pdb_path (str) (Optional): Output multi-model PDB file with the animation of the principal component generated by imove. When several principal components are animated, one PDB file per component is written next to it (ie: output_pc1.pdb, output_pc2.pdb), or all of them are archived in it if it is a ZIP file. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/imod_imove_output.pdb>`_. Accepted formats: pdb (edam:format_1476), zip (edam:format_3987).
+        properties (dict - Python dictionary object containing the tool parameters, not input/output files):
+            * **imode_binary_path** (*str*) - ("imode_gcc") imode binary path to be used.
+            * **imc_binary_path** (*str*) - ("imc") imc binary path to be used.
+            * **imove_binary_path** (*str*) - ("imove") imove binary path to be used.
+            * **cg** (*int*) - (2) Coarse-Grained model. Values: 0 (CA), 1 (C5), 2 (Heavy atoms).
+            * **num_structs** (*int*) - (500) Number of structures to be generated by imc.
+            * **num_modes** (*int*) - (5) Number of eigenvectors to be employed by imc.
+            * **amplitude** (*int*) - (1) Amplitude linear factor to scale motion in imc.
+            * **seed** (*int*) - (None) Random seed of the imc Monte-Carlo sampling, passed to imc with the seed_flag option. Ignored if seed_flag is not set.
+            * **seed_flag** (*str*) - (None) imc command line option taking the random seed, if the installed imc has one. If not set, no seed is passed and imc seeds itself. Values: --seed (option of the imc builds taking a seed)
+            * **pc** (*int*) - (1) Principal Component animated by imove. A list of principal components (ie: [1, 2, 3]) or a string with comma separated components or ranges (ie: "1-20") animates all of them.
+            * **num_frames** (*int*) - (11) Number of frames to be generated by imove.
+            * **num_workers** (*int*) - (1) Number of concurrent imc and imove processes. The imc structures are split across the workers, each one running in its own temporary folder with a seed deterministically derived from the seed property, and every principal component is animated by its own imove process. The imc structures are only split if seed_flag is set, as processes seeded by imc itself may repeat the same structures.
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_flexdyn.flexdyn.imod_pipeline import imod_pipeline
+            prop = {
+                'num_structs' : 500,
+                'pc' : '1-5',
+                'num_workers' : 4
+            }
+            imod_pipeline(  input_pdb_path='/path/to/structure.pdb',
+                            output_traj_path='/path/to/output_ensemble.pdb',
+                            output_pdb_path='/path/to/output_anim.zip',
+                            properties=prop)
+
+    Info:
+        * wrapped_software:
+            * name: iMODS
+            * version: >=1.0.4
+            * license: other
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    def __init__(self, input_pdb_path: str, output_dat_path: Optional[str] = None,
+                 output_traj_path: Optional[str] = None, output_pdb_path: Optional[str] = None,
+                 properties: Optional[dict] = None, **kwargs) -> None:
+
+        properties = properties or {}
+
+        # Call parent class constructor
+        super().__init__(properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            'in': {'input_pdb_path': input_pdb_path},
+            'out': {'output_dat_path': output_dat_path,
+                    'output_traj_path': output_traj_path,
+                    'output_pdb_path': output_pdb_path}
+        }
+
+        # Properties specific for BB
+        self.properties = properties
+        self.imode_binary_path = properties.get('imode_binary_path', 'imode_gcc')
+        self.imc_binary_path = properties.get('imc_binary_path', 'imc')
+        self.imove_binary_path = properties.get('imove_binary_path', 'imove')
+
+        self.cg = properties.get('cg', 2)
+        self.num_structs = properties.get('num_structs', 500)
+        self.num_modes = properties.get('num_modes', 5)
+        self.amplitude = properties.get('amplitude', 1.0)
+        self.seed = properties.get('seed')
+        self.seed_flag = properties.get('seed_flag')
+        self.pc = properties.get('pc', 1)
+        self.num_frames = properties.get('num_frames', 11)
+        self.num_workers = properties.get('num_workers', 1)
+
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
+
+        # Check the properties
+        self.check_properties(properties)
+        self.check_arguments()
+
+    @launchlogger
+    @instrument_launch
+    @result_cache
+    def launch(self):
+        """Launches the execution of the FlexDyn iMOD pipeline module."""
+        return run_launch_steps(self, self.launch_steps())
+
+    @launchlogger_async
+    @instrument_launch_async
+    @result_cache
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn iMOD pipeline module as a coroutine, running the imode, imc and imove processes as an asyncio
+        subprocess that is terminated, and its temporary files removed, if the coroutine is cancelled."""
+        return await run_launch_steps_async(self, self.launch_steps())
+
+    def launch_steps(self) -> LaunchSteps:
+        """Execution of the FlexDyn iMOD pipeline module, yielding the commands to be run by :meth:`launch` or :meth:`launch_async`."""
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+
+        if not any(self.io_dict["out"].values()):
+            fu.log("ERROR: at least one of output_dat_path, output_traj_path or output_pdb_path is required", self.out_log, self.global_log)
+            return 1
+
+        # Short path sandbox shared by all the stages, as in the imod_imode, imod_imc and imod_imove blocks
+        with phase(self, 'stage_files'):
+            tmp_folder = fu.create_unique_dir()
+            fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+            self.tmp_files.append(tmp_folder)
+            copy_file(self, self.io_dict["in"]["input_pdb_path"], tmp_folder)
+        pdb_name = PurePath(self.io_dict["in"]["input_pdb_path"]).name
+        evec_name = "imods_evecs_ic.evec"  # imode appends the _ic.evec extension to the output prefix
+
+        # imode stage
+        self.cmd = ['cd', tmp_folder, ';',
+                    self.imode_binary_path, pdb_name,
+                    '-o', 'imods_evecs',
+                    '-m', str(self.cg)
+                    ]
+        yield from run_biobb_step(self)
+        if self.return_code:
+            self.remove_tmp_files()
+            return self.return_code
+
+        # imc and imove stages, all of them independent from each other
+        cmds = []
+        imc_files: list[PurePath] = []
+        if self.io_dict["out"]["output_traj_path"]:
+            imc_sizes = [size for size in split_count(int(self.num_structs), seeded_processes(self, 'imc', int(self.num_workers))) if size]
+            imc_seeds = derive_seeds(int(self.seed or 0), len(imc_sizes)) if len(imc_sizes) > 1 else [self.seed]
+            for imc_index, (imc_size, imc_seed) in enumerate(zip(imc_sizes, imc_seeds)):
+                imc_folder = tmp_folder
+                if len(imc_sizes) > 1:
+                    # Every imc shard in its own short-path folder, as the imod_imc workers
+                    with phase(self, 'stage_files'):
+                        imc_folder = fu.create_unique_dir()
+                        self.tmp_files.append(imc_folder)
+                        copy_file(self, PurePath(tmp_folder).joinpath(pdb_name), imc_folder)
+                        copy_file(self, PurePath(tmp_folder).joinpath(evec_name), imc_folder)
+                    fu.log(f"imc shard {imc_index}: {imc_size} structures, seed {imc_seed}", self.out_log, self.global_log)
+                self.cmd = ['cd', imc_folder, ';',
+                            self.imc_binary_path, pdb_name, evec_name,
+                            '-o', 'imod_ensemble',
+                            '-c', str(imc_size)
+                            ]
+                if self.num_modes:
+                    self.cmd.extend(['-n', str(self.num_modes)])
+                if self.amplitude:
+                    self.cmd.extend(['-a', str(self.amplitude)])
+                self.cmd.extend(seed_options(self, imc_seed))
+                self.create_cmd_line()
+                cmds.append(self.cmd)
+                imc_files.append(PurePath(imc_folder).joinpath('imod_ensemble.pdb'))
+
+        imove_files: list[str] = []
+        if self.io_dict["out"]["output_pdb_path"]:
+            output_path = PurePath(self.io_dict["out"]["output_pdb_path"])
+            pcs = parse_pcs(self.pc)
+            for pc in pcs:
+                imove_files.append(f"{output_path.stem}_pc{pc}.pdb")
+                self.cmd = ['cd', tmp_folder, ';',
+                            self.imove_binary_path, pdb_name, evec_name,
+                            imove_files[-1], str(pc)
+                            ]
+                if self.num_frames:
+                    self.cmd.extend(['-c', str(self.num_frames)])
+                self.create_cmd_line()
+                cmds.append(self.cmd)
+
+        if cmds:
+            fu.log(f"Running {len(imc_files)} imc and {len(imove_files)} imove processes with {self.num_workers} concurrent processes", self.out_log, self.global_log)
+            self.return_code = yield Commands(cmds, int(self.num_workers))
+        if self.return_code:
+            self.remove_tmp_files()
+            return self.return_code
+
+        # Copy only the requested outputs from the temporary folder
+        multiple_outputs = False
+        with phase(self, 'copy_to_host'):
+            if self.io_dict["out"]["output_dat_path"]:
+                copy_file(self, PurePath(tmp_folder).joinpath(evec_name), self.io_dict["out"]["output_dat_path"])
+            if imc_files:
+                merge_pdb_models(imc_files, self.io_dict["out"]["output_traj_path"])
+            if imove_files:
+                output_path = PurePath(self.io_dict["out"]["output_pdb_path"])
+                if output_path.suffix == '.zip':
+                    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+                        for imove_file in imove_files:
+                            zip_file.write(PurePath(tmp_folder).joinpath(imove_file), imove_file)
+                elif len(imove_files) == 1:
+                    copy_file(self, PurePath(tmp_folder).joinpath(imove_files[0]), output_path)
+                else:
+                    multiple_outputs = True
+                    for imove_file in imove_files:
+                        copy_file(self, PurePath(tmp_folder).joinpath(imove_file), output_path.with_name(imove_file))
+
+        # remove temporary folder(s)
+        self.remove_tmp_files()
+
+        # One output file per principal component instead of output_pdb_path
+        self.check_arguments(output_files_created=not multiple_outputs, raise_exception=False)
+
+        return self.return_code
+
+
+def imod_pipeline(input_pdb_path: str, output_dat_path: Optional[str] = None,
+                  output_traj_path: Optional[str] = None, output_pdb_path: Optional[str] = None,
+                  properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ImodPipeline <flexdyn.imod_pipeline.ImodPipeline>`flexdyn.imod_pipeline.ImodPipeline class and
+    execute :meth:`launch() <flexdyn.imod_pipeline.ImodPipeline.launch>` method"""
+    return ImodPipeline(**dict(locals())).launch()
+
+
+async def imod_pipeline_async(input_pdb_path: str, output_dat_path: Optional[str] = None,
+                              output_traj_path: Optional[str] = None, output_pdb_path: Optional[str] = None,
+                              properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ImodPipeline <flexdyn.imod_pipeline.ImodPipeline>`flexdyn.imod_pipeline.ImodPipeline class and
+    await :meth:`launch_async() <flexdyn.imod_pipeline.ImodPipeline.launch_async>` method"""
+    return await ImodPipeline(**dict(locals())).launch_async()
+
+
+imod_pipeline.__doc__ = ImodPipeline.__doc__
+main = ImodPipeline.get_main(imod_pipeline, "Compute the normal modes of a macromolecule with imode and the imc ensemble and imove animations from them in a single temporary folder.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Module containing the instrumentation of the launches of the FlexDyn blocks: duration, resources of the child
+processes and bytes copied of every phase."""
+import functools
+import json
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Union
+from biobb_common.tools import file_utils as fu
+
+
+class LaunchInstrumentation:
+    """Duration, CPU time and peak RSS of the child processes, and bytes copied of the phases of a block launch.
+
+    Phases called several times (ie: run_biobb) are accumulated. Phases may be nested (ie: run_commands
+    within a chunked generation), so their durations do not necessarily add up to the launch duration.
+    The resources of every child process are read when it is reaped (see :func:`biobb_flexdyn.flexdyn.processes.wait_process`) and recorded
+    in the phases running at that moment: the CPU time is the sum, and the peak RSS the maximum, of the child
+    processes of the phase only. The bytes copied to the sandboxes, the shards and chunks work directories and
+    back to the host (see :func:`copy_file`) are recorded in the innermost running phase.
+    """
+
+    def __init__(self) -> None:
+        self.phases: dict[str, dict] = {}
+        self.active_phases: list[dict] = []
+        self.start = time.monotonic()
+        self.wall_time: Optional[float] = None
+        self.child_cpu_time = 0.0
+        self.child_max_rss_kb = 0
+        self.num_children = 0
+        self.bytes_copied_outside_phases = 0
+        self.bytes_written = 0
+        # Child processes are reaped and files copied by the threads running the commands of a phase
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the **name** phase of the launch."""
+        start = time.monotonic()
+        with self.lock:
+            record = self.phases.setdefault(name, {'count': 0, 'wall_time': 0.0, 'num_children': 0, 'child_cpu_time': 0.0,
+                                                   'child_max_rss_kb': 0, 'bytes_copied': 0})
+            self.active_phases.append(record)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active_phases.remove(record)
+                record['count'] += 1
+                record['wall_time'] += time.monotonic() - start
+
+    def record_child(self, usage) -> None:
+        """Record the resource **usage** returned by ``os.wait4`` for a child process (including its own children)."""
+        cpu_time = usage.ru_utime + usage.ru_stime
+        with self.lock:
+            # A phase nested in itself (ie: stage_files) is counted once
+            for record in {id(record): record for record in self.active_phases}.values():
+                record['num_children'] += 1
+                record['child_cpu_time'] += cpu_time
+                record['child_max_rss_kb'] = max(record['child_max_rss_kb'], usage.ru_maxrss)
+            self.num_children += 1
+            self.child_cpu_time += cpu_time
+            self.child_max_rss_kb = max(self.child_max_rss_kb, usage.ru_maxrss)
+
+    def record_copy(self, num_bytes: int) -> None:
+        """Record **num_bytes** copied by the innermost running phase."""
+        with self.lock:
+            if self.active_phases:
+                self.active_phases[-1]['bytes_copied'] += num_bytes
+            else:
+                self.bytes_copied_outside_phases += num_bytes
+
+    @property
+    def bytes_staged(self) -> int:
+        """Bytes copied by the launch, except the outputs copied back to the host."""
+        return self.bytes_copied_outside_phases + sum(record['bytes_copied'] for name, record in self.phases.items() if name != 'copy_to_host')
+
+    def finish(self, block) -> None:
+        """Record the launch duration and the bytes written by the **block**."""
+        self.wall_time = time.monotonic() - self.start
+        self.bytes_written = _files_size(block.io_dict['out'].values())
+
+    def report(self) -> dict:
+        """Return the JSON serializable instrumentation of the launch."""
+        return {'wall_time': round(self.wall_time or 0.0, 6),
+                'num_children': self.num_children,
+                'child_cpu_time': round(self.child_cpu_time, 6),
+                'child_max_rss_kb': self.child_max_rss_kb,
+                'bytes_staged': self.bytes_staged,
+                'bytes_written': self.bytes_written,
+                'phases': {name: {**record, 'wall_time': round(record['wall_time'], 6), 'child_cpu_time': round(record['child_cpu_time'], 6)}
+                           for name, record in self.phases.items()}}
+
+
+def copy_file(block, src: Union[str, Path], dst: Union[str, Path]) -> str:
+    """``shutil.copy2`` of **src** to **dst** (a file or a directory) recording the bytes copied in the
+    instrumentation of the **block**, if any (see :func:`instrument_launch`). Return the path of the copy."""
+    copy_path = shutil.copy2(src, dst)
+    instrumentation: Optional[LaunchInstrumentation] = getattr(block, 'instrumentation', None)
+    if instrumentation is not None:
+        instrumentation.record_copy(Path(copy_path).stat().st_size)
+    return copy_path
+
+
+def _files_size(file_paths) -> int:
+    return sum(Path(file_path).stat().st_size for file_path in file_paths if file_path and Path(file_path).is_file())
+
+
+def _sandbox_copies_size(block, direction: str) -> int:
+    """Size of the **direction** ('in' or 'out') files of the **block** copied between the host and its sandbox."""
+    stage_paths = getattr(block, 'stage_io_dict', {}).get(direction, {})
+    return _files_size(stage_path for key, stage_path in stage_paths.items()
+                       if stage_path and stage_path != block.io_dict[direction].get(key))
+
+
+@contextmanager
+def phase(block, name: str, sandbox_copies: Optional[str] = None) -> Iterator[None]:
+    """Time the **name** phase of the launch of the **block**, if it is instrumented (see :func:`instrument_launch`).
+    **sandbox_copies** is the direction ('in' or 'out') of the files copied between the host and the sandbox of the
+    block in the phase (ie: by ``block.stage_files()`` or ``block.copy_to_host()``), whose size is recorded."""
+    instrumentation: Optional[LaunchInstrumentation] = getattr(block, 'instrumentation', None)
+    if instrumentation is None:
+        yield
+        return
+    with instrumentation.phase(name):
+        yield
+        if sandbox_copies:
+            instrumentation.record_copy(_sandbox_copies_size(block, sandbox_copies))
+
+
+def record_child(block, usage) -> None:
+    """Record the resource **usage** returned by ``os.wait4`` for a child process of the **block**, if it is instrumented."""
+    instrumentation: Optional[LaunchInstrumentation] = getattr(block, 'instrumentation', None)
+    if instrumentation is not None:
+        instrumentation.record_child(usage)
+
+
+def instrument_launch(launch: Callable) -> Callable:
+    """Decorator of the launch method of the blocks recording a :class:`LaunchInstrumentation` of every execution
+    in ``block.instrumentation``. The :func:`phase` blocks of the launch are timed. The summary is written to the block log and, if the block has an instrumentation_path, to that JSON file."""
+    @functools.wraps(launch)
+    def wrapper_instrumentation(block, *args, **kwargs):
+        instrumentation = block.instrumentation = LaunchInstrumentation()
+        try:
+            return_code = launch(block, *args, **kwargs)
+        finally:
+            instrumentation.finish(block)
+        _report_instrumentation(block, instrumentation, return_code)
+        return return_code
+    return wrapper_instrumentation
+
+
+def instrument_launch_async(launch_async: Callable) -> Callable:
+    """Decorator of the launch_async coroutine of the blocks, equivalent to :func:`instrument_launch`."""
+    @functools.wraps(launch_async)
+    async def wrapper_instrumentation(block, *args, **kwargs):
+        instrumentation = block.instrumentation = LaunchInstrumentation()
+        try:
+            return_code = await launch_async(block, *args, **kwargs)
+        finally:
+            instrumentation.finish(block)
+        _report_instrumentation(block, instrumentation, return_code)
+        return return_code
+    return wrapper_instrumentation
+
+
+def _report_instrumentation(block, instrumentation: LaunchInstrumentation, return_code: int) -> None:
+    report = instrumentation.report()
+    fu.log(f"Launch: {report['wall_time']:.3f} s, {report['num_children']} child processes: CPU time {report['child_cpu_time']:.3f} s, "
+           f"max RSS {report['child_max_rss_kb']} kB, {report['bytes_staged']} bytes staged, {report['bytes_written']} bytes written", block.out_log)
+    for name, record in report['phases'].items():
+        fu.log(f"  {name}: {record['wall_time']:.3f} s ({record['count']} calls), {record['num_children']} child processes: "
+               f"CPU time {record['child_cpu_time']:.3f} s, max RSS {record['child_max_rss_kb']} kB, {record['bytes_copied']} bytes copied", block.out_log)
+    instrumentation_path = getattr(block, 'instrumentation_path', None)
+    if instrumentation_path:
+        with open(instrumentation_path, 'w') as instrumentation_file:
+            json.dump({'block': type(block).__name__, 'return_code': return_code, **report}, instrumentation_file, indent=4)
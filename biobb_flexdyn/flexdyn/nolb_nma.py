@@ -1,11 +1,34 @@
 #!/usr/bin/env python3
 
 """Module containing the nolb class and the command line interface."""
-from typing import Optional
+from typing import Any, Callable, Generator, Iterator, Optional
+import os
 import shutil
+import time
 from pathlib import Path
+import numpy as np
+from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import file_hash, hash_key, result_cache
+from biobb_flexdyn.flexdyn.common import (ChunkManifest, Commands, LaunchStep, LaunchSteps, StreamingCommands,
+                                          derive_seeds, launchlogger_async, merge_pdb_models, run_biobb_step,
+                                          run_launch_steps, run_launch_steps_async, seed_options, seeded_processes,
+                                          split_chunks, split_count)
+from biobb_flexdyn.flexdyn.instrumentation import instrument_launch, instrument_launch_async, phase
+from biobb_flexdyn.flexdyn.streaming import StreamFrame, is_streaming
+from biobb_flexdyn.flexdyn.ensemble import write_trajectory
+
+
+# Minimization settings of the presets: --dist, --nSteps and --tol NOLB options
+MINIMIZATION_PRESETS: dict[str, Optional[dict]] = {
+    'default': {'dist': 1.0, 'steps': 5000, 'tol': 0.001},
+    'balanced': {'dist': 1.0, 'steps': 2000, 'tol': 0.005},
+    'fast': {'dist': 1.0, 'steps': 500, 'tol': 0.01},
+    'none': None
+}
+# Rounds of replacement of the clashing structures by structures generated with the default minimization preset
+REMINIMIZATION_ROUNDS = 3
 
 
 class Nolb_nma(BiobbObject):
@@ -16,11 +39,29 @@ class Nolb_nma(BiobbObject):
 
     Args:
         input_pdb_path (str): Input PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure.pdb>`_. Accepted formats: pdb (edam:format_1476).
-        output_pdb_path (str): Output multi-model PDB file with the generated ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/nolb_output.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        output_pdb_path (str): Output multi-model PDB file, or XTC, DCD or NPZ trajectory, with the generated ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/nolb_output.pdb>`_. Accepted formats: pdb (edam:format_1476), xtc (edam:format_3875), dcd (edam:format_3878), npz (edam:format_4003).
+        output_top_path (str) (Optional): Output PDB file with the first structure of the ensemble, giving the atoms of the frames of the XTC and DCD trajectories. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure.pdb>`_. Accepted formats: pdb (edam:format_1476).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **num_structs** (*int*) - (500) Number of structures to be generated
             * **cutoff** (*float*) - (5.0) This options specifies the interaction cutoff distance for the elastic network models (in angstroms), 5 by default. The Hessian matrix is constructed according to this interaction distance. Some artifacts should be expected for too short distances (< 5 Å).
             * **rmsd** (*float*) - (1.0) Maximum RMSd for decoy generation.
+            * **seed** (*int*) - (None) Random seed of the decoys generation, passed to NOLB with the seed_flag option. Ignored if seed_flag is not set.
+            * **seed_flag** (*str*) - (None) NOLB command line option taking the random seed, if the installed NOLB has one. If not set, no seed is passed and NOLB seeds itself. Values: --seed (option of the NOLB builds taking a seed)
+            * **minimization** (*str*) - ("default") Minimization preset of the generated structures, from the highest quality to the highest throughput. Values: default (Up to 5000 steps with 0.001 tolerance), balanced (Up to 2000 steps with 0.005 tolerance), fast (Up to 500 steps with 0.01 tolerance), none (The structures are not minimized).
+            * **min_steps** (*int*) - (None) Maximum number of minimization steps of every structure. If set, it overrides the value of the minimization preset.
+            * **min_tol** (*float*) - (None) Tolerance of the minimization. If set, it overrides the value of the minimization preset.
+            * **min_dist** (*float*) - (None) Distance (in angstroms) of the minimization restraints. If set, it overrides the value of the minimization preset.
+            * **reminimize_clashes** (*bool*) - (False) Compute the clash score of every generated structure and replace the structures with more than max_clashes clashes by structures generated with the default minimization preset (NOLB can not minimize existing structures), scored as well, in up to 3 rounds. Requires seed_flag, the replacements being generated with seeds different from the ones of the replaced structures.
+            * **clash_distance** (*float*) - (2.0) Distance (in angstroms) below which two heavy atoms of non-adjacent residues are considered clashing.
+            * **max_clashes** (*int*) - (0) Maximum number of clashes of a structure not re-minimized.
+            * **chunk_size** (*int*) - (0) Number of structures generated per chunk. If greater than 0, the structures are generated in chunks with seeds derived from the seed property, and every completed chunk is recorded in a checkpoint, so that relaunching an interrupted execution only generates the missing chunks. The checkpoint is removed once all the chunks are merged. Requires seed_flag, so that the chunks do not repeat the same structures.
+            * **num_workers** (*int*) - (1) Number of concurrent NOLB processes. The structures are split across the processes, with distinct output prefixes and seeds deterministically derived from the seed property, and merged in output_pdb_path with renumbered models, so that the ensemble only depends on the seed and the number of workers. Together with chunk_size, number of chunks generated concurrently. Requires seed_flag: if it is not set, a single NOLB process is run, as processes seeded by NOLB itself may repeat the same structures.
+            * **checkpoint_path** (*str*) - (None) Path to the checkpoint directory of the chunks. If not set, a directory named after the inputs and properties is created in the sandbox_path, so that a relaunch with the same inputs and properties finds it.
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -36,6 +77,23 @@ class Nolb_nma(BiobbObject):
                     output_pdb_path='/path/to/output.pdb',
                     properties=prop)
 
+        The structures can be processed while NOLB is still generating them, stopping the generation once
+        enough have been produced, passing the frame_callback and stop_condition arguments::
+
+            nolb_nma(   input_pdb_path='/path/to/structure.pdb',
+                    output_pdb_path='/path/to/output.pdb',
+                    properties=prop,
+                    frame_callback=lambda frame: print(frame.index, frame.rate, frame.eta),
+                    stop_condition=lambda frame: frame.index >= 10)
+
+        Many executions can be run concurrently from a single asyncio event loop awaiting the nolb_nma_async
+        function (or the launch_async method); cancelling it terminates NOLB and removes its temporary files::
+
+            from biobb_flexdyn.flexdyn.nolb_nma import nolb_nma_async
+            await asyncio.gather(*(nolb_nma_async(input_pdb_path='/path/to/structure.pdb',
+                                                  output_pdb_path=f'/path/to/output_{seed}.pdb',
+                                                  properties={**prop, 'seed': seed}) for seed in range(1, 101)))
+
     Info:
         * wrapped_software:
             * name: NOLB
@@ -48,7 +106,10 @@ class Nolb_nma(BiobbObject):
     """
 
     def __init__(self, input_pdb_path: str, output_pdb_path: str,
-                 properties: Optional[dict] = None, **kwargs) -> None:
+                 output_top_path: Optional[str] = None,
+                 properties: Optional[dict] = None,
+                 frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+                 stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -59,7 +120,8 @@ class Nolb_nma(BiobbObject):
         # Input/Output files
         self.io_dict = {
             'in': {'input_pdb_path': input_pdb_path},
-            'out': {'output_pdb_path': output_pdb_path}
+            'out': {'output_pdb_path': output_pdb_path,
+                    'output_top_path': output_top_path}
         }
 
         # Properties specific for BB
@@ -70,80 +132,372 @@ class Nolb_nma(BiobbObject):
         # self.num_modes = properties.get('num_modes', 10)
         self.cutoff = properties.get('cutoff', 5.0)
         self.rmsd = properties.get('rmsd', 1.0)
+        self.seed = properties.get('seed')
+        self.seed_flag = properties.get('seed_flag')
+        self.minimization = properties.get('minimization', 'default')
+        self.min_steps = properties.get('min_steps')
+        self.min_tol = properties.get('min_tol')
+        self.min_dist = properties.get('min_dist')
+        self.reminimize_clashes = properties.get('reminimize_clashes', False)
+        self.clash_distance = properties.get('clash_distance', 2.0)
+        self.max_clashes = properties.get('max_clashes', 0)
+        self.chunk_size = properties.get('chunk_size', 0)
+        self.num_workers = properties.get('num_workers', 1)
+        self.checkpoint_path = properties.get('checkpoint_path')
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
+
+        # Live streaming of the generated structures (see biobb_flexdyn.flexdyn.streaming.StreamFrame)
+        self.frame_callback = frame_callback
+        self.stop_condition = stop_condition
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
     @launchlogger
+    @instrument_launch
+    @result_cache
     def launch(self):
         """Launches the execution of the FlexDyn NOLB module."""
+        return run_launch_steps(self, self.launch_steps())
+
+    @launchlogger_async
+    @instrument_launch_async
+    @result_cache
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn NOLB module as a coroutine, running the NOLB processes as an asyncio
+        subprocess that is terminated, and its temporary files removed, if the coroutine is cancelled."""
+        return await run_launch_steps_async(self, self.launch_steps())
+
+    def launch_steps(self) -> LaunchSteps:
+        """Execution of the FlexDyn NOLB module, yielding the commands to be run by :meth:`launch` or :meth:`launch_async`."""
 
         # Setup Biobb
         if self.check_restart():
             return 0
-        self.stage_files()
+        if self.minimization not in MINIMIZATION_PRESETS:
+            fu.log(f"ERROR: unknown minimization preset {self.minimization}, valid values: {', '.join(MINIMIZATION_PRESETS)}", self.out_log, self.global_log)
+            return 1
+        with phase(self, 'stage_files', sandbox_copies='in'):
+            self.stage_files()
 
         # Output temporary file
         out_file_prefix = Path(self.stage_io_dict.get("unique_dir", "")).joinpath("nolb_ensemble")
         out_file = Path(self.stage_io_dict.get("unique_dir", "")).joinpath("nolb_ensemble_nlb_decoys.pdb")
 
+        # The workers and chunks need a seed each
+        num_workers = seeded_processes(self, 'NOLB', int(self.num_workers))
+        if self.chunk_size and not self.seed_flag:
+            fu.log("WARNING: the seed_flag property is not set, the structures are not generated in chunks", self.out_log, self.global_log)
+        start = time.monotonic()
+        if self.chunk_size and self.seed_flag:
+            yield from self.run_chunks(out_file, num_workers)
+        elif num_workers > 1:
+            yield from self.run_workers(out_file, num_workers)
+        else:
+            self.cmd = self.create_nolb_cmd(out_file_prefix, self.num_structs, self.seed)
+
+            # Run Biobb block
+            if is_streaming(self):
+                self.create_cmd_line()
+                self.return_code, stopped = yield StreamingCommands([self.cmd], [out_file], self.num_structs)
+                if stopped:
+                    fix_num_models(out_file)
+            else:
+                yield from run_biobb_step(self)
+        generation_time = time.monotonic() - start
+
+        if self.reminimize_clashes and not self.seed_flag:
+            fu.log("WARNING: the seed_flag property is not set, the clashing structures are not replaced", self.out_log, self.global_log)
+        if not self.return_code:
+            reminimized = (yield from self.reminimize(out_file)) if self.reminimize_clashes and self.seed_flag else None
+            self.log_minimization_time(generation_time, reminimized)
+
+        # Copying generated output file to the final (user-given) file name, converted to XTC, DCD or NPZ if needed
+        if not self.return_code:
+            with phase(self, 'write_trajectory'):
+                write_trajectory(out_file, self.stage_io_dict["out"]["output_pdb_path"], self.stage_io_dict["out"].get("output_top_path"))
+
+        # Copy files to host
+        with phase(self, 'copy_to_host', sandbox_copies='out'):
+            self.copy_to_host()
+
+        # remove temporary folder(s)
+        self.remove_tmp_files()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+    def minimization_settings(self) -> Optional[dict]:
+        """Return the --dist, --nSteps and --tol values of the minimization preset overridden by the min_dist,
+        min_steps and min_tol properties, or None if the structures are not minimized."""
+        preset = MINIMIZATION_PRESETS[self.minimization]
+        if preset is None:
+            return None
+        return {'dist': preset['dist'] if self.min_dist is None else self.min_dist,
+                'steps': preset['steps'] if self.min_steps is None else self.min_steps,
+                'tol': preset['tol'] if self.min_tol is None else self.min_tol}
+
+    def create_nolb_cmd(self, out_file_prefix: Path, num_structs: Optional[int], seed: Optional[int],
+                        minimization: Optional[dict] = None) -> list[str]:
+        """Build the NOLB command line generating **num_structs** decoys with **seed** to **out_file_prefix**_nlb_decoys.pdb,
+        minimized with the **minimization** settings (ie: MINIMIZATION_PRESETS['default']) or with the minimization properties if not set."""
+        minimization = minimization or self.minimization_settings()
         # Command line
         # ./NOLB 1ake_monomer.pdb -s 100 --rmsd 5 -m  -o patata # Output: patata_nlb_decoys.pdb
-        self.cmd = [self.binary_path,
-                    str(Path(self.stage_io_dict["in"]["input_pdb_path"]).relative_to(Path.cwd())),
-                    "-o", str(out_file_prefix),
-                    "-m"  # Minimizing the generated structures by default
-                    ]
+        cmd = [self.binary_path,
+               str(Path(self.stage_io_dict["in"]["input_pdb_path"]).relative_to(Path.cwd())),
+               "-o", str(out_file_prefix)
+               ]
+
+        if minimization:
+            cmd.append('-m')  # Minimizing the generated structures
 
         # Properties
-        if self.num_structs:
-            self.cmd.append('-s')
-            self.cmd.append(str(self.num_structs))
+        if num_structs:
+            cmd.append('-s')
+            cmd.append(str(num_structs))
 
         # Num modes is deactivated for the decoys generation. CHECK!
         #  * **num_modes** (*int*) - (10) Number of non-trivial modes to compute, 10 by default. If this number exceeds the size of the Hessian matrix, it will be adapted accordingly.
         # if self.num_modes:
-        #    self.cmd.append('-n')
-        #    self.cmd.append(str(self.num_modes))
+        #    cmd.append('-n')
+        #    cmd.append(str(self.num_modes))
 
         if self.cutoff:
-            self.cmd.append('-c')
-            self.cmd.append(str(self.cutoff))
+            cmd.append('-c')
+            cmd.append(str(self.cutoff))
 
         if self.rmsd:
-            self.cmd.append('--rmsd')
-            self.cmd.append(str(self.rmsd))
-
-        # --dist 1 -m --nSteps 5000 --tol 0.001
-        self.cmd.append("--dist 1 --nSteps 5000 --tol 0.001")
-
-        # Run Biobb block
-        self.run_biobb()
+            cmd.append('--rmsd')
+            cmd.append(str(self.rmsd))
 
-        # Copying generated output file to the final (user-given) file name
-        shutil.copy2(out_file, self.stage_io_dict["out"]["output_pdb_path"])
+        cmd.extend(seed_options(self, seed))
 
-        # Copy files to host
-        self.copy_to_host()
-
-        # remove temporary folder(s)
-        self.remove_tmp_files()
-
-        self.check_arguments(output_files_created=True, raise_exception=False)
-
-        return self.return_code
+        # --dist 1 -m --nSteps 5000 --tol 0.001
+        if minimization:
+            cmd.extend(['--dist', str(minimization['dist']), '--nSteps', str(minimization['steps']), '--tol', str(minimization['tol'])])
+
+        return cmd
+
+    def run_chunks(self, out_file: Path, num_workers: int) -> Generator[Commands, int, None]:
+        """Generate num_structs decoys in chunks of chunk_size decoys, at most **num_workers** at a time, with seeds
+        derived from the seed property, recording the completed chunks in the checkpoint so that a relaunch only generates the missing ones,
+        and merge them into **out_file**."""
+        sizes = split_chunks(int(self.num_structs), int(self.chunk_size))
+        seeds = derive_seeds(int(self.seed or 0), len(sizes))
+        key = hash_key(file_hash(self.io_dict['in']['input_pdb_path']), self.binary_path, self.cutoff, self.rmsd, self.minimization_settings())
+        checkpoint_dir = self.checkpoint_path or str(Path(self.sandbox_path).joinpath(f"nolb_checkpoint_{key[:16]}"))
+        manifest = ChunkManifest(checkpoint_dir, key, sizes, seeds, self.out_log, self.global_log)
+        if is_streaming(self):
+            fu.log("WARNING: frame streaming is not available when generating the structures in chunks", self.out_log, self.global_log)
+
+        pending = manifest.missing()
+        cmds = []
+        for chunk_index in pending:
+            # Discard the partial outputs of an interrupted chunk
+            chunk_dir = str(manifest.chunk_dir(chunk_index))
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+            fu.create_dir(chunk_dir)
+            fu.log(f"Chunk {chunk_index}: {sizes[chunk_index]} structures, seed {seeds[chunk_index]}", self.out_log, self.global_log)
+            self.cmd = self.create_nolb_cmd(Path(chunk_dir).joinpath("nolb_ensemble"), sizes[chunk_index], seeds[chunk_index])
+            self.create_cmd_line()
+            cmds.append(self.cmd)
+
+        self.return_code = yield Commands(cmds, num_workers,
+                                          on_success=lambda cmd_index: manifest.mark_completed(pending[cmd_index]))
+        if self.return_code:
+            return
+
+        with phase(self, 'merge_outputs'):
+            merge_pdb_models([manifest.chunk_dir(chunk_index).joinpath("nolb_ensemble_nlb_decoys.pdb") for chunk_index in range(len(sizes))], out_file)
+            fix_num_models(out_file)
+        # The run is complete, the checkpoint is no longer needed
+        self.tmp_files.append(checkpoint_dir)
+
+    def run_workers(self, out_file: Path, num_workers: int) -> Generator[LaunchStep, Any, None]:
+        """Split num_structs across **num_workers** concurrent NOLB processes, each one writing to its own output
+        prefix with a seed derived from the seed property, and merge their decoys into **out_file**."""
+        worker_sizes = [size for size in split_count(int(self.num_structs), num_workers) if size]
+        worker_seeds = derive_seeds(int(self.seed or 0), len(worker_sizes))
+
+        cmds, out_files = [], []
+        for worker_index, (worker_size, worker_seed) in enumerate(zip(worker_sizes, worker_seeds)):
+            out_file_prefix = out_file.with_name(f"nolb_ensemble_{worker_index}")
+            fu.log(f"Worker {worker_index}: {worker_size} structures, seed {worker_seed}", self.out_log, self.global_log)
+            self.cmd = self.create_nolb_cmd(out_file_prefix, worker_size, worker_seed)
+            self.create_cmd_line()
+            cmds.append(self.cmd)
+            out_files.append(out_file.with_name(f"nolb_ensemble_{worker_index}_nlb_decoys.pdb"))
+
+        stopped = False
+        if is_streaming(self):
+            # The workers run all at once, so the streamed frames come from all of them
+            self.return_code, stopped = yield StreamingCommands(cmds, out_files, int(self.num_structs))
+        else:
+            self.return_code = yield Commands(cmds, num_workers)
+        if self.return_code:
+            return
+
+        # When stopped, the workers that had not written any structure yet have no output file
+        with phase(self, 'merge_outputs'):
+            num_models = merge_pdb_models([path for path in out_files if not stopped or path.exists()], out_file)
+            fix_num_models(out_file)
+        fu.log(f"Merged {num_models} structures from {len(out_files)} workers", self.out_log, self.global_log)
+
+    def reminimize(self, out_file: Path) -> Generator[Commands, int, Optional[tuple[int, float]]]:
+        """Replace the decoys of **out_file** with more than max_clashes clashes by decoys generated with the
+        default minimization preset. Return the number of decoys replaced and the time spent generating them.
+
+        NOLB only minimizes the decoys it generates, it can not minimize the given structures, so the clashing
+        decoys are replaced rather than re-minimized. The replacements are scored as well: for up to
+        REMINIMIZATION_ROUNDS rounds, new decoys are generated for the slots still clashing, and a slot only takes
+        a replacement with fewer clashes than its current decoy."""
+        scores = clash_scores(out_file, self.clash_distance)
+        clashing = [int(index) for index in np.flatnonzero(scores > self.max_clashes)]
+        fu.log(f"{len(clashing)} of {len(scores)} structures with more than {self.max_clashes} clashes", self.out_log, self.global_log)
+        if not clashing:
+            return 0, 0.0
+
+        start = time.monotonic()
+        replacements: dict[int, str] = {}
+        pending = clashing
+        # Deterministic for a given seed property, but different from the seed of the replaced structures
+        for round_index, seed in enumerate(derive_seeds(int(self.seed or 0) + 1, REMINIMIZATION_ROUNDS)):
+            out_file_prefix = out_file.with_name(f"nolb_reminimized_{round_index}")
+            self.cmd = self.create_nolb_cmd(out_file_prefix, len(pending), seed, MINIMIZATION_PRESETS['default'])
+            yield from run_biobb_step(self)
+            if self.return_code:
+                return None
+            decoys_file = out_file.with_name(f"{out_file_prefix.name}_nlb_decoys.pdb")
+            for index, decoy, score in zip(pending, iter_pdb_models(decoys_file), clash_scores(decoys_file, self.clash_distance)):
+                if score < scores[index]:
+                    replacements[index], scores[index] = decoy, score
+            pending = [index for index in pending if scores[index] > self.max_clashes]
+            fu.log(f"Round {round_index + 1}: {len(pending)} structures still with more than {self.max_clashes} clashes", self.out_log, self.global_log)
+            if not pending:
+                break
+        replace_models(out_file, replacements)
+        if pending:
+            fu.log(f"WARNING: {len(pending)} structures keep more than {self.max_clashes} clashes after {REMINIMIZATION_ROUNDS} rounds "
+                   f"of replacement: {', '.join(str(index + 1) for index in pending)}", self.out_log, self.global_log)
+        return len(replacements), time.monotonic() - start
+
+    def log_minimization_time(self, generation_time: float, reminimized: Optional[tuple[int, float]]) -> None:
+        """Log the time spent generating the structures and, if they were minimized with fewer steps than the default
+        preset, the time saved compared with generating them with the default preset, estimated from the number of
+        minimization steps. The time spent replacing the **reminimized** structures is added to the time spent."""
+        settings, default = self.minimization_settings(), MINIMIZATION_PRESETS['default']
+        if settings == default and not self.reminimize_clashes:
+            return
+        num_reminimized, reminimization_time = reminimized or (0, 0.0)
+        total_time = generation_time + reminimization_time
+        message = f"Structures generated in {total_time:.2f} s ({num_reminimized} replaced in {reminimization_time:.2f} s)"
+        if settings and settings['steps'] and settings != default:
+            # The minimization dominates the runtime, that scales at most with the number of steps
+            default_time = generation_time * default['steps'] / settings['steps']
+            message += f", estimated {default_time:.2f} s with the default minimization: {default_time - total_time:.2f} s saved"
+        fu.log(message, self.out_log, self.global_log)
+
+
+def fix_num_models(pdb_path: Path) -> None:
+    """Set the NUMMDL record of the multi-model **pdb_path** to its number of models."""
+    with open(pdb_path) as pdb_file:
+        num_models = sum(1 for line in pdb_file if line.startswith('MODEL'))
+    _rewrite_lines(pdb_path, lambda lines: (f"NUMMDL    {num_models:<4d}\n" if line.startswith('NUMMDL') else line for line in lines))
+
+
+def iter_pdb_models(pdb_path: Path) -> Iterator[str]:
+    """Yield the text of every model (from the MODEL to the ENDMDL record) of the multi-model **pdb_path**."""
+    model: list[str] = []
+    with open(pdb_path) as pdb_file:
+        for line in pdb_file:
+            if line.startswith('MODEL'):
+                model = []
+            model.append(line)
+            if line.startswith('ENDMDL'):
+                yield ''.join(model)
+
+
+def replace_models(pdb_path: Path, replacements: dict[int, str]) -> None:
+    """Replace the models of the multi-model **pdb_path** whose 0-based index is a key of **replacements**
+    by its value, keeping the original MODEL and ENDMDL records."""
+    def replaced_lines(lines: Iterator[str]) -> Iterator[str]:
+        model_index, skipping = -1, False
+        for line in lines:
+            if line.startswith('MODEL'):
+                model_index += 1
+                skipping = model_index in replacements
+                yield line
+                if skipping:
+                    yield from (replacement_line for replacement_line in replacements[model_index].splitlines(keepends=True)
+                                if not replacement_line.startswith(('MODEL', 'ENDMDL')))
+            elif line.startswith('ENDMDL'):
+                skipping = False
+                yield line
+            elif not skipping:
+                yield line
+
+    _rewrite_lines(pdb_path, replaced_lines)
+
+
+def _rewrite_lines(pdb_path: Path, rewrite: Callable[[Iterator[str]], Iterator[str]]) -> None:
+    """Stream the lines of **pdb_path** through **rewrite** to a temporary file then renamed over **pdb_path**,
+    so that the file is never loaded at once."""
+    tmp_path = pdb_path.with_name(f"{pdb_path.name}.tmp")
+    with open(pdb_path) as pdb_file, open(tmp_path, 'w') as tmp_file:
+        tmp_file.writelines(rewrite(pdb_file))
+    os.replace(tmp_path, pdb_path)
+
+
+def clash_scores(pdb_path: Path, clash_distance: float) -> np.ndarray:
+    """Return the number of pairs of heavy atoms of non-adjacent residues closer than **clash_distance**
+    in every model of the multi-model **pdb_path**."""
+    # SciPy is only needed by the clash-driven re-minimization, not when the module is imported
+    from scipy.spatial import cKDTree  # type: ignore
+    scores = []
+    residues = heavy = None
+    for model in iter_pdb_models(pdb_path):
+        atom_lines = [line for line in model.splitlines() if line.startswith(('ATOM', 'HETATM'))]
+        if residues is None:
+            # Same topology in all the models
+            residues = np.array([(ord(line[21]) << 20) + int(line[22:26]) for line in atom_lines])
+            heavy = np.array([(line[76:78].strip() or line[12:16].strip()[0]) != 'H' for line in atom_lines])
+        coords = np.array([[float(line[30:38]), float(line[38:46]), float(line[46:54])] for line in atom_lines])[heavy]
+        pairs = cKDTree(coords).query_pairs(clash_distance, output_type='ndarray')
+        # Same chain (upper bits) and consecutive residue numbers are bonded
+        residue_gap = np.abs(residues[heavy][pairs[:, 0]] - residues[heavy][pairs[:, 1]])
+        scores.append(int(np.count_nonzero(residue_gap > 1)))
+    return np.array(scores, dtype=int)
 
 
 def nolb_nma(input_pdb_path: str, output_pdb_path: str,
-             properties: Optional[dict] = None, **kwargs) -> int:
+             output_top_path: Optional[str] = None,
+             properties: Optional[dict] = None,
+             frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+             stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> int:
     """Create :class:`Nolb_nma <flexdyn.nolb_nma.Nolb_nma>`flexdyn.nolb_nma.Nolb_nma class and
     execute :meth:`launch() <flexdyn.nolb_nma.Nolb_nma.launch>` method"""
     return Nolb_nma(**dict(locals())).launch()
 
 
+async def nolb_nma_async(input_pdb_path: str, output_pdb_path: str,
+                         output_top_path: Optional[str] = None,
+                         properties: Optional[dict] = None,
+                         frame_callback: Optional[Callable[[StreamFrame], None]] = None,
+                         stop_condition: Optional[Callable[[StreamFrame], bool]] = None, **kwargs) -> int:
+    """Create :class:`Nolb_nma <flexdyn.nolb_nma.Nolb_nma>`flexdyn.nolb_nma.Nolb_nma class and
+    await :meth:`launch_async() <flexdyn.nolb_nma.Nolb_nma.launch_async>` method"""
+    return await Nolb_nma(**dict(locals())).launch_async()
+
+
 nolb_nma.__doc__ = Nolb_nma.__doc__
-main = Nolb_nma.get_main(nolb_nma, "Generate an ensemble of structures using the NOLB (NOn-Linear rigid Block) NMA tool.")
+main = Nolb_nma.get_main(nolb_nma, "Generate an ensemble of structures using the NOLB (NOn-Linear rigid Block) NMA tool.", custom_flags={"output_pdb_path": "-o"})
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,404 @@
+"""Module containing the vectorized fixed-column reader and writer of the multi-model PDB files of the FlexDyn ensembles."""
+import re
+from pathlib import Path
+from typing import Iterator, Optional, Union
+import numpy as np
+from biobb_flexdyn.flexdyn.trajectory import TrajectoryWriter
+
+# Models parsed at a time by iter_pdb_chunks
+CHUNK_SIZE = 1000
+# Bytes read at a time, rounded to whole lines (or whole models when parsing coordinates)
+BLOCK_SIZE = 1 << 24
+# x, y and z fields of the ATOM and HETATM records: 8 characters from column 31
+COORDS_START = 30
+FIELD_WIDTH = 8
+MODEL_FORMAT = b'MODEL%9d\n'
+ENDMDL_LINE = b'ENDMDL'.ljust(80) + b'\n'
+END_LINE = b'END'.ljust(80) + b'\n'
+ATOM_RECORDS = (b'ATOM  ', b'HETATM')
+# Largest decimal atom serial, larger ones being written in hexadecimal by ProDy up to the 5 columns of the field
+MAX_SERIAL = 99999
+MAX_HEX_SERIAL = 0xfffff
+SERIAL_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+# Digits of the hybrid-36 numbers, upper case ones going first
+HYBRID36_UPPER = frozenset('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+HYBRID36_LOWER = frozenset('0123456789abcdefghijklmnopqrstuvwxyz')
+# Characters of the integer part (-999 to 9999, and -0) and of the 3 decimals of the %8.3f fields
+NEGATIVE_INTEGERS = 1000
+INTEGER_CHARS = np.frombuffer(b''.join(b'%4s' % (b'-%d' % value) for value in range(999, -1, -1))
+                              + b''.join(b'%4d' % value for value in range(10000)), dtype=np.uint8).reshape(-1, 4)
+FRACTION_CHARS = np.frombuffer(b''.join(b'%03d' % value for value in range(1000)), dtype=np.uint8).reshape(-1, 3)
+
+
+def iter_line_blocks(pdb_path: Union[str, Path], block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield the content of **pdb_path** in blocks of about **block_size** bytes made of whole lines."""
+    with open(pdb_path, 'rb') as pdb_file:
+        pending = b''
+        while True:
+            data = pdb_file.read(block_size)
+            if not data:
+                break
+            block = pending + data
+            end = block.rfind(b'\n') + 1
+            if end:
+                yield block[:end]
+            pending = block[end:]
+    if pending:
+        yield pending
+
+
+def count_pdb_models(pdb_path: Union[str, Path]) -> int:
+    """Returns the number of models of the multi-model **pdb_path**, 1 for a single structure without MODEL/ENDMDL records."""
+    num_models = 0
+    has_atoms = False
+    for block in iter_line_blocks(pdb_path):
+        num_models += block.startswith(b'ENDMDL') + block.count(b'\nENDMDL')
+        has_atoms = has_atoms or bool(re.search(rb'^(?:ATOM|HETATM)', block, re.MULTILINE))
+    return num_models or int(has_atoms)
+
+
+def iter_pdb_chunks(pdb_path: Union[str, Path], chunk_size: int = CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """Yield the (n_frames, n_atoms, 3) float64 coordinates (Angstroms) of the models of the multi-model **pdb_path**,
+    in arrays of at most **chunk_size** models.
+
+    The file is read in blocks of whole models and the coordinate columns of all the ATOM and HETATM records of a
+    block are parsed at once, without splitting the file in lines."""
+    block_size = BLOCK_SIZE
+    pending = b''
+    with open(pdb_path, 'rb') as pdb_file:
+        while True:
+            data = pdb_file.read(block_size)
+            buffer = pending + data
+            end = _models_end(buffer) if data else len(buffer)
+            if data and not end:
+                # Not a single complete model yet
+                pending = buffer
+                block_size *= 2
+                continue
+            pending = buffer[end:]
+            coords = parse_pdb_models(buffer[:end], pdb_path)
+            if len(coords):
+                # About chunk_size models per block from now on, bounded to keep the parsing buffers small
+                block_size = min(max(end // len(coords) * chunk_size, 1 << 16), BLOCK_SIZE)
+            for start in range(0, len(coords), chunk_size):
+                yield coords[start:start + chunk_size]
+            if not data:
+                break
+
+
+def read_pdb_coords(pdb_path: Union[str, Path]) -> np.ndarray:
+    """Returns the (n_frames, n_atoms, 3) float64 coordinates (Angstroms) of all the models of the multi-model **pdb_path**."""
+    chunks = list(iter_pdb_chunks(pdb_path))
+    return np.concatenate(chunks) if chunks else np.empty((0, 0, 3))
+
+
+def parse_pdb_models(buffer: bytes, pdb_path: Union[str, Path] = '') -> np.ndarray:
+    """Returns the (n_frames, n_atoms, 3) float64 coordinates of the ATOM and HETATM records of the complete models
+    (ending with an ENDMDL record, or a single structure without MODEL/ENDMDL records) of the PDB text **buffer**.
+
+    The models after the first one are usually written with the same records and field widths, only their coordinates
+    changing: if all of them have the byte layout of the first model, they are read as the rows of a 2D array at the
+    offsets of its coordinate fields, without locating their lines."""
+    coords = _parse_regular_models(buffer, pdb_path)
+    if coords is not None:
+        return coords
+    return _parse_pdb_lines(buffer, pdb_path)
+
+
+def _parse_regular_models(buffer: bytes, pdb_path: Union[str, Path] = '') -> Optional[np.ndarray]:
+    """Returns the coordinates of the models of **buffer** (see :func:`parse_pdb_models`) if all of them have the atom
+    records of the first model with the same byte layout, None otherwise."""
+    first_endmdl = buffer.find(b'\nENDMDL') + 1
+    first_atom = re.search(rb'^(?:ATOM  |HETATM)', buffer[:first_endmdl], re.MULTILINE) if first_endmdl else None
+    if not first_atom:
+        return None
+    # Lines of the first model from its first atom record to its ENDMDL record, expected just before every ENDMDL record
+    template = buffer[first_atom.start():first_endmdl]
+    newlines = np.flatnonzero(np.frombuffer(template, dtype=np.uint8) == ord('\n'))
+    starts = np.concatenate(([0], newlines[:-1] + 1))
+    atom_starts = np.array([start for start in starts if template[start:start + 6] in ATOM_RECORDS], dtype=np.int64)
+    if (newlines[np.searchsorted(starts, atom_starts)] - atom_starts < COORDS_START + 3 * FIELD_WIDTH).any():
+        # Reported by the line by line parsing
+        return None
+
+    # The next ENDMDL record is looked for after the length of the template, so only the records between the models
+    # (ENDMDL, MODEL...) are scanned: they must not hold atom records, and together with the ones of the template
+    # they must hold all the newlines of the buffer
+    offsets = []
+    num_newlines = buffer.count(b'\n', 0, first_atom.start())
+    endmdl = first_endmdl
+    while endmdl:
+        offsets.append(endmdl - len(template))
+        next_endmdl = buffer.find(b'\nENDMDL', endmdl + len(template) + 6) + 1
+        gap = buffer[endmdl:next_endmdl - len(template) if next_endmdl else len(buffer)]
+        if (next_endmdl and not gap.endswith(b"\n")) or b"\nENDMDL" in gap or re.search(rb'^(?:ATOM  |HETATM)', gap, re.MULTILINE):
+            return None
+        num_newlines += len(newlines) + gap.count(b'\n')
+        endmdl = next_endmdl
+    if len(offsets) < 2 or buffer.count(b'\n') != num_newlines:
+        return None
+    # The newlines and the record names of the template in all the models, every model being followed by its ENDMDL
+    # record so that the windows of its last line stay within the buffer
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offsets_array = np.array(offsets, dtype=np.int64)[:, np.newaxis]
+    if not (data[offsets_array + newlines] == ord('\n')).all():
+        return None
+    names = np.lib.stride_tricks.sliding_window_view(data, 6)
+    if not (names[offsets_array + starts] == names[offsets[0] + starts]).all():
+        return None
+    fields = np.lib.stride_tricks.sliding_window_view(data, 3 * FIELD_WIDTH)[offsets_array + atom_starts + COORDS_START]
+    return parse_fields(fields.reshape(-1, FIELD_WIDTH)).reshape(len(offsets), len(atom_starts), 3)
+
+
+def _parse_pdb_lines(buffer: bytes, pdb_path: Union[str, Path] = '') -> np.ndarray:
+    """Line by line version of :func:`parse_pdb_models`, locating the atom records of any layout."""
+    if not buffer:
+        return np.empty((0, 0, 3))
+    # Padded so that the first 8 bytes of every line can be read
+    data = np.frombuffer(buffer + b'\n' * 8, dtype=np.uint8)
+    newlines = np.flatnonzero(data[:len(buffer)] == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.append(newlines, len(buffer))
+    if starts[-1] == len(buffer):
+        starts, ends = starts[:-1], ends[:-1]
+    # Record name of every line: its first 6 bytes, as a little-endian integer
+    records = np.lib.stride_tricks.sliding_window_view(data, 8)[starts].view('<u8')[:, 0] & np.uint64(0xFFFFFFFFFFFF)
+    is_atom = np.isin(records, [_record_key(record) for record in ATOM_RECORDS])
+    atom_lines = np.flatnonzero(is_atom)
+    if not len(atom_lines):
+        return np.empty((0, 0, 3))
+    short = np.flatnonzero(ends[atom_lines] - starts[atom_lines] < COORDS_START + 3 * FIELD_WIDTH)
+    if len(short):
+        line = atom_lines[short[0]]
+        raise ValueError(f"{pdb_path}: atom record without coordinates: {buffer[starts[line]:ends[line]].decode()!r}")
+
+    endmdl_lines = np.flatnonzero(records == _record_key(b'ENDMDL'))
+    # Model of every atom record: number of ENDMDL records before it
+    atom_models = np.searchsorted(endmdl_lines, atom_lines)
+    model_sizes = np.bincount(atom_models)
+    if len(endmdl_lines) and atom_models[-1] == len(endmdl_lines):
+        raise ValueError(f"{pdb_path}: the last model is not terminated by an ENDMDL record")
+    if (model_sizes != model_sizes[0]).any():
+        raise ValueError(f"{pdb_path}: the models have different numbers of atoms: {sorted(set(model_sizes.tolist()))}")
+
+    fields = np.lib.stride_tricks.sliding_window_view(data, 3 * FIELD_WIDTH)[starts[atom_lines] + COORDS_START]
+    return parse_fields(fields.reshape(-1, FIELD_WIDTH)).reshape(len(model_sizes), model_sizes[0], 3)
+
+
+def parse_fields(fields: np.ndarray) -> np.ndarray:
+    """Returns the float64 values of the (n, 8) uint8 array of fixed-width **fields**, ie: b' -12.345'."""
+    fields = np.ascontiguousarray(fields)
+    digits = fields - np.uint8(ord('0'))
+    is_digit = digits < 10
+    is_minus = fields == ord('-')
+    # Digits, blanks and signs, and a decimal point as 5th character (disjoint sets of characters)
+    num_valid = (np.count_nonzero(is_digit) + np.count_nonzero(fields == ord(' ')) + np.count_nonzero(is_minus)
+                 + np.count_nonzero(fields[:, 4] == ord('.')))
+    if num_valid != fields.size:
+        # Any other decimal layout
+        return fields.view(f'S{FIELD_WIDTH}').ravel().astype(np.float64)
+    # %8.3f fields: the 8 digits of every field (0 for the blanks, sign and decimal point) are read as a little-endian
+    # uint64 and combined by pairs, groups of 4 and 8 digits, giving the integer part * 10^4 + the 3 decimals
+    digits *= is_digit
+    number = digits.view('<u8')[:, 0]
+    shifted = np.empty_like(number)
+    # In place, the allocation of every temporary array costing as much as the operation itself
+    for shift, multiplier, mask in ((8, 10, 0x00FF00FF00FF00FF), (16, 100, 0x0000FFFF0000FFFF), (32, 10000, 0xFFFFFFFF)):
+        np.right_shift(number, np.uint64(shift), out=shifted)
+        number *= np.uint64(multiplier)
+        number += shifted
+        number &= np.uint64(mask)
+    np.floor_divide(number, np.uint64(10000), out=shifted)
+    shifted *= np.uint64(9000)
+    number -= shifted
+    values = number / 1000.0
+    bits = values.view(np.uint64)
+    # The sign bit set from the byte of the minus sign (at most one per field), summed over the 8 bytes by the
+    # multiplication: faster than a masked negation, unpredictable for the branches
+    np.multiply(is_minus.view('<u8')[:, 0], np.uint64(0x0101010101010101), out=shifted)
+    shifted >>= np.uint64(56)
+    shifted <<= np.uint64(63)
+    np.bitwise_or(bits, shifted, out=bits)
+    return values
+
+
+def format_fields(values: np.ndarray) -> np.ndarray:
+    """Returns the (n, 8) uint8 array of the float **values** formatted as ``%8.3f``, as written by Python and ProDy."""
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if not np.isfinite(values).all():
+        raise ValueError("Coordinates that are not finite can not be written to a PDB file")
+    scaled = np.abs(values) * 1000.0
+    thousandths = np.rint(scaled).astype(np.int64)
+    # The product of a float64 by 1000 is not exact: ties are formatted by Python, that rounds the exact values
+    ties = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for index in ties:
+        thousandths[index] = int(('%.3f' % abs(values[index])).replace('.', ''))
+    integer, fraction = np.divmod(thousandths, 1000)
+    # Row of the integer part (with its sign, -0 included) in INTEGER_CHARS
+    integer = np.where(np.signbit(values), NEGATIVE_INTEGERS - 1 - integer, NEGATIVE_INTEGERS + integer)
+    if (integer < 0).any() or (integer >= len(INTEGER_CHARS)).any():
+        raise ValueError("Coordinates out of the -999.999 to 9999.999 range of the PDB format")
+    chars = np.empty((len(values), FIELD_WIDTH), dtype=np.uint8)
+    chars[:, :4] = INTEGER_CHARS[integer]
+    chars[:, 4] = ord('.')
+    chars[:, 5:] = FRACTION_CHARS[fraction]
+    return chars
+
+
+def format_serials(serials: np.ndarray) -> np.ndarray:
+    """Returns the (n, 5) uint8 array of the **serials** formatted as ``%5d``, or as ``%5x`` above 99999 as ProDy does."""
+    serials = np.asarray(serials).ravel()
+    if (serials < 0).any() or (serials > MAX_HEX_SERIAL).any():
+        raise ValueError("Atom serials out of the 0 to fffff range of the PDB format")
+    base = np.where(serials > MAX_SERIAL, 16, 10)
+    chars = np.empty((len(serials), 5), dtype=np.uint8)
+    for position in range(5):
+        power = base ** (4 - position)
+        chars[:, position] = np.where((serials >= power) | (position == 4), SERIAL_DIGITS[serials // power % base], ord(' '))
+    return chars
+
+
+def parse_pdb_number(field: str) -> Optional[int]:
+    """Returns the atom serial or residue number of the fixed-width **field**: decimal, hybrid-36 beyond the decimal
+    range of the field (ie: A0000 after 99999) or hexadecimal as written by ProDy, or None if it can not be parsed
+    (ie: ***** overflow markers)."""
+    width = len(field)
+    field = field.strip()
+    try:
+        return int(field)
+    except ValueError:
+        pass
+    if len(field) == width and field[0].isalpha():
+        if all(char in HYBRID36_UPPER for char in field):
+            return int(field, 36) - 10 * 36 ** (width - 1) + 10 ** width
+        if all(char in HYBRID36_LOWER for char in field):
+            return int(field, 36) + 16 * 36 ** (width - 1) + 10 ** width
+    try:
+        return int(field, 16)
+    except ValueError:
+        return None
+
+
+class PdbTemplate:
+    """Pre-formatted records of a PDB model, whose coordinate columns are filled with the coordinates of every frame.
+
+    Args:
+        model (bytes): Text of the model (ATOM, HETATM, TER... records), without MODEL and ENDMDL records.
+        header (bytes): Records written once before the first model, ie: REMARK records.
+        end (bytes): Records written once after the last model, ie: END record.
+        serial_step (int): (0) Shift of the atom serials of every model from the previous one, ie: the number of TER
+            records of a model in the multi-model files written by ProDy.
+    """
+
+    def __init__(self, model: bytes, header: bytes = b'', end: bytes = END_LINE, serial_step: int = 0) -> None:
+        self.model = np.frombuffer(model, dtype=np.uint8)
+        self.header = header
+        self.end = end
+        self.serial_step = serial_step
+        lines = model.splitlines(keepends=True)
+        offsets = np.cumsum([0] + [len(line) for line in lines[:-1]])
+        atom_offsets = np.array([offset for offset, line in zip(offsets, lines) if line.startswith(ATOM_RECORDS)], dtype=np.int64)
+        self.num_atoms = len(atom_offsets)
+        #: Indices of the characters of the coordinate fields in the model, atom by atom
+        self.coords_index = (atom_offsets[:, np.newaxis] + np.arange(COORDS_START, COORDS_START + 3 * FIELD_WIDTH)).ravel()
+        if len(self.coords_index) and self.coords_index[-1] >= len(self.model):
+            raise ValueError("Atom record without coordinates in the PDB template")
+        # Serials (columns 7-11) of the atom, TER and ANISOU records holding one
+        serial_lines = [(offset, int(line[6:11])) for offset, line in zip(offsets, lines)
+                        if serial_step and line.startswith(ATOM_RECORDS + (b'TER', b'ANISOU')) and line[6:11].strip().isdigit()]
+        self.serials = np.array([serial for _, serial in serial_lines], dtype=np.int64)
+        self.serials_index = (np.array([offset for offset, _ in serial_lines], dtype=np.int64)[:, np.newaxis] + np.arange(6, 11)).ravel()
+
+    @classmethod
+    def from_pdb(cls, pdb_path: Union[str, Path]) -> 'PdbTemplate':
+        """Returns the template of the first model of the (multi-model) **pdb_path**, with the records before it as header."""
+        lines: list[bytes] = []
+        with open(pdb_path, 'rb') as pdb_file:
+            for line in pdb_file:
+                if line.startswith(b'ENDMDL'):
+                    break
+                lines.append(line)
+        return cls.from_records(lines, pdb_path)
+
+    @classmethod
+    def from_records(cls, lines: list[bytes], pdb_path: Union[str, Path] = '', serial_step: int = 0) -> 'PdbTemplate':
+        """Returns the template of the PDB record **lines** of a single model, ie: written by ``prody.writePDBStream``."""
+        lines = [line for line in lines if not line.startswith((b'MODEL', b'NUMMDL', b'END'))]
+        # The model goes from the first to the last atom record, ie: CONECT records are written once at the end
+        model_lines = [index for index, line in enumerate(lines) if line.startswith(ATOM_RECORDS + (b'TER', b'ANISOU'))]
+        if not model_lines:
+            raise ValueError(f"{pdb_path}: no atom records in the first model")
+        first, last = model_lines[0], model_lines[-1] + 1
+        return cls(b''.join(lines[first:last]), b''.join(lines[:first]), b''.join(lines[last:]) + END_LINE, serial_step)
+
+    @classmethod
+    def from_topology(cls, topology: np.ndarray) -> 'PdbTemplate':
+        """Returns the template of the atoms of the **topology** (:data:`TOPOLOGY_DTYPE <flexdyn.ensemble.TOPOLOGY_DTYPE>`
+        array), with an occupancy of 1 and a B-factor of 0."""
+        lines = []
+        for atom in topology:
+            # Atom names of less than 4 characters start at column 14, unless their element has 2 characters
+            name = atom['name'] if len(atom['name']) == 4 or len(atom['element']) == 2 else ' ' + atom['name']
+            lines.append(f"{atom['record']:<6}{atom['serial'] % 100000:>5} {name:<4}{atom['altloc']:1}{atom['resname']:<4}"
+                         f"{atom['chain']:1}{atom['resnum'] % 10000:>4}{atom['icode']:1}   {'':24}{1.0:6.2f}{0.0:6.2f}"
+                         f"{'':10}{atom['element']:>2}  \n")
+        return cls(''.join(lines).encode())
+
+    def format(self, coords: np.ndarray, first_model: int = 0) -> np.ndarray:
+        """Returns the (n_frames, model length) uint8 text of the models of the (n_frames, n_atoms, 3) **coords**,
+        the first one being the model of index **first_model** of the file."""
+        models = np.tile(self.model, (len(coords), 1))
+        models[:, self.coords_index] = format_fields(coords).reshape(len(coords), -1)
+        if self.serial_step:
+            serials = self.serials + self.serial_step * np.arange(first_model, first_model + len(coords))[:, np.newaxis]
+            models[:, self.serials_index] = format_serials(serials).reshape(len(coords), -1)
+        return models
+
+    def format_models(self, coords: np.ndarray, first_model: int = 0, multi_model: bool = True) -> bytes:
+        """Returns the text of the models of the (n_frames, n_atoms, 3) **coords**, the first one being the model of
+        index **first_model** of the file, wrapped in MODEL and ENDMDL records if **multi_model**."""
+        if not multi_model:
+            return self.format(coords, first_model).tobytes()
+        return b''.join(MODEL_FORMAT % model + text.tobytes() + ENDMDL_LINE
+                        for model, text in enumerate(self.format(coords, first_model), first_model + 1))
+
+
+class PdbWriter(TrajectoryWriter):
+    """Multi-model PDB writer, filling the coordinate columns of the pre-formatted records of **template** with every frame.
+
+    Args:
+        traj_path (str): Path to the output multi-model PDB file.
+        template (PdbTemplate): Records of every model.
+        multi_model (bool): (True) Write MODEL and ENDMDL records. If False, a single frame is expected.
+    """
+    dtype = np.float64
+
+    def __init__(self, traj_path: Union[str, Path], template: PdbTemplate, multi_model: bool = True) -> None:
+        super().__init__(traj_path, template.num_atoms)
+        self.template = template
+        self.multi_model = multi_model
+        self.traj_file.write(template.header)
+
+    def write_frames(self, coords: np.ndarray) -> None:
+        self.traj_file.write(self.template.format_models(coords, self.num_frames, self.multi_model))
+
+    def close(self) -> None:
+        if not self.traj_file.closed:
+            self.traj_file.write(self.template.end)
+        super().close()
+
+
+def _models_end(buffer: bytes) -> int:
+    """Returns the position after the last complete ENDMDL record of **buffer**, 0 if there is none."""
+    position = len(buffer)
+    while True:
+        position = buffer.rfind(b'ENDMDL', 0, position)
+        if position < 0:
+            return 0
+        line_end = buffer.find(b'\n', position)
+        if (position == 0 or buffer[position - 1] == ord('\n')) and line_end >= 0:
+            return line_end + 1
+
+
+def _record_key(record: bytes) -> int:
+    return int.from_bytes(record, 'little')
@@ -0,0 +1,169 @@
+"""Module containing the execution of the command lines of the FlexDyn blocks as child processes."""
+import asyncio
+import os
+import signal
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Callable, Optional
+from biobb_common.command_wrapper import cmd_wrapper
+from biobb_common.tools import file_utils as fu
+from biobb_flexdyn.flexdyn.instrumentation import phase, record_child
+
+
+def run_commands(block, cmds: list[list[str]], num_workers: int,
+                 on_success: Optional[Callable[[int], None]] = None, phase_name: str = 'run_commands') -> int:
+    """Run the command lines **cmds** with at most **num_workers** concurrent processes, using the
+    shell, environment and logs of the **block**. **on_success** is called with the index of every
+    command as soon as it finishes with exit code 0. Return the first non-zero exit code or 0."""
+    def launch(cmd_index: int) -> int:
+        return_code = _run_command(block, cmds[cmd_index])
+        if not return_code and on_success:
+            on_success(cmd_index)
+        return return_code
+
+    with phase(block, phase_name), ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return_codes = list(executor.map(launch, range(len(cmds))))
+    return next((return_code for return_code in return_codes if return_code), 0)
+
+
+def _run_command(block, cmd: list[str]) -> int:
+    wrapper = command_wrapper(block, cmd)
+    fu.log(f"Launching command (it may take a while): {' '.join(cmd)}", block.out_log)
+    with tempfile.TemporaryFile() as out_file, tempfile.TemporaryFile() as err_file:
+        process = start_process(wrapper, out_file, err_file)
+        timed_out = not wait_process(block, process, block.timeout)
+        if timed_out:
+            terminate_process(process, block=block)
+        return_code = 1 if timed_out else process.returncode
+        log_process_output(wrapper, return_code, out_file, err_file, timed_out)
+    return return_code
+
+
+async def run_commands_async(block, cmds: list[list[str]], num_workers: int,
+                             on_success: Optional[Callable[[int], None]] = None, phase_name: str = 'run_commands') -> int:
+    """Asynchronous equivalent of :func:`run_commands`. When cancelled, the process groups of the running
+    commands are terminated before the cancellation is propagated."""
+    semaphore = asyncio.Semaphore(num_workers)
+
+    async def launch(cmd_index: int) -> int:
+        async with semaphore:
+            return_code = await _run_command_async(block, cmds[cmd_index])
+        if not return_code and on_success:
+            on_success(cmd_index)
+        return return_code
+
+    with phase(block, phase_name):
+        return_codes = await asyncio.gather(*(launch(cmd_index) for cmd_index in range(len(cmds))))
+    return next((return_code for return_code in return_codes if return_code), 0)
+
+
+async def _run_command_async(block, cmd: list[str]) -> int:
+    wrapper = command_wrapper(block, cmd)
+    fu.log(f"Launching command (it may take a while): {' '.join(cmd)}", block.out_log)
+    # Polled rather than awaited through asyncio, so that the process is reaped by wait_process_async
+    with tempfile.TemporaryFile() as out_file, tempfile.TemporaryFile() as err_file:
+        process = start_process(wrapper, out_file, err_file)
+        try:
+            timed_out = not await wait_process_async(block, process, block.timeout)
+            if timed_out:
+                await terminate_process_async(process, block=block)
+        except asyncio.CancelledError:
+            await terminate_process_async(process, block=block)
+            raise
+        return_code = 1 if timed_out else process.returncode
+        log_process_output(wrapper, return_code, out_file, err_file, timed_out)
+    return return_code
+
+
+def command_wrapper(block, cmd: list[str]) -> cmd_wrapper.CmdWrapper:
+    """Return the CmdWrapper of the command line **cmd** with the shell, environment, timeout and logs of the **block**."""
+    return cmd_wrapper.CmdWrapper(cmd, shell_path=block.shell_path, out_log=block.out_log, err_log=block.err_log,
+                                  global_log=block.global_log, env=block.env_vars_dict, timeout=block.timeout,
+                                  disable_logs=block.disable_logs)
+
+
+def start_process(wrapper: cmd_wrapper.CmdWrapper, out_file: IO[bytes], err_file: IO[bytes]) -> subprocess.Popen:
+    """Start the command of **wrapper** as ``CmdWrapper.launch`` does, but writing its output to **out_file** and
+    **err_file** to avoid blocking on full pipes, and in a new session so that its whole process group (ie: the shell
+    and the binary) can be terminated. The process is to be reaped with :func:`wait_process`."""
+    env = {**os.environ.copy(), **wrapper.env} if wrapper.env else os.environ.copy()
+    return subprocess.Popen(' '.join(wrapper.cmd), shell=True, executable=wrapper.shell_path, env=env,
+                            stdout=out_file, stderr=err_file, start_new_session=True)
+
+
+def log_process_output(wrapper: cmd_wrapper.CmdWrapper, return_code: int, out_file: IO[bytes], err_file: IO[bytes],
+                       timed_out: bool = False) -> None:
+    """Log the exit code and the output written to **out_file** and **err_file** by the command of **wrapper**."""
+    out_file.seek(0)
+    err_file.seek(0)
+    wrapper.log_output(exit_code=str(return_code), command=' '.join(wrapper.cmd), out=out_file.read(), err=err_file.read(),
+                       timeout=str(wrapper.timeout) if timed_out else None,
+                       out_log=wrapper.out_log, err_log=wrapper.err_log, global_log=wrapper.global_log)
+
+
+def wait_process(block, process: subprocess.Popen, timeout: Optional[float] = None) -> bool:
+    """Wait up to **timeout** seconds (forever if None) for **process** to exit, reaping it with ``os.wait4`` to
+    record the CPU time and peak RSS of the process (and its own child processes) in the instrumentation of the
+    **block**, if any. Return whether the process has exited."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    poll_interval = 0.001
+    while process.returncode is None:
+        if _reap(block, process):
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, 0.1)
+    return True
+
+
+async def wait_process_async(block, process: subprocess.Popen, timeout: Optional[float] = None) -> bool:
+    """Asynchronous equivalent of :func:`wait_process`."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    poll_interval = 0.001
+    while process.returncode is None:
+        if _reap(block, process):
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, 0.1)
+    return True
+
+
+def _reap(block, process: subprocess.Popen) -> bool:
+    try:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+    except ChildProcessError:
+        # Already reaped, its resource usage is lost
+        process.wait()
+        return True
+    if not pid:
+        return False
+    process.returncode = os.waitstatus_to_exitcode(status)
+    record_child(block, usage)
+    return True
+
+
+def terminate_process(process: subprocess.Popen, grace_period: float = 5.0, block=None) -> None:
+    """Terminate the process group of **process**, killing it if it does not exit within **grace_period** seconds."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        if not wait_process(block, process, grace_period):
+            os.killpg(process.pid, signal.SIGKILL)
+            wait_process(block, process)
+    except ProcessLookupError:
+        pass
+
+
+async def terminate_process_async(process: subprocess.Popen, grace_period: float = 5.0, block=None) -> None:
+    """Asynchronous equivalent of :func:`terminate_process`."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        if not await wait_process_async(block, process, grace_period):
+            os.killpg(process.pid, signal.SIGKILL)
+            await wait_process_async(block, process)
+    except ProcessLookupError:
+        pass
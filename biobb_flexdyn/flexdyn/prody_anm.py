@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
 
 """Module containing the prody_anm class and the command line interface."""
-from typing import Optional
-import prody  # type: ignore
+import asyncio
+from typing import TYPE_CHECKING, Iterator, Optional
+import io
+from pathlib import Path
+import numpy as np
 from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexdyn.flexdyn.cache import ContentCache, file_hash, hash_key, result_cache
+from biobb_flexdyn.flexdyn.instrumentation import instrument_launch, phase
+from biobb_flexdyn.flexdyn.ensemble import read_pdb_topology
+from biobb_flexdyn.flexdyn.pdb_codec import PdbTemplate, PdbWriter
+from biobb_flexdyn.flexdyn.trajectory import is_binary_trajectory, open_trajectory_writer
+
+if TYPE_CHECKING:
+    # ProDy and SciPy are imported when the block is launched, not when the module is imported
+    import prody  # type: ignore
+    from scipy import sparse  # type: ignore
 
 
 class ProdyANM(BiobbObject):
@@ -15,13 +29,25 @@ class ProdyANM(BiobbObject):
 
     Args:
         input_pdb_path (str): Input PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure.pdb>`_. Accepted formats: pdb (edam:format_1476).
-        output_pdb_path (str): Output multi-model PDB file with the generated ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/prody_output.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        output_pdb_path (str): Output multi-model PDB file, or XTC, DCD or NPZ trajectory, with the generated ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/reference/flexdyn/prody_output.pdb>`_. Accepted formats: pdb (edam:format_1476), xtc (edam:format_3875), dcd (edam:format_3878), npz (edam:format_4003).
+        output_top_path (str) (Optional): Output PDB file with the first structure of the ensemble, giving the atoms of the frames of the XTC and DCD trajectories. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexdyn/raw/master/biobb_flexdyn/test/data/flexdyn/structure.pdb>`_. Accepted formats: pdb (edam:format_1476).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **num_structs** (*int*) - (500) Number of structures to be generated
             * **selection** (*str*) - (calpha) Atoms selection (Prody syntax: http://prody.csb.pitt.edu/manual/reference/atomic/select.html)
             * **cutoff** (*float*) - (15.0) Cutoff distance (Å) for pairwise interactions, minimum is 4.0 Å
             * **gamma** (*float*) - (1.0) Spring constant
             * **rmsd** (*float*) - (1.0) Average RMSD that the conformations will have with respect to the initial conformation
+            * **num_modes** (*int*) - (20) Number of non-trivial normal modes to be computed
+            * **hessian_mode** (*str*) - ("dense") Hessian matrix construction and diagonalization strategy. Values: dense (dense Hessian and full diagonalization with Prody), sparse (sparse Hessian built from a KD-tree contact search and iterative eigensolver computing only the lowest modes, recommended for large systems)
+            * **seed** (*int*) - (None) Seed of the random number generator used to sample the conformations. If not set, the sampling is not reproducible.
+            * **chunk_size** (*int*) - (0) Number of conformations sampled and written to the output file at a time, bounding the memory used regardless of num_structs. If 0, the whole ensemble is built in memory before being written.
+            * **modes_cache_path** (*str*) - (None) Path to a persistent normal-mode cache directory shared between executions. If not set, the normal modes are always computed.
+            * **modes_cache_max_size** (*float*) - (1024) Maximum size (MB) of the normal-mode cache, the least recently used entries are evicted beyond this size.
+            * **cache_path** (*str*) - (None) Path to the result cache shared by the FlexDyn blocks, see :func:`biobb_flexdyn.flexdyn.cache.result_cache`. If not set the cache is not used.
+            * **cache_max_size** (*float*) - (1024) Maximum size (MB) of the result cache.
+            * **cache_max_age** (*float*) - (None) Maximum age (days) of the result cache entries. If not set the entries do not expire.
+            * **cache_link** (*bool*) - (False) Hard link the outputs to the result cache entry instead of copying them.
+            * **instrumentation_path** (*str*) - (None) Path to the output JSON file of the instrumentation of the launch, see :func:`biobb_flexdyn.flexdyn.instrumentation.instrument_launch`.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -50,6 +76,7 @@ class ProdyANM(BiobbObject):
     """
 
     def __init__(self, input_pdb_path: str, output_pdb_path: str,
+                 output_top_path: Optional[str] = None,
                  properties: Optional[dict] = None, **kwargs) -> None:
 
         properties = properties or {}
@@ -61,7 +88,8 @@ class ProdyANM(BiobbObject):
         # Input/Output files
         self.io_dict = {
             'in': {'input_pdb_path': input_pdb_path},
-            'out': {'output_pdb_path': output_pdb_path}
+            'out': {'output_pdb_path': output_pdb_path,
+                    'output_top_path': output_top_path}
         }
 
         # Properties specific for BB
@@ -72,42 +100,68 @@ class ProdyANM(BiobbObject):
         self.cutoff = properties.get('cutoff', 15.0)
         self.gamma = properties.get('gamma', 1.0)
         self.rmsd = properties.get('rmsd', 1.0)
+        self.num_modes = properties.get('num_modes', 20)
+        self.hessian_mode = properties.get('hessian_mode', 'dense')
+        self.seed = properties.get('seed')
+        self.chunk_size = properties.get('chunk_size', 0)
+        self.modes_cache_path = properties.get('modes_cache_path')
+        self.modes_cache_max_size = properties.get('modes_cache_max_size', 1024)
+
+        self.cache_path = properties.get('cache_path')
+        self.cache_max_size = properties.get('cache_max_size', 1024)
+        self.cache_max_age = properties.get('cache_max_age')
+        self.cache_link = properties.get('cache_link', False)
+        self.instrumentation_path = properties.get('instrumentation_path')
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    # Python packages computing the outputs, their versions are part of the result cache key
+    CACHE_PACKAGES = ('prody',)
+
     @launchlogger
+    @instrument_launch
+    @result_cache
     def launch(self):
         """Launches the execution of the FlexDyn ConcoordDist module."""
 
         # Setup Biobb
         if self.check_restart():
             return 0
-        self.stage_files()
+        with phase(self, 'stage_files', sandbox_copies='in'):
+            self.stage_files()
 
+        import prody  # type: ignore
         prot = prody.parsePDB(self.stage_io_dict["in"]["input_pdb_path"],)
 
-        # http://prody.csb.pitt.edu/manual/reference/atomic/select.html
-        prot_sel = prot.select(self.selection)  # type: ignore
-
-        enm = prody.ANM('BioBB_flexdyn Prody ANM ensemble generator')
-
-        enm.buildHessian(prot_sel, cutoff=self.cutoff, gamma=self.gamma)
-
-        enm.calcModes()
+        enm, prot_sel = self.get_modes(prot)
 
         bb_enm, bb_atoms = prody.extendModel(enm, prot_sel, prot_sel)
 
-        ensemble = prody.sampleModes(bb_enm[:3], bb_atoms, n_confs=self.num_structs, rmsd=self.rmsd)
-
-        nmastruct = bb_atoms.copy()
-        nmastruct.addCoordset(ensemble)
-
-        prody.writePDB(self.stage_io_dict["out"]["output_pdb_path"], nmastruct)
+        # Streaming mode: conformations are sampled and written chunk by chunk, all at once by default
+        rng = np.random.default_rng(self.seed)
+        chunks = _sample_modes_chunks(bb_enm[:3], bb_atoms, n_confs=self.num_structs, rmsd=self.rmsd,
+                                      chunk_size=self.chunk_size or max(self.num_structs, 1), rng=rng)
+
+        output_path = self.stage_io_dict["out"]["output_pdb_path"]
+        top_path = self.stage_io_dict["out"].get("output_top_path")
+        if is_binary_trajectory(output_path):
+            # The atoms are written once to the topology PDB, the frames (initial structure first) as coordinates only
+            top_path = top_path or str(Path(self.stage_io_dict["unique_dir"]).joinpath('prody_top.pdb'))
+            prody.writePDB(top_path, bb_atoms)
+            topology = read_pdb_topology(top_path)
+            with open_trajectory_writer(output_path, len(topology), topology) as writer:
+                for chunk in chunks:
+                    writer.write(chunk)
+        else:
+            _write_pdb_chunks(output_path, bb_atoms, chunks, multi_model=self.num_structs > 0, out_log=self.out_log, global_log=self.global_log)
+            if top_path:
+                prody.writePDB(top_path, bb_atoms)
 
         # Copy files to host
-        self.copy_to_host()
+        with phase(self, 'copy_to_host', sandbox_copies='out'):
+            self.copy_to_host()
 
         # remove temporary folder(s)
         self.remove_tmp_files()
@@ -116,16 +170,199 @@ class ProdyANM(BiobbObject):
 
         return self.return_code
 
+    async def launch_async(self):
+        """Launches the execution of the FlexDyn ProdyANM module as a coroutine. As it runs no external process, the
+        execution is run in a worker thread of the default executor of the event loop and is not interrupted if cancelled."""
+        return await asyncio.to_thread(self.launch)
+
+    def get_modes(self, prot) -> tuple['prody.ANM', 'prody.Selection']:
+        """Return the normal modes and the selected atoms of **prot**, reading them from the normal-mode cache when available."""
+        import prody  # type: ignore
+        cache, key = None, None
+        if self.modes_cache_path:
+            cache = ContentCache(self.modes_cache_path, self.modes_cache_max_size, self.out_log, self.global_log)
+            key = hash_key(file_hash(self.stage_io_dict["in"]["input_pdb_path"]),
+                           self.selection, self.cutoff, self.gamma, self.num_modes, self.hessian_mode)
+            entry = cache.lookup(key)
+            if entry:
+                with np.load(entry.joinpath('modes.npz')) as modes:
+                    prot_sel = prot[modes['indices']]
+                    enm = prody.ANM('BioBB_flexdyn Prody ANM ensemble generator')
+                    enm.setEigens(modes['eigenvectors'], modes['eigenvalues'])
+                return enm, prot_sel
+
+        # http://prody.csb.pitt.edu/manual/reference/atomic/select.html
+        prot_sel = prot.select(self.selection)  # type: ignore
+        enm = self.calc_modes(prot_sel)
+
+        if cache and key:
+            modes_path = str(Path(self.stage_io_dict["unique_dir"]).joinpath('modes.npz'))
+            np.savez(modes_path, eigenvalues=enm.getEigvals(), eigenvectors=enm.getEigvecs(), indices=prot_sel.getIndices())
+            cache.store(key, {'modes.npz': modes_path})
+
+        return enm, prot_sel
+
+    def calc_modes(self, atoms) -> 'prody.ANM':
+        """Build the ANM Hessian of the **atoms** and compute its lowest non-trivial normal modes."""
+        import prody  # type: ignore
+        enm = prody.ANM('BioBB_flexdyn Prody ANM ensemble generator')
+
+        if self.hessian_mode == 'dense':
+            enm.buildHessian(atoms, cutoff=self.cutoff, gamma=self.gamma)
+            enm.calcModes(n_modes=self.num_modes)
+        elif self.hessian_mode == 'sparse':
+            hessian = _build_sparse_hessian(atoms.getCoords(), self.cutoff, self.gamma)
+            values, vectors = _calc_sparse_modes(hessian, self.num_modes)
+            enm.setEigens(vectors, values)
+        else:
+            raise ValueError(f"hessian_mode ({self.hessian_mode}) must be 'dense' or 'sparse'")
+
+        return enm
+
+
+def _build_sparse_hessian(coords: np.ndarray, cutoff: float, gamma: float) -> 'sparse.csr_matrix':
+    """Build the ANM Hessian as a sparse matrix, finding the contacts within **cutoff** with a KD-tree."""
+    from scipy import sparse  # type: ignore
+    from scipy.spatial import cKDTree  # type: ignore
+    n_atoms = coords.shape[0]
+    pairs = cKDTree(coords).query_pairs(cutoff, output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+
+    # 3x3 super elements of every contact: -gamma * (r_ij r_ij^T) / |r_ij|^2
+    i2j = coords[j] - coords[i]
+    dist2 = (i2j ** 2).sum(1)
+    super_elements = np.einsum('ka,kb->kab', i2j, i2j) * (-gamma / dist2)[:, None, None]
+
+    # Diagonal blocks are minus the sum of the off-diagonal blocks of the row
+    diagonal = np.zeros((n_atoms, 3, 3))
+    np.add.at(diagonal, i, -super_elements)
+    np.add.at(diagonal, j, -super_elements)
+
+    # Row/column offsets of the 9 elements of a 3x3 block
+    offset_row, offset_col = (a.ravel() for a in np.indices((3, 3)))
+    block_i = np.concatenate([i, j, np.arange(n_atoms)])
+    block_j = np.concatenate([j, i, np.arange(n_atoms)])
+    rows = (3 * block_i[:, None] + offset_row).ravel()
+    cols = (3 * block_j[:, None] + offset_col).ravel()
+    data = np.concatenate([super_elements, super_elements, diagonal]).reshape(-1)
+
+    return sparse.coo_matrix((data, (rows, cols)), shape=(3 * n_atoms, 3 * n_atoms)).tocsr()
+
+
+def _count_zero_modes(hessian: 'sparse.csr_matrix') -> int:
+    """Count the rigid-body (zero eigenvalue) modes: 6 per connected component of the network, 5 for dimers and 3 for isolated atoms."""
+    from scipy.sparse import csgraph  # type: ignore
+    contacts = abs(hessian[0::3, 0::3]) + abs(hessian[1::3, 1::3]) + abs(hessian[2::3, 2::3])
+    _, labels = csgraph.connected_components(contacts, directed=False)
+    sizes = np.bincount(labels)
+    return int(6 * (sizes > 2).sum() + 5 * (sizes == 2).sum() + 3 * (sizes == 1).sum())
+
+
+def _calc_sparse_modes(hessian: 'sparse.csr_matrix', n_modes: int, zero: float = 1e-6) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the lowest **n_modes** non-trivial modes of a sparse **hessian** with a shift-invert Lanczos eigensolver."""
+    from scipy.sparse import linalg as sparse_linalg  # type: ignore
+    dof = hessian.shape[0]
+    k = min(n_modes + _count_zero_modes(hessian), dof - 1)
+
+    # Shift slightly below zero so that the factorized (H - sigma*I) is positive definite
+    sigma = -zero * abs(hessian.diagonal()).max()
+    values, vectors = sparse_linalg.eigsh(hessian, k=k, sigma=sigma, which='LM')
+
+    order = np.argsort(values)
+    values, vectors = values[order], vectors[:, order]
+    non_trivial = values > zero
+    return values[non_trivial][:n_modes], vectors[:, non_trivial][:, :n_modes]
+
+
+def _sample_modes_chunks(modes, atoms, n_confs: int, rmsd: float, chunk_size: int,
+                         rng: np.random.Generator) -> Iterator[np.ndarray]:
+    """Chunked version of prody.sampleModes yielding the coordinate sets of at most **chunk_size** conformations at a time.
+
+    The random numbers of all the conformations are drawn at once from **rng**, as the scaling
+    factor giving the requested average **rmsd** depends on all of them, so that the result is
+    identical to prody.sampleModes for the same random numbers. The first chunk is preceded
+    by the initial coordinates of **atoms**.
+    """
+    n_atoms = modes.numAtoms()
+    initial = atoms.getCoords()
+    yield initial[np.newaxis]
+    if not n_confs:
+        return
+    variances = modes.getVariances()
+    magnitudes = np.array([abs(mode) for mode in modes])
+
+    randn = rng.standard_normal((n_confs, len(modes)))
+    coef = ((randn ** 2 * variances).sum(1) ** 0.5).mean()
+    scale = n_atoms**0.5 * rmsd / coef
+    scale = scale / magnitudes * variances ** 0.5
+
+    array = modes.getArray()
+    for start in range(0, n_confs, chunk_size):
+        confs = [(array * scale * r).sum(1).reshape((n_atoms, 3)) for r in randn[start:start + chunk_size]]
+        yield np.array(confs) + initial
+
+
+def _write_pdb_chunks(pdb_path: str, atoms, chunks: Iterator[np.ndarray], multi_model: bool = True,
+                      out_log=None, global_log=None) -> None:
+    """Write the coordinate set **chunks** of **atoms** as consecutive models of a PDB file.
+
+    The output is identical to prody.writePDB of an atom group holding all the coordinate
+    sets, but only one chunk is formatted at a time: the atom records are formatted once by
+    Prody and the coordinates of every chunk are written in their columns, the atom serials
+    being shifted by the TER records of the previous models as Prody does. If this layout does
+    not reproduce the Prody output of two models, as with a Prody version formatting the models
+    differently, a warning is logged and all the coordinate sets are written at once by prody.writePDB.
+    """
+    import prody  # type: ignore
+    buffer = io.StringIO()
+    prody.writePDBStream(buffer, atoms)
+    records = buffer.getvalue().encode().splitlines(keepends=True)
+    num_ter = sum(1 for line in records if line.startswith(b'TER'))
+    template = PdbTemplate.from_records(records, serial_step=num_ter)
+    if not _matches_prody_output(template, atoms, multi_model):
+        fu.log("WARNING: the PDB layout of this Prody version is not supported, the whole ensemble is written at once", out_log, global_log)
+        ensemble = atoms.copy()
+        ensemble.setCoords(np.concatenate(list(chunks)))
+        with open(pdb_path, 'w') as pdb_file:
+            prody.writePDBStream(pdb_file, ensemble)
+        return
+
+    with PdbWriter(pdb_path, template, multi_model=multi_model) as writer:
+        for coordsets in chunks:
+            writer.write(coordsets)
+
+
+def _matches_prody_output(template: PdbTemplate, atoms, multi_model: bool) -> bool:
+    """Check in memory that **template** reproduces the prody.writePDB output of **atoms** with two coordinate sets
+    (one if not **multi_model**)."""
+    import prody  # type: ignore
+    coords = atoms.getCoords()
+    probe = np.stack([coords, coords + 1.0])[:2 if multi_model else 1]
+    ensemble = atoms.copy()
+    ensemble.setCoords(probe)
+    buffer = io.StringIO()
+    prody.writePDBStream(buffer, ensemble)
+    return template.header + template.format_models(probe, multi_model=multi_model) + template.end == buffer.getvalue().encode()
+
 
 def prody_anm(input_pdb_path: str, output_pdb_path: str,
+              output_top_path: Optional[str] = None,
               properties: Optional[dict] = None, **kwargs) -> int:
     """Create :class:`ProdyANM <flexdyn.prody_anm.ProdyANM>`flexdyn.prody_anm.ProdyANM class and
     execute :meth:`launch() <flexdyn.prody_anm.ProdyANM.launch>` method"""
     return ProdyANM(**dict(locals())).launch()
 
 
+async def prody_anm_async(input_pdb_path: str, output_pdb_path: str,
+                          output_top_path: Optional[str] = None,
+                          properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`ProdyANM <flexdyn.prody_anm.ProdyANM>`flexdyn.prody_anm.ProdyANM class and
+    await :meth:`launch_async() <flexdyn.prody_anm.ProdyANM.launch_async>` method"""
+    return await ProdyANM(**dict(locals())).launch_async()
+
+
 prody_anm.__doc__ = ProdyANM.__doc__
-main = ProdyANM.get_main(prody_anm, "Generate an ensemble of structures using the Prody Anisotropic Network Model (ANM), for coarse-grained NMA.")
+main = ProdyANM.get_main(prody_anm, "Generate an ensemble of structures using the Prody Anisotropic Network Model (ANM), for coarse-grained NMA.", custom_flags={"output_pdb_path": "-o"})
 
 if __name__ == '__main__':
     main()
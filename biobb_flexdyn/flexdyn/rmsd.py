@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+"""Module containing the batched all-vs-all RMSD of the FlexDyn ensembles and the command line interface."""
+from typing import Optional, Union
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from biobb_flexdyn.flexdyn.ensemble import Ensemble
+
+# Frames of every side of the square tiles of the matrix computed at a time
+TILE_SIZE = 512
+# Relative precision of the largest eigenvalue found by the Newton-Raphson iterations, and their maximum number
+EIGENVALUE_PRECISION = 1e-11
+MAX_ITERATIONS = 50
+
+# Centered coordinates and output matrix memory-mapped by every worker process
+_worker_arrays: tuple[np.ndarray, np.ndarray] = (np.empty((0, 0, 3)), np.empty((0, 0)))
+
+
+def qcp_rmsd(coords_a: np.ndarray, coords_b: np.ndarray, centered: bool = False) -> np.ndarray:
+    """Returns the (n_a, n_b) RMSD (Angstroms) of every frame of **coords_a** (n_a, n_atoms, 3) and every frame of
+    **coords_b** (n_b, n_atoms, 3) after their optimal superposition, without computing the rotations.
+
+    The minimal RMSD of every pair of frames is given by the largest eigenvalue of the 4x4 quaternion key matrix of
+    its 3x3 inner product matrix (Theobald, Acta Cryst. A 2005), the largest root of a quartic characteristic
+    polynomial found by Newton-Raphson iterations. The inner product matrices of all the pairs are computed by a
+    single matrix product, and the polynomials of all the pairs are solved at once. If **centered** is True, the
+    frames are expected to be centered at the origin already."""
+    coords_a = np.asarray(coords_a, dtype=np.float64)
+    coords_b = np.asarray(coords_b, dtype=np.float64)
+    if coords_a.shape[1:] != coords_b.shape[1:] or coords_a.ndim != 3 or coords_a.shape[2] != 3:
+        raise ValueError(f"Frames of shape {coords_a.shape[1:]} and {coords_b.shape[1:]} can not be superposed, (n_atoms, 3) expected")
+    num_a, num_atoms = coords_a.shape[:2]
+    num_b = len(coords_b)
+    if not num_atoms:
+        raise ValueError("Frames without atoms can not be superposed")
+    if not centered:
+        coords_a = coords_a - coords_a.mean(axis=1, keepdims=True)
+        coords_b = coords_b - coords_b.mean(axis=1, keepdims=True)
+
+    # Inner products of every pair: S[i, j, k, l] = sum over the atoms of coords_a[i, :, k] * coords_b[j, :, l]
+    inner = (coords_a.transpose(0, 2, 1).reshape(num_a * 3, num_atoms) @ coords_b.transpose(0, 2, 1).reshape(num_b * 3, num_atoms).T)
+    inner = np.ascontiguousarray(inner.reshape(num_a, 3, num_b, 3).transpose(1, 3, 0, 2))
+    half_norms = (np.einsum('ijk,ijk->i', coords_a, coords_a)[:, np.newaxis] + np.einsum('ijk,ijk->i', coords_b, coords_b)) / 2.0
+    (sxx, sxy, sxz), (syx, syy, syz), (szx, szy, szz) = inner
+
+    # Coefficients of the characteristic polynomial x^4 + c2 x^2 + c1 x + c0 of the key matrix
+    sxx2, syy2, szz2, sxy2, syz2, sxz2, syx2, szy2, szx2 = (value * value for value in (sxx, syy, szz, sxy, syz, sxz, syx, szy, szx))
+    syz_szy_syy_szz2 = 2.0 * (syz * szy - syy * szz)
+    sxx2_syy2_szz2_syz2_szy2 = syy2 + szz2 - sxx2 + syz2 + szy2
+    sxy2_sxz2_syx2_szx2 = sxy2 + sxz2 - syx2 - szx2
+    c2 = -2.0 * (sxx2 + syy2 + szz2 + sxy2 + syx2 + sxz2 + szx2 + syz2 + szy2)
+    c1 = 8.0 * (sxx * syz * szy + syy * szx * sxz + szz * sxy * syx - sxx * syy * szz - syz * szx * sxy - szy * syx * sxz)
+    sxz_p_szx, syz_p_szy, sxy_p_syx = sxz + szx, syz + szy, sxy + syx
+    syz_m_szy, sxz_m_szx, sxy_m_syx = syz - szy, sxz - szx, sxy - syx
+    sxx_p_syy, sxx_m_syy = sxx + syy, sxx - syy
+    c0 = (sxy2_sxz2_syx2_szx2 * sxy2_sxz2_syx2_szx2
+          + (sxx2_syy2_szz2_syz2_szy2 + syz_szy_syy_szz2) * (sxx2_syy2_szz2_syz2_szy2 - syz_szy_syy_szz2)
+          + (-sxz_p_szx * syz_m_szy + sxy_m_syx * (sxx_m_syy - szz)) * (-sxz_m_szx * syz_p_szy + sxy_m_syx * (sxx_m_syy + szz))
+          + (-sxz_p_szx * syz_p_szy - sxy_p_syx * (sxx_p_syy - szz)) * (-sxz_m_szx * syz_m_szy - sxy_p_syx * (sxx_p_syy + szz))
+          + (sxy_p_syx * syz_p_szy + sxz_p_szx * (sxx_m_syy + szz)) * (-sxy_m_syx * syz_m_szy + sxz_p_szx * (sxx_p_syy + szz))
+          + (sxy_p_syx * syz_m_szy + sxz_m_szx * (sxx_m_syy - szz)) * (-sxy_m_syx * syz_p_szy + sxz_m_szx * (sxx_p_syy - szz)))
+
+    # Newton-Raphson from the upper bound of the largest eigenvalue, (|A|^2 + |B|^2) / 2, iterating over the pairs
+    # that have not converged yet only
+    eigenvalue = half_norms.ravel().copy()
+    c2, c1, c0 = c2.ravel(), c1.ravel(), c0.ravel()
+    active = np.arange(eigenvalue.size)
+    for _ in range(MAX_ITERATIONS):
+        x = eigenvalue[active]
+        squared = x * x
+        b = (squared + c2) * x
+        a = b + c1
+        delta = (a * x + c0) / (2.0 * squared * x + b + a)
+        x -= delta
+        eigenvalue[active] = x
+        unconverged = np.abs(delta) > EIGENVALUE_PRECISION * np.abs(x)
+        if not unconverged.any():
+            break
+        if not unconverged.all():
+            active, c2, c1, c0 = active[unconverged], c2[unconverged], c1[unconverged], c0[unconverged]
+    eigenvalue = eigenvalue.reshape(half_norms.shape)
+    return np.sqrt(np.abs(2.0 * (half_norms - eigenvalue) / num_atoms))
+
+
+def rmsd_matrix(coords: np.ndarray, output_path: Optional[Union[str, Path]] = None, tile_size: int = TILE_SIZE,
+                num_workers: Optional[int] = None, tmp_dir: Optional[Union[str, Path]] = None,
+                atom_indices: Optional[np.ndarray] = None) -> np.ndarray:
+    """Returns the symmetric (n_frames, n_frames) float32 matrix of the RMSD (Angstroms) of every pair of frames of
+    **coords** (n_frames, n_atoms, 3) after their optimal superposition (see :func:`qcp_rmsd`).
+
+    The matrix is computed by square tiles of **tile_size** frames, the tiles of its upper triangle being shared by a
+    pool of **num_workers** processes that write them (and their transpose) to the memory-mapped .npy file
+    **output_path**, so neither the matrix nor the frames are held in memory: the frames are centered chunk by chunk
+    to a memory-mapped copy in **tmp_dir**, keeping only the **atom_indices** atoms. The returned matrix is that
+    memory-mapped file, or an in-memory array if **output_path** is not set.
+
+    Args:
+        coords (np.ndarray): (n_frames, n_atoms, 3) coordinates (Angstroms), ie: the coords of an :class:`Ensemble <flexdyn.ensemble.Ensemble>`.
+        output_path (str): Path to the output .npy matrix.
+        tile_size (int): Frames of every side of the tiles.
+        num_workers (int): Number of worker processes. If not set, the number of CPUs.
+        tmp_dir (str): Directory of the temporary centered coordinates. If not set, the system temporary directory.
+        atom_indices (np.ndarray): 0-based indices of the superposed atoms. If not set, all the atoms.
+    """
+    if np.ndim(coords) != 3 or np.shape(coords)[2] != 3:
+        raise ValueError(f"coords of shape {np.shape(coords)} are not (n_frames, n_atoms, 3) frames")
+    if tile_size < 1:
+        raise ValueError(f"tile_size must be greater than 0, not {tile_size}")
+    num_frames, num_atoms = np.shape(coords)[:2]
+    if atom_indices is not None:
+        num_atoms = len(atom_indices)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        coords_path = str(Path(work_dir).joinpath('centered.npy'))
+        centered = np.lib.format.open_memmap(coords_path, mode='w+', dtype=np.float32, shape=(num_frames, num_atoms, 3))
+        for start in range(0, num_frames, tile_size):
+            chunk = np.asarray(coords[start:start + tile_size], dtype=np.float64)
+            if atom_indices is not None:
+                chunk = chunk[:, atom_indices]
+            centered[start:start + tile_size] = chunk - chunk.mean(axis=1, keepdims=True)
+        centered.flush()
+        del centered
+
+        matrix_path = str(output_path or Path(work_dir).joinpath('matrix.npy'))
+        matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(num_frames, num_frames))
+        tiles = [(start_a, start_b, tile_size) for start_a in range(0, num_frames, tile_size) for start_b in range(start_a, num_frames, tile_size)]
+        num_workers = min(num_workers or os.cpu_count() or 1, len(tiles))
+        if num_workers > 1:
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(coords_path, matrix_path)) as executor:
+                for _ in executor.map(_rmsd_tile, *zip(*tiles), chunksize=max(1, len(tiles) // (4 * num_workers))):
+                    pass
+        else:
+            _init_worker(coords_path, matrix_path)
+            for tile in tiles:
+                _rmsd_tile(*tile)
+            _init_worker(None, None)
+        np.fill_diagonal(matrix, 0.0)
+        matrix.flush()
+        if output_path:
+            return matrix
+        return np.array(matrix)
+
+
+def ensemble_rmsd_matrix(traj_path: Union[str, Path], output_path: Union[str, Path], top_path: Optional[Union[str, Path]] = None,
+                         atom_names: Optional[list[str]] = None, tile_size: int = TILE_SIZE, num_workers: Optional[int] = None) -> np.ndarray:
+    """Writes the all-vs-all RMSD matrix (see :func:`rmsd_matrix`) of the frames of the ensemble **traj_path** (multi-model PDB,
+    multi-frame GRO, XTC, DCD or NPZ file, see :meth:`Ensemble.read <flexdyn.ensemble.Ensemble.read>`) to the .npy file **output_path**.
+
+    The frames are memory-mapped while they are read chunk by chunk, and only the atoms named as one of the
+    **atom_names** (ie: ["CA"]) are superposed if set, selected from every chunk of frames while they are centered.
+
+    Args:
+        traj_path (str): Path to the input ensemble.
+        output_path (str): Path to the output .npy matrix.
+        top_path (str): Path to the topology PDB file of the XTC and DCD trajectories.
+        atom_names (list): Names of the superposed atoms. If not set, all the atoms.
+        tile_size (int): Frames of every side of the tiles.
+        num_workers (int): Number of worker processes. If not set, the number of CPUs.
+    """
+    tmp_dir = Path(output_path).resolve().parent
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        ensemble = Ensemble.read(traj_path, mmap_path=Path(work_dir).joinpath('coords.npy'), top_path=top_path)
+        atom_indices = None
+        if atom_names:
+            atom_indices = np.flatnonzero(np.isin(ensemble.topology['name'], atom_names))
+            if not len(atom_indices):
+                raise ValueError(f"{traj_path}: no atoms named {', '.join(atom_names)}")
+        matrix = rmsd_matrix(ensemble.coords, output_path, tile_size, num_workers, tmp_dir, atom_indices)
+        del ensemble
+    return matrix
+
+
+def _init_worker(coords_path: Optional[str], matrix_path: Optional[str]) -> None:
+    # Memory-mapped once per worker process, every tile is written in place to the shared output file
+    global _worker_arrays
+    if coords_path is None or matrix_path is None:
+        _worker_arrays = (np.empty((0, 0, 3)), np.empty((0, 0)))
+        return
+    _worker_arrays = (np.load(coords_path, mmap_mode='r'), np.load(matrix_path, mmap_mode='r+'))
+
+
+def _rmsd_tile(start_a: int, start_b: int, tile_size: int) -> None:
+    coords, matrix = _worker_arrays
+    rmsd = qcp_rmsd(coords[start_a:start_a + tile_size], coords[start_b:start_b + tile_size], centered=True)
+    matrix[start_a:start_a + tile_size, start_b:start_b + tile_size] = rmsd
+    matrix[start_b:start_b + tile_size, start_a:start_a + tile_size] = rmsd.T
+
+
+def main():
+    """Command line execution of this module."""
+    parser = argparse.ArgumentParser(description="All-vs-all RMSD matrix of the frames of a FlexDyn ensemble, after their optimal superposition.",
+                                     formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=99999))
+    required_args = parser.add_argument_group('required arguments')
+    required_args.add_argument('--input_traj_path', required=True, help="Input ensemble: multi-model PDB, multi-frame GRO, XTC, DCD or NPZ file")
+    required_args.add_argument('--output_npy_path', required=True, help="Output (n_frames, n_frames) float32 RMSD matrix (Angstroms) in .npy format")
+    parser.add_argument('--input_top_path', help="Topology PDB file of the XTC and DCD trajectories")
+    parser.add_argument('--atom_names', nargs='+', help="Names of the superposed atoms, ie: CA. Default: all the atoms")
+    parser.add_argument('--tile_size', type=int, default=TILE_SIZE, help=f"Frames of every side of the tiles computed at a time. Default: {TILE_SIZE}")
+    parser.add_argument('--num_workers', type=int, help="Number of worker processes. Default: the number of CPUs")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    matrix = ensemble_rmsd_matrix(args.input_traj_path, args.output_npy_path, args.input_top_path, args.atom_names, args.tile_size, args.num_workers)
+    print(f"{len(matrix)}x{len(matrix)} RMSD matrix written to {args.output_npy_path} in {time.monotonic() - start:.1f} s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
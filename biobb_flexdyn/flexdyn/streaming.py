@@ -0,0 +1,237 @@
+"""Module containing the streaming of the frames of the ensembles of the FlexDyn blocks while they are generated."""
+import asyncio
+import queue
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple, Optional, Union
+import numpy as np
+from biobb_common.tools import file_utils as fu
+from biobb_flexdyn.flexdyn.instrumentation import phase
+from biobb_flexdyn.flexdyn.processes import command_wrapper, log_process_output, start_process, terminate_process, wait_process
+
+
+class StreamFrame(NamedTuple):
+    """Completed frame of an ensemble being generated, with the progress of the generation."""
+    #: Frame number (1-based) in order of completion
+    index: int
+    #: (n_atoms, 3) coordinates (Angstroms)
+    coords: np.ndarray
+    #: PDB records of the model, from the end of the previous model to its ENDMDL record
+    model: str
+    #: Seconds since the generation started
+    elapsed: float
+    #: Frames generated per second
+    rate: float
+    #: Estimated seconds to generate the remaining frames, None if unknown
+    eta: Optional[float]
+
+
+class PdbModelTail:
+    """Incremental reader of the complete models of a multi-model PDB file being written by another process.
+
+    Args:
+        pdb_path (str): Path to the multi-model PDB file, that may not exist yet.
+    """
+
+    def __init__(self, pdb_path: Union[str, Path]) -> None:
+        self.pdb_path = Path(pdb_path)
+        self.read_offset = 0
+        self.pending = b''
+        #: Byte offset after the last complete model returned by :meth:`read_models`
+        self.model_end = 0
+
+    def read_models(self) -> Iterator[tuple[str, int]]:
+        """Yield the text and the end byte offset of the models completed since the last call."""
+        if not self.pdb_path.exists():
+            return
+        with open(self.pdb_path, 'rb') as pdb_file:
+            pdb_file.seek(self.read_offset)
+            data = pdb_file.read()
+        self.read_offset += len(data)
+        self.pending += data
+        start = 0
+        for match in re.finditer(rb'^ENDMDL[^\n]*\n', self.pending, re.MULTILINE):
+            model_end = self.read_offset - len(self.pending) + match.end()
+            yield self.pending[start:match.end()].decode(), model_end
+            start = match.end()
+        self.pending = self.pending[start:]
+
+    def truncate(self, offset: int) -> None:
+        """Truncate the PDB file after the model ending at byte **offset**."""
+        if self.pdb_path.exists():
+            with open(self.pdb_path, 'rb+') as pdb_file:
+                pdb_file.truncate(offset)
+
+
+def model_coords(model: str) -> np.ndarray:
+    """Return the (n_atoms, 3) coordinates of the ATOM and HETATM records of the PDB **model** text."""
+    return np.array([[float(line[30:38]), float(line[38:46]), float(line[46:54])]
+                     for line in model.splitlines() if line.startswith(('ATOM', 'HETATM'))])
+
+
+def is_streaming(block) -> bool:
+    """Return whether a frame callback or a stop condition has been set on the **block**."""
+    return bool(getattr(block, 'frame_callback', None) or getattr(block, 'stop_condition', None))
+
+
+def run_streaming(block, cmds: list[list[str]], traj_paths: list[Union[str, Path]], num_frames: Optional[int],
+                  poll_interval: float = 0.5, progress_interval: float = 10.0) -> tuple[int, bool]:
+    """Run the command lines **cmds** concurrently, using the shell, environment and logs of the **block**,
+    while tailing the multi-model PDB files **traj_paths** they write. Every completed model is passed as a
+    :class:`StreamFrame` to the ``frame_callback`` of the block, and the processes are terminated once its
+    ``stop_condition`` returns True for a frame; the PDB files are then truncated after the last frame passed.
+    The progress (frames, rate and ETA out of **num_frames**) is logged every **progress_interval** seconds.
+    Return the first non-zero exit code or 0 and whether the stop condition was met."""
+    with phase(block, 'run_streaming'):
+        return _run_streaming(block, cmds, traj_paths, num_frames, poll_interval, progress_interval)
+
+
+def _run_streaming(block, cmds: list[list[str]], traj_paths: list[Union[str, Path]], num_frames: Optional[int],
+                   poll_interval: float, progress_interval: float,
+                   cancelled: Optional[threading.Event] = None) -> tuple[int, bool]:
+    frame_callback: Optional[Callable[[StreamFrame], None]] = getattr(block, 'frame_callback', None)
+    stop_condition: Optional[Callable[[StreamFrame], bool]] = getattr(block, 'stop_condition', None)
+    tails = [PdbModelTail(traj_path) for traj_path in traj_paths]
+
+    processes = []
+    for cmd in cmds:
+        fu.log(f"Launching command (streaming frames): {' '.join(cmd)}", block.out_log)
+        wrapper = command_wrapper(block, cmd)
+        out_file, err_file = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+        processes.append((wrapper, start_process(wrapper, out_file, err_file), out_file, err_file))
+
+    start = last_progress = time.monotonic()
+    num_done = 0
+    stopped = timed_out = killed = False
+
+    def read_frames() -> bool:
+        nonlocal num_done
+        for tail in tails:
+            for model, model_end in tail.read_models():
+                num_done += 1
+                tail.model_end = model_end
+                elapsed = time.monotonic() - start
+                rate = num_done / elapsed if elapsed > 0 else 0.0
+                eta = (num_frames - num_done) / rate if num_frames and rate else None
+                frame = StreamFrame(num_done, model_coords(model), model, elapsed, rate, eta)
+                if frame_callback:
+                    frame_callback(frame)
+                if stop_condition and stop_condition(frame):
+                    return True
+        return False
+
+    while True:
+        running = not all([wait_process(block, process, 0) for _, process, _, _ in processes])
+        if read_frames():
+            stopped = True
+            break
+        if not running:
+            break
+        if cancelled is not None and cancelled.is_set():
+            killed = True
+            break
+        now = time.monotonic()
+        if block.timeout and now - start > block.timeout:
+            timed_out = True
+            break
+        if now - last_progress >= progress_interval:
+            last_progress = now
+            rate = num_done / (now - start)
+            eta = f"{(num_frames - num_done) / rate:.0f} s" if num_frames and rate else "unknown"
+            fu.log(f"Streaming: {num_done}{f'/{num_frames}' if num_frames else ''} frames ({rate:.2f} frames/s, ETA: {eta})", block.out_log, block.global_log)
+        time.sleep(poll_interval)
+
+    if stopped or timed_out or killed:
+        for _, process, _, _ in processes:
+            terminate_process(process, block=block)
+
+    return_code = 0
+    for wrapper, process, out_file, err_file in processes:
+        wait_process(block, process)
+        log_process_output(wrapper, process.returncode, out_file, err_file, timed_out)
+        out_file.close()
+        err_file.close()
+        if not stopped:
+            return_code = return_code or process.returncode
+    if timed_out or killed:
+        return_code = 1
+
+    elapsed = time.monotonic() - start
+    fu.log(f"Streamed {num_done} frames in {elapsed:.1f} s ({num_done / elapsed if elapsed else 0:.2f} frames/s)", block.out_log, block.global_log)
+    if stopped:
+        fu.log(f"Stop condition met after {num_done} frames, generation terminated", block.out_log, block.global_log)
+        for tail in tails:
+            tail.truncate(tail.model_end)
+    return return_code, stopped
+
+
+def stream_frames(block, stop_condition: Optional[Callable[[StreamFrame], bool]] = None) -> Iterator[StreamFrame]:
+    """Launch the **block** in a background thread and yield the frames of its ensemble as they are generated.
+
+    The generation is terminated once **stop_condition** returns True for a frame or when the generator is
+    closed (ie: breaking the loop). The exit code of the launch is available in ``block.return_code``.
+
+    Args:
+        block (BiobbObject): Block streaming frames (ConcoordDisco, Nolb_nma or ImodImc).
+        stop_condition (Callable): Function called with every :class:`StreamFrame`, returning True to stop the generation.
+    """
+    frames: queue.Queue = queue.Queue()
+    finished = object()
+    closed = threading.Event()
+    errors: list[BaseException] = []
+    frame_callback = block.frame_callback
+    block_stop_condition = stop_condition or block.stop_condition
+
+    def put_frame(frame: StreamFrame) -> None:
+        if frame_callback:
+            frame_callback(frame)
+        # Wait for the consumer to request the next frame, so that the stop condition sees the generator closed
+        frames.put(frame)
+        frames.join()
+
+    def launch() -> None:
+        try:
+            block.launch()
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            frames.put(finished)
+
+    block.frame_callback = put_frame
+    block.stop_condition = lambda frame: closed.is_set() or bool(block_stop_condition and block_stop_condition(frame))
+    thread = threading.Thread(target=launch, daemon=True)
+    thread.start()
+    try:
+        while (frame := frames.get()) is not finished:
+            try:
+                yield frame
+            except GeneratorExit:
+                closed.set()
+                raise
+            finally:
+                frames.task_done()
+    finally:
+        closed.set()
+        thread.join()
+        block.frame_callback, block.stop_condition = frame_callback, block_stop_condition
+    if errors:
+        raise errors[0]
+
+
+async def run_streaming_async(block, cmds: list[list[str]], traj_paths: list[Union[str, Path]],
+                              num_frames: Optional[int]) -> tuple[int, bool]:
+    """Asynchronous equivalent of :func:`run_streaming`. The frames are tailed in a worker thread, as the frame
+    callback and the stop condition of the block are synchronous. When cancelled, the processes are terminated
+    before the cancellation is propagated."""
+    cancelled = threading.Event()
+    with phase(block, 'run_streaming'):
+        streaming = asyncio.ensure_future(asyncio.to_thread(_run_streaming, block, cmds, traj_paths, num_frames, 0.5, 10.0, cancelled))
+        try:
+            return await asyncio.shield(streaming)
+        except asyncio.CancelledError:
+            cancelled.set()
+            await streaming
+            raise
@@ -0,0 +1,429 @@
+"""Module containing the XTC, DCD and NPZ trajectory writers and readers of the FlexDyn ensembles."""
+import struct
+from pathlib import Path
+from typing import Iterator, Optional, Union
+import numpy as np
+
+# Binary trajectory formats written by the ensemble generating blocks, besides multi-model PDB
+TRAJECTORY_FORMATS = ('.xtc', '.dcd', '.npz')
+# Default precision (1 / nm) of the XTC coordinates, as in GROMACS
+XTC_PRECISION = 1000.0
+XTC_MAGIC = 1995
+# Bits of the XTC run-length encoded small differences: magicints[i] ~ 2^(i/3)
+XTC_MAGICINTS = (0, 0, 0, 0, 0, 0, 0, 0, 0, 8, 10, 12, 16, 20, 25, 32, 40, 50, 64, 80, 101, 128, 161, 203, 256, 322, 406, 512, 645,
+                 812, 1024, 1290, 1625, 2048, 2580, 3250, 4096, 5060, 6501, 8192, 10321, 13003, 16384, 20642, 26007, 32768, 41285,
+                 52015, 65536, 82570, 104031, 131072, 165140, 208063, 262144, 330280, 416127, 524287, 660561, 832255, 1048576,
+                 1321122, 1664510, 2097152, 2642245, 3329021, 4194304, 5284491, 6658042, 8388607, 10568983, 13316085, 16777216)
+XTC_FIRSTIDX = 9
+# Frames converted at a time by the streaming writers
+CHUNK_SIZE = 1000
+
+
+def is_binary_trajectory(traj_path: Union[str, Path]) -> bool:
+    """Returns whether **traj_path** is an XTC, DCD or NPZ trajectory."""
+    return Path(traj_path).suffix.lower() in TRAJECTORY_FORMATS
+
+
+class TrajectoryWriter:
+    """Base class of the streaming trajectory writers, appending (n_frames, n_atoms, 3) coordinate chunks (Angstroms).
+
+    Args:
+        traj_path (str): Path to the output trajectory.
+        num_atoms (int): Number of atoms of every frame.
+    """
+    #: Type of the coordinates given to :meth:`write_frames`
+    dtype: type = np.float32
+
+    def __init__(self, traj_path: Union[str, Path], num_atoms: int) -> None:
+        self.traj_path = Path(traj_path)
+        self.num_atoms = num_atoms
+        self.num_frames = 0
+        self.traj_file = open(self.traj_path, 'wb')
+
+    def __enter__(self) -> 'TrajectoryWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, coords: np.ndarray) -> None:
+        """Appends the (n_frames, n_atoms, 3) or (n_atoms, 3) **coords** (Angstroms) to the trajectory."""
+        coords = np.asarray(coords, dtype=self.dtype)
+        if coords.ndim == 2:
+            coords = coords[np.newaxis]
+        if coords.shape[1:] != (self.num_atoms, 3):
+            raise ValueError(f"{self.traj_path}: frames of shape {coords.shape[1:]} do not match the ({self.num_atoms}, 3) frames of the trajectory")
+        self.write_frames(coords)
+        self.num_frames += len(coords)
+
+    def write_frames(self, coords: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Completes and closes the trajectory file."""
+        self.traj_file.close()
+
+
+class XtcWriter(TrajectoryWriter):
+    """GROMACS XTC writer. The coordinates are quantized with **precision** and bit-packed at once for all the atoms of a
+    frame, without the run-length encoding of small differences between consecutive atoms used by GROMACS, which keeps the
+    files readable by any XTC reader at the cost of files about 20% larger.
+
+    Args:
+        traj_path (str): Path to the output trajectory.
+        num_atoms (int): Number of atoms of every frame.
+        precision (float): (1000.0) Precision (1 / nm) of the coordinates.
+    """
+
+    def __init__(self, traj_path: Union[str, Path], num_atoms: int, precision: float = XTC_PRECISION) -> None:
+        super().__init__(traj_path, num_atoms)
+        self.precision = np.float32(precision)
+
+    def write_frames(self, coords: np.ndarray) -> None:
+        for step, frame in enumerate(coords, self.num_frames):
+            # Step and time are the frame index, no box
+            header = struct.pack('>iiif9fi', XTC_MAGIC, self.num_atoms, step, float(step), *([0.0] * 9), self.num_atoms)
+            # Angstroms to nm
+            self.traj_file.write(header + _xtc_coords(frame / np.float32(10), self.precision))
+
+
+class DcdWriter(TrajectoryWriter):
+    """CHARMM/NAMD DCD writer (little-endian, without unit cell). The number of frames of the header is updated on :meth:`close`."""
+
+    def __init__(self, traj_path: Union[str, Path], num_atoms: int) -> None:
+        super().__init__(traj_path, num_atoms)
+        # NSET, ISTART, NSAVC and NSTEP, 5 unused, DELTA, unit cell flag, 8 unused and CHARMM version 24
+        self.traj_file.write(struct.pack('<i4s9if10ii', 84, b'CORD', 0, 0, 1, 0, 0, 0, 0, 0, 0, 1.0, *([0] * 9), 24, 84))
+        titles = [b'REMARKS FILENAME=' + self.traj_path.name.encode() + b' CREATED BY BIOBB_FLEXDYN', b'REMARKS ENSEMBLE']
+        self.traj_file.write(struct.pack('<ii', 164, 2) + b''.join(title[:80].ljust(80) for title in titles) + struct.pack('<i', 164))
+        self.traj_file.write(struct.pack('<iii', 4, num_atoms, 4))
+
+    def write_frames(self, coords: np.ndarray) -> None:
+        marker = np.full((len(coords), 3, 1), 4 * self.num_atoms, dtype='<i4').view('<f4')
+        # Every frame: X, Y and Z records of num_atoms floats between Fortran record length markers
+        records = np.concatenate([marker, coords.transpose(0, 2, 1).astype('<f4'), marker], axis=2)
+        self.traj_file.write(records.tobytes())
+
+    def close(self) -> None:
+        if not self.traj_file.closed:
+            self.traj_file.seek(8)
+            self.traj_file.write(struct.pack('<i', self.num_frames))
+            self.traj_file.seek(20)
+            self.traj_file.write(struct.pack('<i', self.num_frames))
+        super().close()
+
+
+class NpzWriter(TrajectoryWriter):
+    """Uncompressed NPZ writer, with the ``coords`` float32 array (Angstroms) and the ``topology`` array of the atoms,
+    as written by :meth:`Ensemble.save <flexdyn.ensemble.Ensemble.save>`. The frames are appended to a raw temporary
+    file that is memory-mapped and stored in the NPZ on :meth:`close`.
+
+    Args:
+        traj_path (str): Path to the output trajectory.
+        num_atoms (int): Number of atoms of every frame.
+        topology (np.ndarray): (None) Per-atom structured array stored with the coordinates.
+    """
+
+    def __init__(self, traj_path: Union[str, Path], num_atoms: int, topology: Optional[np.ndarray] = None) -> None:
+        super().__init__(self._raw_path(traj_path), num_atoms)
+        self.npz_path = Path(traj_path)
+        self.topology = topology
+
+    @staticmethod
+    def _raw_path(traj_path: Union[str, Path]) -> Path:
+        return Path(traj_path).with_name(Path(traj_path).name + '.coords.tmp')
+
+    def write_frames(self, coords: np.ndarray) -> None:
+        self.traj_file.write(np.ascontiguousarray(coords, dtype='<f4').tobytes())
+
+    def close(self) -> None:
+        if self.traj_file.closed:
+            return
+        super().close()
+        shape = (self.num_frames, self.num_atoms, 3)
+        coords = np.memmap(self.traj_path, dtype='<f4', mode='r', shape=shape) if self.num_frames and self.num_atoms else np.empty(shape, dtype=np.float32)
+        arrays = {'coords': coords}
+        if self.topology is not None:
+            arrays['topology'] = self.topology
+        np.savez(self.npz_path, **arrays)
+        del arrays, coords
+        self.traj_path.unlink()
+
+
+def open_trajectory_writer(traj_path: Union[str, Path], num_atoms: int, topology: Optional[np.ndarray] = None) -> TrajectoryWriter:
+    """Returns the writer of the XTC, DCD or NPZ trajectory **traj_path**."""
+    suffix = Path(traj_path).suffix.lower()
+    if suffix == '.xtc':
+        return XtcWriter(traj_path, num_atoms)
+    if suffix == '.dcd':
+        return DcdWriter(traj_path, num_atoms)
+    if suffix == '.npz':
+        return NpzWriter(traj_path, num_atoms, topology)
+    raise ValueError(f"{traj_path}: the trajectory must be a {', '.join(TRAJECTORY_FORMATS)} formatted file")
+
+
+def read_trajectory(traj_path: Union[str, Path]) -> np.ndarray:
+    """Returns the (n_frames, n_atoms, 3) float32 coordinates (Angstroms) of the XTC, DCD or NPZ trajectory **traj_path**."""
+    suffix = Path(traj_path).suffix.lower()
+    if suffix == '.xtc':
+        return read_xtc(traj_path)
+    if suffix == '.dcd':
+        return read_dcd(traj_path)
+    if suffix == '.npz':
+        with np.load(traj_path) as npz:
+            return npz['coords']
+    raise ValueError(f"{traj_path}: the trajectory must be a {', '.join(TRAJECTORY_FORMATS)} formatted file")
+
+
+def count_trajectory_frames(traj_path: Union[str, Path]) -> int:
+    """Returns the number of frames of the XTC or DCD trajectory **traj_path**, reading only the frame headers."""
+    suffix = Path(traj_path).suffix.lower()
+    if suffix == '.xtc':
+        return sum(1 for _ in _iter_xtc_frames(traj_path, decode=False))
+    if suffix == '.dcd':
+        return len(_memmap_dcd(traj_path)[0])
+    raise ValueError(f"{traj_path}: the trajectory must be a XTC or DCD formatted file")
+
+
+def iter_trajectory_chunks(traj_path: Union[str, Path], chunk_size: int = CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """Yield the float32 coordinates (Angstroms) of the XTC or DCD trajectory **traj_path** in (n_frames, n_atoms, 3)
+    arrays of at most **chunk_size** frames, reading only those frames from the file."""
+    suffix = Path(traj_path).suffix.lower()
+    if suffix == '.dcd':
+        frames, num_atoms = _memmap_dcd(traj_path)
+        for start in range(0, len(frames), chunk_size):
+            yield _dcd_coords(frames[start:start + chunk_size], num_atoms)
+        return
+    if suffix != '.xtc':
+        raise ValueError(f"{traj_path}: the trajectory must be a XTC or DCD formatted file")
+    chunk: list[np.ndarray] = []
+    for frame in _iter_xtc_frames(traj_path):
+        chunk.append(frame)
+        if len(chunk) == chunk_size:
+            yield np.stack(chunk)
+            chunk = []
+    if chunk:
+        yield np.stack(chunk)
+
+
+def read_dcd(dcd_path: Union[str, Path]) -> np.ndarray:
+    """Returns the (n_frames, n_atoms, 3) float32 coordinates of the little-endian DCD **dcd_path**."""
+    return _dcd_coords(*_memmap_dcd(dcd_path))
+
+
+def _memmap_dcd(dcd_path: Union[str, Path]) -> tuple[np.ndarray, int]:
+    """Memory-maps the (n_frames, frame size) float32 records of the frames of the little-endian DCD **dcd_path**,
+    returned with the number of atoms."""
+    with open(dcd_path, 'rb') as dcd_file:
+        header = dcd_file.read(100)
+        if header[4:8] != b'CORD':
+            raise ValueError(f"{dcd_path}: not a little-endian DCD file")
+        has_unit_cell = struct.unpack_from('<i', header, 48)[0]
+        title_length = struct.unpack_from('<i', header, 92)[0]
+        offset = 92 + 4 + title_length + 4
+        dcd_file.seek(offset + 4)
+        num_atoms = struct.unpack('<i', dcd_file.read(4))[0]
+        offset += 12
+        frame_size = (4 + 48 + 4 if has_unit_cell else 0) + 3 * (4 * num_atoms + 8)
+        num_frames = (dcd_file.seek(0, 2) - offset) // frame_size
+    if not num_frames:
+        return np.empty((0, frame_size // 4), dtype='<f4'), num_atoms
+    return np.memmap(dcd_path, dtype='<f4', mode='r', offset=offset, shape=(num_frames, frame_size // 4)), num_atoms
+
+
+def _dcd_coords(frames: np.ndarray, num_atoms: int) -> np.ndarray:
+    # The x, y and z records of every frame, after its unit cell record if any, are framed by their 4 bytes lengths
+    frames = frames[:, frames.shape[1] - 3 * (num_atoms + 2):].reshape(len(frames), 3, num_atoms + 2)[:, :, 1:-1]
+    return np.ascontiguousarray(frames.transpose(0, 2, 1), dtype=np.float32)
+
+
+def read_xtc(xtc_path: Union[str, Path]) -> np.ndarray:
+    """Returns the (n_frames, n_atoms, 3) float32 coordinates (Angstroms) of the GROMACS XTC **xtc_path**, decoding the
+    run-length encoded small differences written by GROMACS as well."""
+    frames = list(_iter_xtc_frames(xtc_path))
+    if not frames:
+        return np.empty((0, 0, 3), dtype=np.float32)
+    return np.stack(frames)
+
+
+def _iter_xtc_frames(xtc_path: Union[str, Path], decode: bool = True) -> Iterator[np.ndarray]:
+    """Yield the (n_atoms, 3) float32 coordinates (Angstroms) of every frame of the XTC **xtc_path**, reading one frame
+    at a time. If **decode** is False, the coordinates are skipped and empty arrays are yielded."""
+    with open(xtc_path, 'rb') as xtc_file:
+        while True:
+            offset = xtc_file.tell()
+            # Magic, number of atoms, step, time, box and number of atoms again
+            header = xtc_file.read(4 * 14)
+            if not header:
+                break
+            if len(header) < 4 * 14:
+                raise ValueError(f"{xtc_path}: truncated XTC frame at byte {offset}")
+            magic, num_atoms = struct.unpack_from('>ii', header)
+            if magic != XTC_MAGIC:
+                raise ValueError(f"{xtc_path}: unexpected XTC magic number {magic} at byte {offset}")
+            if num_atoms <= 9:
+                data = xtc_file.read(12 * num_atoms)
+                if decode:
+                    yield np.frombuffer(data, dtype='>f4').reshape(num_atoms, 3).astype(np.float32) * np.float32(10)
+                else:
+                    yield np.empty((0, 3), dtype=np.float32)
+                continue
+            precision, *bounds, smallidx, num_bytes = struct.unpack('>f8i', xtc_file.read(4 * 9))
+            if not decode:
+                xtc_file.seek((num_bytes + 3) // 4 * 4, 1)
+                yield np.empty((0, 3), dtype=np.float32)
+                continue
+            buffer = xtc_file.read((num_bytes + 3) // 4 * 4)[:num_bytes]
+            coords = _decode_xtc_coords(buffer, num_atoms, precision, bounds[:3], bounds[3:], smallidx)
+            yield coords.astype(np.float32) * np.float32(10)
+
+
+def _xtc_coords(coords: np.ndarray, precision: np.float32) -> bytes:
+    """Encodes the compressed XTC coordinates (nm) of a frame from the precision to the compressed bytes."""
+    num_atoms = len(coords)
+    if num_atoms <= 9:
+        return coords.astype('>f4').tobytes()
+    scaled = coords * precision
+    ints = (scaled + np.where(scaled >= 0, np.float32(0.5), np.float32(-0.5))).astype(np.int64)
+    minint, maxint = ints.min(0), ints.max(0)
+    sizes = [int(size) for size in maxint - minint + 1]
+    # Smallest step between consecutive atoms, as GROMACS (used only by the run-length encoding of the readers)
+    mindiff = int(np.abs(np.diff(ints, axis=0)).sum(1).min())
+    smallidx = XTC_FIRSTIDX
+    while smallidx < len(XTC_MAGICINTS) - 1 and XTC_MAGICINTS[smallidx] < mindiff:
+        smallidx += 1
+
+    unsigned = ints - minint
+    if max(sizes) > 0xffffff:
+        # Large coordinates: every one of them in its own number of bits (big-endian)
+        bit_columns = [_int_bits(unsigned[:, axis], size.bit_length()) for axis, size in enumerate(sizes)]
+    else:
+        # The three coordinates as a single mixed-radix integer, sent as little-endian bytes
+        bitsize = (sizes[0] * sizes[1] * sizes[2]).bit_length()
+        if bitsize <= 63:
+            combined = (unsigned[:, 0] * sizes[1] + unsigned[:, 1]) * sizes[2] + unsigned[:, 2]
+        else:
+            combined = np.array([(int(x) * sizes[1] + int(y)) * sizes[2] + int(z) for x, y, z in unsigned], dtype=object)
+        full_bytes, remainder = divmod(bitsize, 8)
+        le_bytes = np.stack([(combined >> (8 * index)) & 0xff for index in range(full_bytes + 1)], axis=1).astype(np.uint8)
+        bits = np.unpackbits(le_bytes, axis=1)
+        bit_columns = [bits[:, :8 * full_bytes], bits[:, 8 * full_bytes + 8 - remainder:8 * full_bytes + 8]]
+    # No run of small differences after every atom: a single 0 bit
+    bit_columns.append(np.zeros((num_atoms, 1), dtype=np.uint8))
+    buffer = np.packbits(np.concatenate(bit_columns, axis=1).ravel()).tobytes()
+    padding = b'\0' * (-len(buffer) % 4)
+    return struct.pack('>f8i', precision, *minint.tolist(), *maxint.tolist(), smallidx, len(buffer)) + buffer + padding
+
+
+def _int_bits(values: np.ndarray, num_bits: int) -> np.ndarray:
+    """Returns the (n, **num_bits**) big-endian bits of the non-negative **values**."""
+    be_bytes = values.astype('>u4').view(np.uint8).reshape(-1, 4)
+    return np.unpackbits(be_bytes, axis=1)[:, 32 - num_bits:]
+
+
+class _BitReader:
+    """Most significant bit first reader of the XTC compressed coordinates."""
+
+    def __init__(self, buffer: bytes) -> None:
+        self.buffer = buffer + b'\0' * 8
+        self.position = 0
+
+    def bits(self, num_bits: int) -> int:
+        start, shift = divmod(self.position, 8)
+        end = (self.position + num_bits + 7) // 8
+        value = int.from_bytes(self.buffer[start:end], 'big')
+        self.position += num_bits
+        return (value >> (8 * (end - start) - shift - num_bits)) & ((1 << num_bits) - 1)
+
+    def ints(self, num_bits: int, sizes: list[int]) -> list[int]:
+        full_bytes, remainder = divmod(num_bits, 8)
+        if not remainder and full_bytes:
+            full_bytes, remainder = full_bytes - 1, 8
+        le_bytes = [self.bits(8) for _ in range(full_bytes)] + ([self.bits(remainder)] if remainder else [])
+        combined = int.from_bytes(bytes(le_bytes), 'little')
+        combined, z = divmod(combined, sizes[2])
+        x, y = divmod(combined, sizes[1])
+        return [x, y, z]
+
+
+def _decode_xtc_coords(buffer: bytes, num_atoms: int, precision: float, minint: list[int], maxint: list[int], smallidx: int) -> np.ndarray:
+    """Decodes the compressed XTC coordinates of a frame, following the GROMACS xdr3dfcoord algorithm."""
+    sizes = [high - low + 1 for low, high in zip(minint, maxint)]
+    large = max(sizes) > 0xffffff
+    bitsizes = [size.bit_length() for size in sizes]
+    bitsize = (sizes[0] * sizes[1] * sizes[2]).bit_length()
+    smaller = XTC_MAGICINTS[max(XTC_FIRSTIDX, smallidx - 1)] // 2
+    smallnum = XTC_MAGICINTS[smallidx] // 2
+    sizesmall = [XTC_MAGICINTS[smallidx]] * 3
+
+    fixed = _decode_xtc_fixed(buffer, num_atoms, sizes, bitsizes if large else None, bitsize)
+    if fixed is not None:
+        return (fixed + np.array(minint)).astype(np.float32) / np.float32(precision)
+
+    reader = _BitReader(buffer)
+    coords = np.empty((num_atoms, 3), dtype=np.int64)
+    atom = 0
+    run = 0
+    while atom < num_atoms:
+        this = [reader.bits(bits) for bits in bitsizes] if large else reader.ints(bitsize, sizes)
+        this = [value + low for value, low in zip(this, minint)]
+        previous = this
+        is_smaller = 0
+        if reader.bits(1):
+            run = reader.bits(5)
+            is_smaller = run % 3
+            run -= is_smaller
+            is_smaller -= 1
+        if run > 0:
+            for index in range(0, run, 3):
+                small = reader.ints(smallidx, sizesmall)
+                small = [value + prev - smallnum for value, prev in zip(small, previous)]
+                if index == 0:
+                    # The first two atoms of a run are swapped (better compression of water molecules)
+                    coords[atom] = small
+                    coords[atom + 1] = previous
+                    atom += 2
+                    previous = small
+                else:
+                    coords[atom] = small
+                    atom += 1
+                    previous = small
+        else:
+            coords[atom] = this
+            atom += 1
+        smallidx += is_smaller
+        if is_smaller < 0:
+            smallnum = smaller
+            smaller = XTC_MAGICINTS[smallidx - 1] // 2 if smallidx > XTC_FIRSTIDX else 0
+        elif is_smaller > 0:
+            smaller = smallnum
+            smallnum = XTC_MAGICINTS[smallidx] // 2
+        sizesmall = [XTC_MAGICINTS[smallidx]] * 3
+    return coords.astype(np.float32) / np.float32(precision)
+
+
+def _decode_xtc_fixed(buffer: bytes, num_atoms: int, sizes: list[int], bitsizes: Optional[list[int]], bitsize: int) -> Optional[np.ndarray]:
+    """Decodes at once the (n_atoms, 3) unsigned coordinates of a frame without runs of small differences, in which
+    every atom takes the same number of bits (ie: written by :class:`XtcWriter`). Returns None if the frame has runs."""
+    atom_bits = (sum(bitsizes) if bitsizes else bitsize) + 1
+    if len(buffer) != (num_atoms * atom_bits + 7) // 8:
+        return None
+    bits = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8))[:num_atoms * atom_bits].reshape(num_atoms, atom_bits)
+    if bits[:, -1].any():
+        return None
+    if bitsizes:
+        # Large coordinates: every one of them in its own number of bits (big-endian)
+        bounds = np.cumsum([0] + bitsizes)
+        return np.stack([bits[:, start:end].astype(np.int64) @ (1 << np.arange(end - start - 1, -1, -1, dtype=np.int64))
+                         for start, end in zip(bounds[:-1], bounds[1:])], axis=1)
+    # Little-endian bytes of the mixed-radix integer, the last one in the remaining bits
+    full_bytes, remainder = divmod(bitsize, 8)
+    le_bytes = [np.packbits(bits[:, 8 * index:8 * index + 8], axis=1)[:, 0] for index in range(full_bytes)]
+    if remainder:
+        le_bytes.append(bits[:, 8 * full_bytes:bitsize].astype(np.int64) @ (1 << np.arange(remainder - 1, -1, -1, dtype=np.int64)))
+    dtype = np.int64 if bitsize <= 63 else object
+    combined = sum(np.asarray(value).astype(dtype) << (8 * index) for index, value in enumerate(le_bytes))
+    # Operators instead of np.divmod, which does not support the object arrays of integers wider than 63 bits
+    combined, z = combined // sizes[2], combined % sizes[2]
+    x, y = combined // sizes[1], combined % sizes[1]
+    return np.stack([x, y, z], axis=1).astype(np.int64)
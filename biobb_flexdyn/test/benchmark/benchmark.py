@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Benchmark suite of the biobb_flexdyn blocks.
+
+Every block is launched in its own process on synthetic structures of increasing size, built by
+replicating the chain of ``test/data/flexdyn/structure.pdb``, and with an increasing number of
+generated structures. The wall time, the CPU time of the block process and its children, the peak
+RSS and the bytes written to the outputs are recorded in a JSON file, together with the scaling
+exponents of the wall time and the import time of the block modules, and can be compared against a
+stored baseline::
+
+    python benchmark.py --stand-ins --output results.json --baseline baseline.json
+
+With ``--stand-ins`` the Concoord, iMODS and NOLB binaries are replaced by the deterministic
+executables of the ``stand_ins`` folder, which mimic their command line options and output files,
+so that the Python side of the blocks (staging, copying and merging) can be measured anywhere.
+The exit code is 1 if any block failed or regressed with respect to the baseline, or if the import
+of a block module exceeds the startup budget.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+STAND_INS_DIR = BENCHMARK_DIR.joinpath('stand_ins')
+STRUCTURE_PATH = BENCHMARK_DIR.parent.joinpath('data', 'flexdyn', 'structure.pdb')
+# Concoord parameter files copied by concoord_dist and concoord_disco from CONCOORDLIB
+CONCOORD_LIB_FILES = ['HBONDS.DAT', 'BONDS.DAT', 'BONDS.DAT.noeh'] + [f'{prefix}_{vdw}.DAT' for prefix in ('ATOMS', 'MARGINS')
+                                                                      for vdw in ('oplsua', 'oplsaa', 'repel', 'yamber2', 'li', 'oplsx')]
+# Resource usage metrics compared against the baseline and their absolute noise floor
+METRICS = {'wall_time': 0.05, 'cpu_time': 0.05, 'peak_rss_kb': 10240, 'bytes_written': 0}
+
+# Blocks in execution order: inputs of the later blocks are outputs of the earlier ones with the same structure.
+# Blocks without num_structs run once per structure size.
+BLOCKS = {
+    'concoord_dist': {'num_structs': None,
+                      'paths': {'input_structure_path': 'structure.pdb', 'output_pdb_path': 'dist.pdb',
+                                'output_gro_path': 'dist.gro', 'output_dat_path': 'dist.dat'},
+                      'properties': {}},
+    'concoord_disco': {'num_structs': 'num_structs',
+                       'paths': {'input_pdb_path': 'dist.pdb', 'input_dat_path': 'dist.dat', 'output_traj_path': 'disco_trj.pdb',
+                                 'output_rmsd_path': 'disco_rmsd.dat', 'output_bfactor_path': 'disco_bfactor.pdb'},
+                       'properties': {'vdw': 4}},
+    'imod_imode': {'num_structs': None,
+                   'paths': {'input_pdb_path': 'structure.pdb', 'output_dat_path': 'imod_evecs.dat'},
+                   'properties': {'cg': 2}},
+    'imod_imc': {'num_structs': 'num_structs',
+                 'paths': {'input_pdb_path': 'structure.pdb', 'input_dat_path': 'imod_evecs.dat', 'output_traj_path': 'imod_imc.pdb'},
+                 'properties': {'num_modes': 10, 'amplitude': 6.0}},
+    'imod_imove': {'num_structs': 'num_frames',
+                   'paths': {'input_pdb_path': 'structure.pdb', 'input_dat_path': 'imod_evecs.dat', 'output_pdb_path': 'imod_imove.pdb'},
+                   'properties': {'pc': 1}},
+    'nolb_nma': {'num_structs': 'num_structs',
+                 'paths': {'input_pdb_path': 'structure.pdb', 'output_pdb_path': 'nolb.pdb'},
+                 'properties': {}},
+    'prody_anm': {'num_structs': 'num_structs',
+                  'paths': {'input_pdb_path': 'structure.pdb', 'output_pdb_path': 'prody.pdb'},
+                  'properties': {'rmsd': 1.0}},
+}
+
+# Block modules whose import time is measured, on top of biobb_common, as the best of STARTUP_RUNS fresh interpreters
+STARTUP_MODULES = ['concoord_dist', 'concoord_disco', 'concoord_violations', 'concoord_prune', 'nolb_nma',
+                   'imod_imode', 'imod_imove', 'imod_imc', 'imod_pipeline', 'prody_anm', 'batch']
+STARTUP_RUNS = 3
+# Noise floor (s) of the import time compared against the baseline
+STARTUP_FLOOR = 0.05
+STARTUP_SCRIPT = ("import sys, time\n"
+                  "import biobb_common.generic.biobb_object, biobb_common.tools.file_utils\n"
+                  "start = time.perf_counter()\n"
+                  "__import__('biobb_flexdyn.flexdyn.' + sys.argv[1])\n"
+                  "print(time.perf_counter() - start)\n")
+
+# Launch the block function and exit with its return code
+RUNNER = ("import json, sys, importlib\n"
+          "module = importlib.import_module('biobb_flexdyn.flexdyn.' + sys.argv[1])\n"
+          "sys.exit(getattr(module, sys.argv[1])(properties=json.loads(sys.argv[3]), **json.loads(sys.argv[2])) or 0)\n")
+
+
+def replicate_chains(pdb_path: Path, copies: int, output_path: Path, offset: float = 80.0) -> int:
+    """Write to **output_path** the atoms of **pdb_path** replicated in **copies** chains (A, B, ...),
+    every copy translated **offset** Angstroms along x from the previous one. Return the number of atoms."""
+    with open(pdb_path) as pdb_file:
+        atom_lines = [line.rstrip('\n').ljust(80)[:80] for line in pdb_file if line.startswith('ATOM')]
+    coords = np.array([[float(line[30:38]), float(line[38:46]), float(line[46:54])] for line in atom_lines])
+    serial = 0
+    with open(output_path, 'w') as output_file:
+        output_file.write(f'REMARK    {copies} copies of {pdb_path.name}\n')
+        for copy in range(copies):
+            chain = string.ascii_uppercase[copy % len(string.ascii_uppercase)]
+            for line, xyz in zip(atom_lines, (coords + [offset * copy, 0.0, 0.0]).tolist()):
+                serial += 1
+                output_file.write('ATOM  %5d%s%s%s%8.3f%8.3f%8.3f%s\n' % (serial % 100000, line[11:21], chain, line[22:30], *xyz, line[54:]))
+            output_file.write('TER\n')
+        output_file.write('END\n')
+    return serial
+
+
+def run_case(block: str, work_dir: Path, paths: dict, properties: dict, env: dict) -> dict:
+    """Launch the **block** in a new process in **work_dir** and return its resource usage."""
+    out_log = open(work_dir.joinpath(f'{block}.log'), 'w')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', RUNNER, block, json.dumps(paths), json.dumps(properties)],
+                               cwd=work_dir, env=env, stdout=out_log, stderr=subprocess.STDOUT)
+    # The usage of the terminated children of the block process (the binaries) is added to its own
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    out_log.close()
+    return {'return_code': process.returncode,
+            'wall_time': round(wall_time, 4),
+            'cpu_time': round(usage.ru_utime + usage.ru_stime, 4),
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            'peak_rss_kb': usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss,
+            'bytes_written': sum(Path(path).stat().st_size for key, path in paths.items()
+                                 if key.startswith('output') and Path(path).exists())}
+
+
+def run_benchmark(blocks: list[str], copies_list: list[int], num_structs_list: list[int], work_dir: Path, env: dict) -> list[dict]:
+    """Run every block of **blocks** for every structure size and number of structures, and return the results."""
+    results = []
+    for copies in copies_list:
+        size_dir = work_dir.joinpath(f'copies_{copies}')
+        size_dir.mkdir(parents=True, exist_ok=True)
+        num_atoms = replicate_chains(STRUCTURE_PATH, copies, size_dir.joinpath('structure.pdb'))
+        for block in blocks:
+            spec = BLOCKS[block]
+            for num_structs in (num_structs_list if spec['num_structs'] else [None]):
+                case_dir = size_dir if num_structs is None else size_dir.joinpath(f'{block}_{num_structs}')
+                case_dir.mkdir(exist_ok=True)
+                # Inputs from the structure folder, outputs to the case folder
+                paths = {key: str(size_dir.joinpath(name) if key.startswith('input') else case_dir.joinpath(name))
+                         for key, name in spec['paths'].items()}
+                properties = {**spec['properties'], 'sandbox_path': str(case_dir)}
+                if num_structs is not None:
+                    properties[spec['num_structs']] = num_structs
+                result = {'block': block, 'copies': copies, 'atoms': num_atoms, 'num_structs': num_structs,
+                          **run_case(block, case_dir, paths, properties, env)}
+                print('{block:16} copies {copies:3} atoms {atoms:7} num_structs {num_structs!s:>6}: '
+                      '{wall_time:9.3f} s wall {cpu_time:9.3f} s CPU {peak_rss_kb:9d} kB RSS {bytes_written:11d} B written '
+                      '(exit code {return_code})'.format(**result), flush=True)
+                results.append(result)
+    return results
+
+
+def measure_startup(modules: list[str], env: dict) -> dict[str, float]:
+    """Return the import time (s) of every block module of **modules**, the best of STARTUP_RUNS fresh interpreters."""
+    startup = {}
+    for module in modules:
+        import_times = [float(subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, module], env=env, capture_output=True,
+                                             text=True, check=True).stdout) for _ in range(STARTUP_RUNS)]
+        startup[module] = round(min(import_times), 4)
+        print(f"{module:19} import: {startup[module]:9.3f} s", flush=True)
+    return startup
+
+
+def scaling(results: list[dict]) -> dict:
+    """Return the log-log slope of the wall time of every block with respect to the number of atoms
+    (with the largest number of structures) and to the number of structures (with the smallest structure)."""
+    exponents: dict[str, dict] = {}
+    for block in dict.fromkeys(result['block'] for result in results):
+        block_results = [result for result in results if result['block'] == block and not result['return_code']]
+        if not block_results:
+            continue
+        exponents[block] = {}
+        max_structs = max(result['num_structs'] or 0 for result in block_results)
+        min_atoms = min(result['atoms'] for result in block_results)
+        for key, variable, selection in (('atoms_exponent', 'atoms', [result for result in block_results if (result['num_structs'] or 0) == max_structs]),
+                                         ('num_structs_exponent', 'num_structs', [result for result in block_results if result['atoms'] == min_atoms])):
+            points = [(result[variable], result['wall_time']) for result in selection if result[variable] and result['wall_time'] > 0]
+            if len({x for x, _ in points}) > 1:
+                exponents[block][key] = round(float(np.polyfit(np.log([x for x, _ in points]), np.log([y for _, y in points]), 1)[0]), 3)
+    return exponents
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """Return the regressions of the **results** with respect to the results of the **baseline**: the metrics
+    greater than the baseline ones by more than the **tolerance** fraction and the metric noise floor."""
+    baseline_results = {(result['block'], result['copies'], result['num_structs']): result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        base = baseline_results.get((result['block'], result['copies'], result['num_structs']))
+        if not base:
+            continue
+        for metric, floor in METRICS.items():
+            if metric in base and result[metric] > base[metric] * (1 + tolerance) and result[metric] - base[metric] > floor:
+                regressions.append(f"{result['block']} copies {result['copies']} num_structs {result['num_structs']}: "
+                                   f"{metric} {base[metric]} --> {result[metric]} ({result[metric] / base[metric] if base[metric] else float('inf'):.2f}x)")
+    return regressions
+
+
+def compare_startup(startup: dict[str, float], baseline: dict, tolerance: float) -> list[str]:
+    """Return the regressions of the import times of the **startup** results with respect to those of the **baseline**."""
+    regressions = []
+    for module, import_time in startup.items():
+        base = baseline.get('startup', {}).get(module)
+        if base is not None and import_time > base * (1 + tolerance) and import_time - base > STARTUP_FLOOR:
+            regressions.append(f"{module} import_time {base} --> {import_time} ({import_time / base if base else float('inf'):.2f}x)")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark suite of the biobb_flexdyn blocks.")
+    parser.add_argument('--blocks', nargs='+', choices=list(BLOCKS), default=list(BLOCKS), help="Blocks to be benchmarked (default: all).")
+    parser.add_argument('--copies', nargs='+', type=int, default=[1, 2, 4], help="Number of copies of the structure chain of the synthetic structures.")
+    parser.add_argument('--num-structs', nargs='+', type=int, default=[10, 100], help="Number of structures (frames for imod_imove) generated.")
+    parser.add_argument('--stand-ins', action='store_true', help="Use the stand-in executables instead of the Concoord, iMODS and NOLB binaries.")
+    parser.add_argument('--output', default='benchmark_results.json', help="Output JSON file with the results.")
+    parser.add_argument('--baseline', help="JSON file with the baseline results to compare against.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Fraction over the baseline considered a regression.")
+    parser.add_argument('--work-dir', help="Working directory (default: a temporary directory, removed at the end).")
+    parser.add_argument('--startup-budget', type=float, default=0.5, help="Seconds allowed to import a block module on top of biobb_common.")
+    args = parser.parse_args(argv)
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix='biobb_flexdyn_benchmark_')).resolve()
+    env = os.environ.copy()
+    if args.stand_ins:
+        env['PATH'] = os.pathsep.join([str(STAND_INS_DIR), env.get('PATH', '')])
+        concoord_lib = work_dir.joinpath('concoord_lib')
+        concoord_lib.mkdir(parents=True, exist_ok=True)
+        for lib_file in CONCOORD_LIB_FILES:
+            concoord_lib.joinpath(lib_file).touch()
+        env['CONCOORDLIB'] = str(concoord_lib)
+
+    try:
+        startup = measure_startup(STARTUP_MODULES, env)
+        results = run_benchmark(args.blocks, args.copies, args.num_structs, work_dir, env)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'platform': {'python': platform.python_version(), 'system': platform.system(), 'machine': platform.machine(),
+                           'processor': platform.processor(), 'cpu_count': os.cpu_count()},
+              'stand_ins': args.stand_ins,
+              'startup': startup,
+              'results': results,
+              'scaling': scaling(results)}
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=4)
+    print(f"Results written to {args.output}")
+
+    failed = [result for result in results if result['return_code']]
+    for result in failed:
+        print(f"FAILED: {result['block']} copies {result['copies']} num_structs {result['num_structs']} (exit code {result['return_code']})")
+    slow = [module for module, import_time in startup.items() if import_time > args.startup_budget]
+    for module in slow:
+        print(f"SLOW STARTUP: {module} imported in {startup[module]:.3f} s (budget {args.startup_budget} s)")
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('stand_ins') != args.stand_ins:
+            print("WARNING: baseline and results obtained with different executables (stand-ins vs binaries)")
+        regressions = compare(results, baseline, args.tolerance) + compare_startup(startup, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if not regressions:
+            print(f"No regressions with respect to {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if failed or slow or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Helpers shared by the stand-in executables of the benchmark suite.
+
+The stand-ins mimic the command line options and the output files of the Concoord, iMODS and NOLB
+binaries, generating deterministic (seeded) structures instead of sampling them, so that the
+Python side of the blocks (staging, copying, merging and parsing) can be measured anywhere.
+"""
+import sys
+import numpy as np
+
+
+def parse_options(args: list[str], flags: tuple[str, ...] = ()) -> tuple[list[str], dict[str, str]]:
+    """Split **args** in positional arguments and ``-option value`` pairs, **flags** being options without value."""
+    positional: list[str] = []
+    options: dict[str, str] = {}
+    index = 0
+    while index < len(args):
+        if args[index].startswith('-') and len(args[index]) > 1 and not _is_number(args[index]):
+            if args[index] in flags or index + 1 == len(args):
+                options[args[index]] = ''
+                index += 1
+            else:
+                options[args[index]] = args[index + 1]
+                index += 2
+        else:
+            positional.append(args[index])
+            index += 1
+    return positional, options
+
+
+def _is_number(text: str) -> bool:
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def read_atoms(pdb_path: str) -> tuple[list[str], np.ndarray]:
+    """Return the ATOM and HETATM records of the first model of **pdb_path** and their (n_atoms, 3) coordinates."""
+    lines = []
+    with open(pdb_path) as pdb_file:
+        for line in pdb_file:
+            if line.startswith(('ATOM', 'HETATM')):
+                lines.append(line.rstrip('\n').ljust(80)[:80] + '\n')
+            elif line.startswith('ENDMDL'):
+                break
+    if not lines:
+        sys.exit(f"{pdb_path}: no atoms found")
+    return lines, np.array([[float(line[30:38]), float(line[38:46]), float(line[46:54])] for line in lines])
+
+
+def write_model(output_file, lines: list[str], coords: np.ndarray, model: int) -> None:
+    """Write the **lines** with the **coords** as the **model** of a multi-model PDB file."""
+    output_file.write('MODEL %8d\n' % model)
+    output_file.write(''.join(line[:30] + '%8.3f%8.3f%8.3f' % tuple(xyz) + line[54:] for line, xyz in zip(lines, coords.tolist())))
+    output_file.write('TER\nENDMDL\n')
+
+
+def modes(coords: np.ndarray, num_modes: int, seed: int) -> np.ndarray:
+    """Return **num_modes** smooth, normalized (n_atoms, 3) displacement fields of the **coords**."""
+    rng = np.random.default_rng(seed)
+    centered = (coords - coords.mean(0)) / max(float(np.abs(coords - coords.mean(0)).max()), 1.0)
+    fields = np.empty((num_modes,) + coords.shape)
+    for mode in range(num_modes):
+        rotation = np.linalg.qr(rng.normal(size=(3, 3)))[0]
+        fields[mode] = np.sin((mode + 1) * centered @ rotation)
+        fields[mode] /= np.linalg.norm(fields[mode])
+    return fields
@@ -0,0 +1,41 @@
+# type: ignore
+import glob
+import os
+from pathlib import Path
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn import batch
+from biobb_flexdyn.flexdyn.batch import run_batch
+
+
+def _crash_job(*args):
+    # A worker process killed while running its job (ie: by the OOM killer)
+    os._exit(1)
+
+
+class TestBatch():
+    def setup_class(self):
+        fx.test_setup(self, 'batch')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+
+    def test_batch(self):
+        report = run_batch('prody_anm', [self.paths['input_pdb_pattern']], {'output_pdb_path': 'batch_{stem}_anm.pdb'},
+                           self.properties, num_workers=2, report_path=self.paths['report_path'])
+        input_paths = sorted(glob.glob(self.paths['input_pdb_pattern']))
+        assert report['num_jobs'] == len(input_paths) and report['num_failed'] == 0
+        assert fx.not_empty(self.paths['report_path'])
+        for job, input_path in zip(report['jobs'], input_paths):
+            assert job['input'] == input_path and job['return_code'] == 0
+            assert fx.not_empty(f'batch_{Path(input_path).stem}_anm.pdb')
+            assert job['out_log']
+
+    def test_batch_crash(self, monkeypatch):
+        monkeypatch.setattr(batch, '_run_job', _crash_job)
+        report = run_batch('prody_anm', [self.paths['input_pdb_pattern']], {'output_pdb_path': 'batch_{stem}_anm.pdb'},
+                           self.properties, num_workers=2, report_path=self.paths['report_path'])
+        input_paths = sorted(glob.glob(self.paths['input_pdb_pattern']))
+        assert report['num_jobs'] == report['num_failed'] == len(input_paths)
+        assert fx.not_empty(self.paths['report_path'])
+        for job, input_path in zip(report['jobs'], input_paths):
+            assert job['input'] == input_path and job['return_code'] == 1 and job['error'].startswith('BrokenProcessPool')
@@ -1,4 +1,5 @@
 # type: ignore
+from pathlib import Path
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexdyn.flexdyn.concoord_disco import concoord_disco
 
@@ -19,3 +20,51 @@ class TestConcoordDisco():
         # assert fx.equal(self.paths['output_traj_path'], self.paths['ref_output_traj_path'])
         # assert fx.equal(self.paths['output_rmsd_path'], self.paths['ref_output_rmsd_path']) # Frames swap??
         # assert fx.equal(self.paths['output_bfactor_path'], self.paths['ref_output_bfactor_path'])
+
+    def test_concoord_disco_stream(self):
+        frames = []
+        concoord_disco(properties=self.properties, **self.paths,
+                       frame_callback=frames.append, stop_condition=lambda frame: frame.index >= 5)
+        assert [frame.index for frame in frames] == [1, 2, 3, 4, 5]
+        with open(self.paths['output_traj_path']) as traj_file:
+            assert sum(line.startswith('MODEL') for line in traj_file) == 5
+        with open(self.paths['output_rmsd_path']) as rmsd_file:
+            assert len(rmsd_file.readlines()) == 5
+        assert fx.not_empty(self.paths['output_bfactor_path'])
+
+
+class TestConcoordDiscoWorkers():
+    def setup_class(self):
+        fx.test_setup(self, 'concoord_disco_workers')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+
+    def test_concoord_disco_workers(self):
+        concoord_disco(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_traj_path'])
+        assert fx.not_empty(self.paths['output_rmsd_path'])
+        assert fx.not_empty(self.paths['output_bfactor_path'])
+        with open(self.paths['output_traj_path']) as traj_file:
+            assert sum(line.startswith('MODEL') for line in traj_file) == self.properties['num_structs']
+        with open(self.paths['output_rmsd_path']) as rmsd_file:
+            assert [int(line.split()[0]) for line in rmsd_file] == list(range(1, self.properties['num_structs'] + 1))
+
+
+class TestConcoordDiscoChunks():
+    def setup_class(self):
+        fx.test_setup(self, 'concoord_disco_chunks')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+
+    def test_concoord_disco_chunks(self):
+        concoord_disco(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_traj_path'])
+        assert fx.not_empty(self.paths['output_bfactor_path'])
+        with open(self.paths['output_traj_path']) as traj_file:
+            assert sum(line.startswith('MODEL') for line in traj_file) == self.properties['num_structs']
+        with open(self.paths['output_rmsd_path']) as rmsd_file:
+            assert [int(line.split()[0]) for line in rmsd_file] == list(range(1, self.properties['num_structs'] + 1))
+        # The checkpoint is removed once the run is complete
+        assert not list(Path.cwd().glob('disco_checkpoint_*'))
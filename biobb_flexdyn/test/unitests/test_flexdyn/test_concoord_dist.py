@@ -1,4 +1,6 @@
 # type: ignore
+import json
+from pathlib import Path
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexdyn.flexdyn.concoord_dist import concoord_dist
 
@@ -19,3 +21,15 @@ class TestConcoordDist():
         assert fx.equal(self.paths['output_pdb_path'], self.paths['ref_output_pdb_path'])
         # assert fx.equal(self.paths['output_gro_path'], self.paths['ref_output_gro_path'])
         # assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path']) # Header changing with every execution
+
+    def test_concoord_dist_cache(self):
+        properties = {**self.properties, 'cache_path': 'dist_cache'}
+        concoord_dist(properties=properties, **self.paths)
+        output_dat = Path(self.paths['output_dat_path']).read_text()
+        for output_path in ('output_pdb_path', 'output_gro_path', 'output_dat_path'):
+            Path(self.paths[output_path]).unlink()
+        concoord_dist(properties=properties, **self.paths)
+        assert fx.equal(self.paths['output_pdb_path'], self.paths['ref_output_pdb_path'])
+        assert Path(self.paths['output_dat_path']).read_text() == output_dat
+        with open(Path('dist_cache').joinpath('stats.json')) as stats_file:
+            assert json.load(stats_file) == {'hits': 1, 'misses': 1}
@@ -0,0 +1,33 @@
+# type: ignore
+import json
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.concoord_prune import cap_pairs_per_atom, concoord_prune
+
+
+class TestConcoordPrune():
+    def setup_class(self):
+        fx.test_setup(self, 'concoord_prune')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_concoord_prune(self):
+        concoord_prune(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.not_empty(self.paths['output_report_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+        with open(self.paths['output_report_path']) as report_file:
+            report = json.load(report_file)
+        assert report['constraints_before'] == 25223
+        assert report['constraints_after'] < report['constraints_before']
+
+    def test_cap_pairs_per_atom(self):
+        rng = np.random.default_rng(1)
+        atoms_i, atoms_j = rng.integers(1, 40, 2000), rng.integers(40, 80, 2000)
+        distances = rng.uniform(3, 10, 2000)
+        keep = cap_pairs_per_atom(atoms_i, atoms_j, distances, 5)
+        assert np.bincount(np.concatenate((atoms_i[keep], atoms_j[keep]))).max() <= 5
+        # The shortest pair of all is the shortest one of both of its atoms
+        assert keep[np.argmin(distances)]
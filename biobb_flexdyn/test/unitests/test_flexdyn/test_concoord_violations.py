@@ -0,0 +1,31 @@
+# type: ignore
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn import concoord_violations as violations_module
+from biobb_flexdyn.flexdyn.concoord_violations import concoord_violations
+
+
+class TestConcoordViolations():
+    def setup_class(self):
+        fx.test_setup(self, 'concoord_violations')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_concoord_violations(self):
+        concoord_violations(properties=self.properties, **self.paths)
+        self.check_outputs()
+
+    def test_concoord_violations_pair_tiles(self, monkeypatch):
+        # About 1000 of the 25223 constraints scored at a time
+        monkeypatch.setattr(violations_module, 'TILE_ELEMENTS', self.properties['chunk_size'] * 1000)
+        concoord_violations(properties=self.properties, **self.paths)
+        self.check_outputs()
+
+    def check_outputs(self):
+        for output in ('output_frames_path', 'output_pairs_path', 'output_atoms_path'):
+            assert fx.not_empty(self.paths[output])
+            output_values = np.loadtxt(self.paths[output], delimiter=',', skiprows=1)
+            ref_values = np.loadtxt(self.paths['ref_' + output], delimiter=',', skiprows=1)
+            assert np.allclose(output_values, ref_values, atol=1e-4)
@@ -0,0 +1,30 @@
+# type: ignore
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.dist_dat import DistDat
+
+
+class TestDistDat():
+    def setup_class(self):
+        fx.test_setup(self, 'dist_dat')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_dist_dat(self):
+        dist_dat = DistDat.read(self.paths['input_dat_path'])
+        assert len(dist_dat.sections['1-2 restricted pairs']) == 724
+        assert dist_dat.sections['1-3 restricted pairs'][0].tolist() == (3, 1, 2.478, 2.398, 2.558, 2, 110.1103, 3.0)
+        dist_dat.write(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['input_dat_path'])
+
+    def test_dist_dat_sidecar(self):
+        dist_dat = DistDat.read(self.paths['input_dat_path'])
+        dist_dat.save(self.paths['output_npz_path'])
+        loaded = DistDat.load(self.paths['output_npz_path'])
+        assert isinstance(loaded.sections['other restrictions'], np.memmap)
+        assert loaded.header == dist_dat.header
+        assert np.array_equal(loaded.pairs(), dist_dat.pairs())
+        loaded.write(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['input_dat_path'])
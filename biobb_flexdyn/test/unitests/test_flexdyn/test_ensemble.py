@@ -0,0 +1,58 @@
+# type: ignore
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.common import iter_pdb_coords
+from biobb_flexdyn.flexdyn.ensemble import Ensemble, read_pdb_topology
+from biobb_flexdyn.flexdyn.prody_anm import ProdyANM
+
+
+class TestEnsemble():
+    def setup_class(self):
+        fx.test_setup(self, 'ensemble')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_ensemble(self):
+        ensemble = Ensemble.read(self.paths['input_pdb_path'])
+        assert len(ensemble) == 20 and ensemble.num_atoms == 716
+        assert ensemble.coords.dtype == np.float32 and ensemble.coords.flags['C_CONTIGUOUS']
+        assert list(ensemble.topology['name'][:3]) == ['N', 'CA', 'C'] and ensemble.topology['resname'][0] == 'LEU'
+        assert np.allclose(ensemble[3], list(iter_pdb_coords(self.paths['input_pdb_path']))[3], atol=1e-3)
+        frames = ensemble[5:10]
+        assert len(frames) == 5 and frames.topology is ensemble.topology
+        assert np.shares_memory(frames.coords, ensemble.coords)
+        assert ensemble.select(ensemble.topology['name'] == 'CA').coords.shape == (20, 85, 3)
+
+    def test_ensemble_gro(self):
+        ensemble = Ensemble.read(self.paths['input_gro_path'])
+        assert len(ensemble) == 1 and ensemble.num_atoms == 775
+        assert ensemble.topology['resname'][-1] == 'HOH'
+
+    def test_ensemble_large_serials(self):
+        # Serials beyond 99999 in hybrid-36, in hexadecimal (ProDy) and overflowed, and a hybrid-36 residue number
+        with open(self.paths['input_pdb_path']) as pdb_file:
+            atom = next(line for line in pdb_file if line.startswith('ATOM'))
+        fields = [('99999', '   1'), ('A0000', '   1'), ('186a1', 'A000'), ('*****', '****')]
+        with open('large_serials.pdb', 'w') as pdb_file:
+            pdb_file.writelines(atom[:6] + serial + atom[11:22] + resnum + atom[26:] for serial, resnum in fields)
+        topology = read_pdb_topology('large_serials.pdb')
+        assert list(topology['serial']) == [99999, 100000, 100001, 4]
+        assert list(topology['resnum']) == [1, 1, 10000, 10000]
+
+    def test_ensemble_memmap(self):
+        ensemble = Ensemble.read(self.paths['input_pdb_path'], mmap_path=self.paths['output_npy_path'], chunk_size=6)
+        assert isinstance(ensemble.coords, np.memmap)
+        assert np.array_equal(ensemble.coords, Ensemble.read(self.paths['input_pdb_path']).coords)
+        ensemble.save(self.paths['output_npz_path'])
+        loaded = Ensemble.load(self.paths['output_npz_path'])
+        assert isinstance(loaded.coords, np.memmap)
+        assert np.array_equal(loaded.coords, ensemble.coords) and np.array_equal(loaded.topology, ensemble.topology)
+
+    def test_ensemble_from_block(self):
+        block = ProdyANM(input_pdb_path=self.paths['input_structure_path'], output_pdb_path=self.paths['output_pdb_path'],
+                         properties=self.properties)
+        assert block.launch() == 0
+        ensemble = Ensemble.from_block(block)
+        assert len(ensemble) == 6 and ensemble.num_atoms == 85
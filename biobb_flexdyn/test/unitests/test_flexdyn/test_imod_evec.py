@@ -0,0 +1,32 @@
+# type: ignore
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.imod_evec import ImodEvec
+
+
+class TestImodEvec():
+    def setup_class(self):
+        fx.test_setup(self, 'imod_evec')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_imod_evec(self):
+        evec = ImodEvec.read(self.paths['input_dat_path'])
+        assert evec.eigenvectors.shape == (20, 168)
+        assert evec.eigenvalues[0] == 2.0544755964e-05
+        evec.write(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['input_dat_path'])
+        selected = evec.select(range(5))
+        selected.write(self.paths['output_dat_path'])
+        assert np.array_equal(ImodEvec.read(self.paths['output_dat_path']).eigenvectors, evec.eigenvectors[:5])
+
+    def test_imod_evec_sidecar(self):
+        evec = ImodEvec.read(self.paths['input_dat_path'])
+        evec.save(self.paths['output_npz_path'])
+        loaded = ImodEvec.load(self.paths['output_npz_path'])
+        assert isinstance(loaded.eigenvectors, np.memmap)
+        assert np.array_equal(loaded.eigenvalues, evec.eigenvalues)
+        loaded.write(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['input_dat_path'])
@@ -1,5 +1,9 @@
 # type: ignore
+import json
+from pathlib import Path
+import pytest
 from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.ensemble import Ensemble
 from biobb_flexdyn.flexdyn.imod_imc import imod_imc
 
 
@@ -15,3 +19,47 @@ class TestImodImc():
         imod_imc(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_traj_path'])
         # assert fx.equal(self.paths['output_traj_path'], self.paths['ref_output_traj_path'])  # Header changing with every execution
+
+    def test_imod_imc_stream(self):
+        frames = []
+        imod_imc(properties=self.properties, **self.paths,
+                 frame_callback=frames.append, stop_condition=lambda frame: frame.index >= 5)
+        assert [frame.index for frame in frames] == [1, 2, 3, 4, 5]
+        assert all(frame.coords.shape == frames[0].coords.shape for frame in frames)
+        with open(self.paths['output_traj_path']) as traj_file:
+            assert sum(line.startswith('MODEL') for line in traj_file) == 5
+
+
+class TestImodImcWorkers():
+    def setup_class(self):
+        fx.test_setup(self, 'imod_imc_workers')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+
+    def test_imod_imc_workers(self):
+        # Without seed_flag, a single imc process so that the workers do not repeat the same structures
+        instrumentation_path = str(Path(self.paths['output_traj_path']).with_name('imc_instrumentation.json'))
+        imod_imc(properties={**self.properties, 'instrumentation_path': instrumentation_path}, **self.paths)
+        with open(self.paths['output_traj_path']) as traj_file:
+            models = [int(line.split()[1]) for line in traj_file if line.startswith('MODEL')]
+        assert models == list(range(1, self.properties['num_structs'] + 1))
+        with open(instrumentation_path) as instrumentation_file:
+            assert json.load(instrumentation_file)['num_children'] == 1
+
+    def test_imod_imc_workers_seeded(self):
+        instrumentation_path = str(Path(self.paths['output_traj_path']).with_name('imc_instrumentation.json'))
+        imod_imc(properties={**self.properties, 'seed_flag': '--seed', 'instrumentation_path': instrumentation_path}, **self.paths)
+        with open(self.paths['output_traj_path']) as traj_file:
+            models = [int(line.split()[1]) for line in traj_file if line.startswith('MODEL')]
+        assert models == list(range(1, self.properties['num_structs'] + 1))
+        with open(instrumentation_path) as instrumentation_file:
+            assert json.load(instrumentation_file)['num_children'] == self.properties['num_workers']
+        # Every worker samples with its own seed
+        coords = Ensemble.read(self.paths['output_traj_path']).coords
+        assert len({coords[first].tobytes() for first in (0, 4, 7)}) == 3
+
+    def test_imod_imc_seed_flag(self):
+        # Only the known seed options are inserted in the command line
+        with pytest.raises(ValueError):
+            imod_imc(properties={**self.properties, 'seed_flag': '--seed 1; rm'}, **self.paths)
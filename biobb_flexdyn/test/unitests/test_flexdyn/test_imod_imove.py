@@ -1,4 +1,5 @@
 # type: ignore
+import zipfile
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexdyn.flexdyn.imod_imove import imod_imove
 
@@ -15,3 +16,17 @@ class TestImodImove():
         imod_imove(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_pdb_path'])
         assert fx.equal(self.paths['output_pdb_path'], self.paths['ref_output_pdb_path'])  # Header changing with every execution
+
+
+class TestImodImovePcs():
+    def setup_class(self):
+        fx.test_setup(self, 'imod_imove_pcs')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+
+    def test_imod_imove_pcs(self):
+        imod_imove(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pdb_path'])
+        with zipfile.ZipFile(self.paths['output_pdb_path']) as zip_file:
+            assert zip_file.namelist() == [f'imod_imove_output_pc{pc}.pdb' for pc in range(1, 5)]
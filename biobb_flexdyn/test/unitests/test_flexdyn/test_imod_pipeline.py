@@ -0,0 +1,42 @@
+# type: ignore
+import json
+import zipfile
+from pathlib import Path
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.ensemble import Ensemble
+from biobb_flexdyn.flexdyn.imod_pipeline import imod_pipeline
+
+
+class TestImodPipeline():
+    def setup_class(self):
+        fx.test_setup(self, 'imod_pipeline')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_imod_pipeline(self):
+        instrumentation_path = str(Path(self.paths['output_traj_path']).with_name('pipeline_instrumentation.json'))
+        imod_pipeline(properties={**self.properties, 'instrumentation_path': instrumentation_path}, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.not_empty(self.paths['output_traj_path'])
+        with open(self.paths['output_traj_path']) as traj_file:
+            models = [int(line.split()[1]) for line in traj_file if line.startswith('MODEL')]
+        assert models == list(range(1, self.properties['num_structs'] + 1))
+        with zipfile.ZipFile(self.paths['output_pdb_path']) as zip_file:
+            assert zip_file.namelist() == [f'imod_pipeline_anim_pc{pc}.pdb' for pc in (1, 2, 3)]
+        # imode, a single imc process without seed_flag, and an imove process per principal component
+        with open(instrumentation_path) as instrumentation_file:
+            assert json.load(instrumentation_file)['num_children'] == 1 + 1 + 3
+
+    def test_imod_pipeline_seeded(self):
+        instrumentation_path = str(Path(self.paths['output_traj_path']).with_name('pipeline_instrumentation.json'))
+        imod_pipeline(properties={**self.properties, 'seed': 3, 'seed_flag': '--seed', 'instrumentation_path': instrumentation_path}, **self.paths)
+        with open(self.paths['output_traj_path']) as traj_file:
+            models = [int(line.split()[1]) for line in traj_file if line.startswith('MODEL')]
+        assert models == list(range(1, self.properties['num_structs'] + 1))
+        with open(instrumentation_path) as instrumentation_file:
+            assert json.load(instrumentation_file)['num_children'] == 1 + self.properties['num_workers'] + 3
+        # Every imc shard samples with its own seed
+        coords = Ensemble.read(self.paths['output_traj_path']).coords
+        assert len({coords[first].tobytes() for first in (0, 4, 7)}) == 3
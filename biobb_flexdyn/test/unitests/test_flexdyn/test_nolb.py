@@ -1,6 +1,33 @@
 # type: ignore
+import asyncio
+import json
+import sys
+from pathlib import Path
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
-from biobb_flexdyn.flexdyn.nolb_nma import nolb_nma
+from biobb_flexdyn.flexdyn.nolb_nma import clash_scores, nolb_nma, nolb_nma_async
+from biobb_flexdyn.flexdyn.pdb_codec import read_pdb_coords
+
+# NOLB moving the atoms of the last residue of the first decoy onto its first atom when run with the fast
+# minimization preset (--nSteps 500), and keeping a copy of the decoys
+CLASHING_NOLB = """#!{python}
+import shutil, subprocess, sys
+args = sys.argv[1:]
+return_code = subprocess.call(['{binary_path}', *args])
+if not return_code and args[args.index('--nSteps') + 1] == '500':
+    decoys_path = args[args.index('-o') + 1] + '_nlb_decoys.pdb'
+    with open(decoys_path) as decoys_file:
+        lines = decoys_file.readlines()
+    first_model = lines[:next(index for index, line in enumerate(lines) if line.startswith('ENDMDL'))]
+    atoms = [index for index, line in enumerate(first_model) if line.startswith(('ATOM', 'HETATM'))]
+    for index in atoms:
+        if lines[index][21:26] == lines[atoms[-1]][21:26]:
+            lines[index] = lines[index][:30] + lines[atoms[0]][30:54] + lines[index][54:]
+    with open(decoys_path, 'w') as decoys_file:
+        decoys_file.writelines(lines)
+    shutil.copy(decoys_path, '{generated_path}')
+sys.exit(return_code)
+"""
 
 
 class TestNolb_nma():
@@ -15,3 +42,111 @@ class TestNolb_nma():
         nolb_nma(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_pdb_path'])
         # assert fx.equal(self.paths['output_pdb_path'], self.paths['ref_output_pdb_path']) # Header changing with every execution
+
+    def test_nolb_nma_stream(self):
+        frames = []
+        nolb_nma(properties=self.properties, **self.paths,
+                 frame_callback=frames.append, stop_condition=lambda frame: frame.index >= 5)
+        assert [frame.index for frame in frames] == [1, 2, 3, 4, 5]
+        assert all(frame.coords.shape == frames[0].coords.shape for frame in frames)
+        with open(self.paths['output_pdb_path']) as pdb_file:
+            assert sum(line.startswith('MODEL') for line in pdb_file) == 5
+
+
+class TestNolb_nmaWorkers():
+    def setup_class(self):
+        fx.test_setup(self, 'nolb_nma_workers')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+
+    def test_nolb_nma_workers_unseeded(self):
+        # Without seed_flag, a single NOLB process so that the workers do not repeat the same structures
+        instrumentation_path = str(Path(self.paths['output_pdb_path']).with_name('nolb_instrumentation.json'))
+        nolb_nma(properties={**self.properties, 'instrumentation_path': instrumentation_path}, **self.paths)
+        with open(self.paths['output_pdb_path']) as pdb_file:
+            assert sum(line.startswith('MODEL') for line in pdb_file) == self.properties['num_structs']
+        with open(instrumentation_path) as instrumentation_file:
+            assert json.load(instrumentation_file)['num_children'] == 1
+
+    def test_nolb_nma_workers(self):
+        instrumentation_path = str(Path(self.paths['output_pdb_path']).with_name('nolb_instrumentation.json'))
+        nolb_nma(properties={**self.properties, 'seed_flag': '--seed', 'instrumentation_path': instrumentation_path}, **self.paths)
+        assert fx.not_empty(self.paths['output_pdb_path'])
+        with open(self.paths['output_pdb_path']) as pdb_file:
+            models = [int(line.split()[1]) for line in pdb_file if line.startswith('MODEL')]
+        assert models == list(range(1, self.properties['num_structs'] + 1))
+        with open(instrumentation_path) as instrumentation_file:
+            instrumentation = json.load(instrumentation_file)
+        assert {'stage_files', 'run_commands', 'merge_outputs', 'copy_to_host'} <= set(instrumentation['phases'])
+        assert instrumentation['bytes_written'] == Path(self.paths['output_pdb_path']).stat().st_size
+        # Resources of the 3 NOLB processes only, bytes of the input structure copied to the sandbox
+        run_commands, stage_files = instrumentation['phases']['run_commands'], instrumentation['phases']['stage_files']
+        assert run_commands['num_children'] == instrumentation['num_children'] == 3 and run_commands['child_max_rss_kb'] > 0
+        assert stage_files['num_children'] == 0 and stage_files['child_max_rss_kb'] == 0
+        assert stage_files['bytes_copied'] == instrumentation['bytes_staged'] == Path(self.paths['input_pdb_path']).stat().st_size
+
+
+class TestNolb_nmaMinimization():
+    def setup_class(self):
+        fx.test_setup(self, 'nolb_nma_minimization')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+
+    def test_nolb_nma_minimization(self):
+        # NOLB wrapped so that the first decoy of the generation with the fast preset always clashes, the generated
+        # decoys being kept for the comparison
+        generated_path = Path(self.paths['output_pdb_path']).with_name('nolb_generated.pdb')
+        binary_path = Path(self.paths['output_pdb_path']).with_name('nolb_clashing')
+        binary_path.write_text(CLASHING_NOLB.format(python=sys.executable, binary_path=self.properties.get('binary_path', 'NOLB'),
+                                                    generated_path=generated_path))
+        binary_path.chmod(0o755)
+        nolb_nma(properties={**self.properties, 'seed_flag': '--seed', 'binary_path': str(binary_path)}, **self.paths)
+        assert fx.not_empty(self.paths['output_pdb_path'])
+        with open(self.paths['output_pdb_path']) as pdb_file:
+            models = [int(line.split()[1]) for line in pdb_file if line.startswith('MODEL')]
+        assert models == list(range(1, self.properties['num_structs'] + 1))
+        # The clashing structures are only replaced by structures with fewer clashes, as the one made clashing is,
+        # and the other ones are kept
+        generated_scores = clash_scores(generated_path, 2.0)
+        scores = clash_scores(Path(self.paths['output_pdb_path']), 2.0)
+        clashing = generated_scores > self.properties.get('max_clashes', 0)
+        assert (scores <= generated_scores).all() and scores[0] < generated_scores[0]
+        assert np.array_equal(read_pdb_coords(self.paths['output_pdb_path'])[~clashing], read_pdb_coords(generated_path)[~clashing])
+
+
+class TestNolb_nmaAsync():
+    def setup_class(self):
+        fx.test_setup(self, 'nolb_nma_async')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+
+    def test_nolb_nma_async(self):
+        output_paths = [str(Path(self.paths['output_pdb_path']).with_name(f'nolb_output_{index}.pdb')) for index in range(4)]
+
+        async def launch_all():
+            return await asyncio.gather(*(nolb_nma_async(input_pdb_path=self.paths['input_pdb_path'], output_pdb_path=output_path,
+                                                         properties={**self.properties, 'seed': index})
+                                          for index, output_path in enumerate(output_paths)))
+
+        assert asyncio.run(launch_all()) == [0] * len(output_paths)
+        for output_path in output_paths:
+            with open(output_path) as pdb_file:
+                assert sum(line.startswith('MODEL') for line in pdb_file) == self.properties['num_structs']
+
+    def test_nolb_nma_async_cancel(self):
+        sandbox_path = Path(self.properties.get('sandbox_path', '.'))
+        sandboxes = set(sandbox_path.glob('sandbox_*'))
+
+        async def launch_cancelled():
+            await asyncio.wait_for(nolb_nma_async(properties={**self.properties, 'num_structs': 100000}, **self.paths), 1)
+
+        try:
+            asyncio.run(launch_cancelled())
+            assert False, 'The launch was expected to be cancelled'
+        except asyncio.TimeoutError:
+            pass
+        assert not Path(self.paths['output_pdb_path']).exists()
+        assert set(sandbox_path.glob('sandbox_*')) == sandboxes
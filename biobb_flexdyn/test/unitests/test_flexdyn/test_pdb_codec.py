@@ -0,0 +1,76 @@
+# type: ignore
+import numpy as np
+import pytest
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.common import merge_pdb_models
+from biobb_flexdyn.flexdyn.ensemble import Ensemble
+from biobb_flexdyn.flexdyn.pdb_codec import PdbTemplate, PdbWriter, count_pdb_models, format_fields, format_serials, iter_pdb_chunks, parse_fields, parse_pdb_models, read_pdb_coords
+from biobb_flexdyn.flexdyn.pdb_codec import _models_end, _parse_pdb_lines, _parse_regular_models
+
+
+class TestPdbCodec():
+    def setup_class(self):
+        fx.test_setup(self, 'pdb_codec')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pdb_codec_fields(self):
+        values = np.array([0.0, -0.0, 1.5, -1.5, 0.0005, -0.0015, 12.345, -999.999, 9999.999, 123.4565])
+        chars = format_fields(values)
+        assert chars.tobytes() == ''.join('%8.3f' % value for value in values).encode()
+        parsed = parse_fields(chars)
+        assert np.array_equal(parsed, [float('%.3f' % value) for value in values]) and np.signbit(parsed[1])
+        # Any other decimal layout falls back to the float conversion
+        assert np.array_equal(parse_fields(np.frombuffer(b'   1.5e2 -12.3456', dtype=np.uint8)[1:].reshape(-1, 8)), [150.0, -12.3456])
+        # Serials above 99999 are hexadecimal, as written by ProDy
+        serials = np.array([1, 99999, 100000, 0xfffff])
+        assert format_serials(serials).tobytes() == b'    1' + b'99999' + b'%5x' % 100000 + b'fffff'
+        with pytest.raises(ValueError):
+            format_serials([0x100000])
+
+    def test_pdb_codec_read(self):
+        coords = read_pdb_coords(self.paths['input_pdb_path'])
+        assert coords.shape == (20, 716, 3) and count_pdb_models(self.paths['input_pdb_path']) == 20
+        with open(self.paths['input_pdb_path']) as pdb_file:
+            first = [[float(line[30 + 8 * axis:38 + 8 * axis]) for axis in range(3)] for line in pdb_file
+                     if line.startswith(('ATOM', 'HETATM'))][:716]
+        assert np.array_equal(coords[0], first)
+        assert np.array_equal(np.concatenate(list(iter_pdb_chunks(self.paths['input_pdb_path'], chunk_size=6))), coords)
+
+    def test_pdb_codec_write(self):
+        template = PdbTemplate.from_pdb(self.paths['input_pdb_path'])
+        coords = read_pdb_coords(self.paths['input_pdb_path'])
+        with PdbWriter(self.paths['output_pdb_path'], template) as writer:
+            for start in range(0, len(coords), 6):
+                writer.write(coords[start:start + 6])
+        assert writer.num_frames == 20
+        assert np.array_equal(read_pdb_coords(self.paths['output_pdb_path']), coords)
+        ensemble = Ensemble.read(self.paths['output_pdb_path'])
+        assert np.array_equal(ensemble.topology, Ensemble.read(self.paths['input_pdb_path']).topology)
+        ensemble.write(self.paths['output_prody_path'], chunk_size=7)
+        assert np.array_equal(Ensemble.read(self.paths['output_prody_path']).coords, ensemble.coords)
+
+    def test_pdb_codec_merge(self):
+        assert merge_pdb_models([self.paths['input_pdb_path']] * 2, self.paths['output_merged_path']) == 40
+        with open(self.paths['output_merged_path']) as pdb_file:
+            models = [int(line.split()[1]) for line in pdb_file if line.startswith('MODEL')]
+        assert models == list(range(1, 41))
+        coords = read_pdb_coords(self.paths['output_merged_path'])
+        assert np.array_equal(coords[20:], coords[:20])
+
+    def test_pdb_codec_layouts(self):
+        with open(self.paths['input_pdb_path'], 'rb') as pdb_file:
+            buffer = pdb_file.read()
+        buffer = buffer[:_models_end(buffer)]
+        coords = _parse_pdb_lines(buffer)
+        # Models of the same layout as the first one, their MODEL records widening from 'MODEL 9' to 'MODEL 10'
+        assert _parse_regular_models(buffer) is not None and np.array_equal(parse_pdb_models(buffer), coords)
+        # Any other layout is read line by line
+        irregular = buffer.replace(b'ENDMDL', b'REMARK extra record\nENDMDL', 1)
+        assert _parse_regular_models(irregular) is None and np.array_equal(parse_pdb_models(irregular), coords)
+        missing = buffer[:buffer.rfind(b'ATOM')] + buffer[buffer.rfind(b'\nENDMDL') + 1:]
+        assert _parse_regular_models(missing) is None
+        with pytest.raises(ValueError):
+            parse_pdb_models(missing)
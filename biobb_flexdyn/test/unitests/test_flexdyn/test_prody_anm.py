@@ -1,6 +1,14 @@
 # type: ignore
+import io
+import json
+import logging
+from pathlib import Path
+import numpy as np
+import prody
 from biobb_common.tools import test_fixtures as fx
-from biobb_flexdyn.flexdyn.prody_anm import prody_anm
+from biobb_flexdyn.flexdyn import prody_anm as prody_anm_module
+from biobb_flexdyn.flexdyn.pdb_codec import PdbTemplate
+from biobb_flexdyn.flexdyn.prody_anm import prody_anm, ProdyANM, _matches_prody_output, _sample_modes_chunks, _write_pdb_chunks
 
 
 class TestProdyANM():
@@ -15,3 +23,72 @@ class TestProdyANM():
         prody_anm(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_pdb_path'])
         assert fx.equal(self.paths['output_pdb_path'], self.paths['ref_output_pdb_path'])
+
+    def test_prody_anm_sparse_modes(self):
+        atoms = prody.parsePDB(self.paths['input_pdb_path']).select('calpha')
+        dense = ProdyANM(properties={**self.properties, 'hessian_mode': 'dense'}, **self.paths).calc_modes(atoms)
+        sparse = ProdyANM(properties={**self.properties, 'hessian_mode': 'sparse'}, **self.paths).calc_modes(atoms)
+        assert np.allclose(dense.getEigvals(), sparse.getEigvals())
+        # Eigenvectors are only defined up to their sign
+        overlaps = np.abs((dense.getArray() * sparse.getArray()).sum(0))
+        assert np.allclose(overlaps, 1.0, atol=1e-6)
+
+    def test_prody_anm_modes_cache(self):
+        properties = {**self.properties, 'modes_cache_path': 'modes_cache'}
+        for _ in range(2):
+            prody_anm(properties=properties, **self.paths)
+            assert fx.not_empty(self.paths['output_pdb_path'])
+        with open(Path('modes_cache').joinpath('stats.json')) as stats_file:
+            assert json.load(stats_file) == {'hits': 1, 'misses': 1}
+
+    def test_prody_anm_result_cache(self):
+        properties = {**self.properties, 'seed': 1, 'cache_path': 'anm_cache'}
+        prody_anm(properties=properties, **self.paths)
+        prody_anm(properties=properties, **{**self.paths, 'output_pdb_path': 'prody_output_cached.pdb'})
+        assert fx.compare_hash('prody_output_cached.pdb', self.paths['output_pdb_path'])
+        # Different properties, different outputs
+        prody_anm(properties={**properties, 'num_structs': 10}, **{**self.paths, 'output_pdb_path': 'prody_output_cached.pdb'})
+        assert not fx.compare_hash('prody_output_cached.pdb', self.paths['output_pdb_path'])
+        with open(Path('anm_cache').joinpath('stats.json')) as stats_file:
+            assert json.load(stats_file) == {'hits': 1, 'misses': 2}
+
+    def test_prody_anm_chunks(self):
+        chunked_pdb_path = 'prody_output_chunked.pdb'
+        prody_anm(properties={**self.properties, 'seed': 1}, **self.paths)
+        prody_anm(properties={**self.properties, 'seed': 1, 'chunk_size': 3}, **{**self.paths, 'output_pdb_path': chunked_pdb_path})
+        assert fx.not_empty(chunked_pdb_path)
+        assert fx.compare_hash(chunked_pdb_path, self.paths['output_pdb_path'])
+
+    def test_prody_anm_sampling(self):
+        atoms = prody.parsePDB(self.paths['input_pdb_path']).select('calpha')
+        anm = ProdyANM(properties=self.properties, **self.paths).calc_modes(atoms)
+        np.random.seed(1)
+        ensemble = prody.sampleModes(anm[:3], atoms, n_confs=7, rmsd=2.0)
+        chunks = list(_sample_modes_chunks(anm[:3], atoms, n_confs=7, rmsd=2.0, chunk_size=3, rng=np.random.RandomState(1)))
+        assert [len(chunk) for chunk in chunks] == [1, 3, 3, 1]
+        assert np.array_equal(chunks[0][0], atoms.getCoords())
+        assert np.allclose(np.concatenate(chunks[1:]), ensemble.getCoordsets())
+
+    def test_prody_anm_write_pdb(self, monkeypatch, caplog):
+        atoms = prody.parsePDB(self.paths['input_pdb_path']).select('not hydrogen').copy()
+        coordsets = atoms.getCoords() + np.random.default_rng(1).normal(size=(5, atoms.numAtoms(), 3))
+        ensemble = atoms.copy()
+        ensemble.setCoords(coordsets)
+        prody.writePDB('prody_expected.pdb', ensemble)
+        # The Prody layout the chunked writer relies on: every model shifts the atom serials by its TER records
+        buffer = io.StringIO()
+        prody.writePDBStream(buffer, atoms)
+        records = buffer.getvalue().encode().splitlines(keepends=True)
+        num_ter = sum(1 for line in records if line.startswith(b'TER'))
+        assert num_ter > 0
+        assert _matches_prody_output(PdbTemplate.from_records(records, serial_step=num_ter), atoms, True)
+        assert not _matches_prody_output(PdbTemplate.from_records(records), atoms, True)
+        for matches in (True, False):
+            if not matches:
+                # Any other layout is written by Prody at once, with a warning
+                monkeypatch.setattr(prody_anm_module, '_matches_prody_output', lambda *args: False)
+            caplog.clear()
+            with caplog.at_level(logging.INFO, logger='prody_chunked'):
+                _write_pdb_chunks('prody_chunked.pdb', atoms, iter([coordsets[:2], coordsets[2:]]), out_log=logging.getLogger('prody_chunked'))
+            assert fx.compare_hash('prody_chunked.pdb', 'prody_expected.pdb')
+            assert any(message.startswith('WARNING') for message in caplog.messages) != matches
@@ -0,0 +1,51 @@
+# type: ignore
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.ensemble import Ensemble, write_trajectory
+from biobb_flexdyn.flexdyn.rmsd import ensemble_rmsd_matrix, qcp_rmsd, rmsd_matrix
+
+
+def kabsch_rmsd(coords_a, coords_b):
+    coords_a, coords_b = coords_a - coords_a.mean(axis=0), coords_b - coords_b.mean(axis=0)
+    u, s, vt = np.linalg.svd(coords_a.T @ coords_b)
+    s[-1] *= np.sign(np.linalg.det(u @ vt))
+    return np.sqrt(max((coords_a ** 2).sum() + (coords_b ** 2).sum() - 2 * s.sum(), 0) / len(coords_a))
+
+
+class TestRmsd():
+    def setup_class(self):
+        fx.test_setup(self, 'rmsd')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_qcp_rmsd(self):
+        coords = np.random.default_rng(1).normal(size=(12, 40, 3)) * 5
+        expected = [[kabsch_rmsd(coords_a, coords_b) for coords_b in coords[:5]] for coords_a in coords]
+        assert np.allclose(qcp_rmsd(coords, coords[:5]), expected, atol=1e-5)
+        # Rotated and translated copies superpose exactly
+        rotation, _ = np.linalg.qr(np.random.default_rng(2).normal(size=(3, 3)))
+        rotation *= np.sign(np.linalg.det(rotation))
+        assert np.allclose(qcp_rmsd(coords, coords @ rotation.T + [1.0, -2.0, 3.0]).diagonal(), 0, atol=1e-4)
+
+    def test_rmsd_matrix(self):
+        ensemble = Ensemble.read(self.paths['input_pdb_path'])
+        ca = ensemble.select(ensemble.topology['name'] == 'CA')
+        matrix = ensemble_rmsd_matrix(self.paths['input_pdb_path'], self.paths['output_npy_path'], atom_names=['CA'], tile_size=6, num_workers=2)
+        assert fx.not_empty(self.paths['output_npy_path'])
+        assert matrix.shape == (20, 20) and matrix.dtype == np.float32
+        assert np.array_equal(matrix, matrix.T) and not matrix.diagonal().any()
+        coords = ca.coords.astype(np.float64)
+        expected = [[kabsch_rmsd(coords_a, coords_b) for coords_b in coords] for coords_a in coords]
+        assert np.allclose(np.load(self.paths['output_npy_path']), expected, atol=1e-4)
+        assert np.allclose(rmsd_matrix(ca.coords, tile_size=7, num_workers=1), matrix, atol=1e-5)
+        assert np.allclose(rmsd_matrix(ensemble.coords, tile_size=7, num_workers=1, atom_indices=np.flatnonzero(ensemble.topology['name'] == 'CA')), matrix, atol=1e-5)
+
+    def test_rmsd_matrix_xtc(self):
+        write_trajectory(self.paths['input_pdb_path'], self.paths['output_xtc_path'], self.paths['output_top_path'])
+        matrix = ensemble_rmsd_matrix(self.paths['output_xtc_path'], self.paths['output_xtc_npy_path'], top_path=self.paths['output_top_path'],
+                                      atom_names=['CA'], tile_size=6, num_workers=1)
+        # Within the XTC precision of the matrix of the PDB ensemble
+        expected = ensemble_rmsd_matrix(self.paths['input_pdb_path'], self.paths['output_npy_path'], atom_names=['CA'], tile_size=6, num_workers=1)
+        assert matrix.shape == (20, 20) and np.allclose(matrix, expected, atol=5e-3)
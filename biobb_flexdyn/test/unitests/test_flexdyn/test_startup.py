@@ -0,0 +1,26 @@
+# type: ignore
+import json
+import subprocess
+import sys
+import pytest
+
+# Dependencies only needed by prody_anm or inside launch(), never when a module is imported.
+# The import time budget of the block modules is checked by the benchmark suite (test/benchmark/benchmark.py)
+HEAVY_MODULES = ['prody', 'scipy']
+STARTUP_SCRIPT = """
+import json, sys
+import biobb_flexdyn.flexdyn.{module}
+print(json.dumps([name for name in {heavy} if name in sys.modules]))
+"""
+
+
+def heavy_imports(module):
+    return json.loads(subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                     capture_output=True, text=True, check=True).stdout)
+
+
+class TestStartup():
+    @pytest.mark.parametrize('module', ['concoord_dist', 'concoord_disco', 'concoord_violations', 'concoord_prune', 'nolb_nma',
+                                        'imod_imode', 'imod_imove', 'imod_imc', 'imod_pipeline', 'prody_anm', 'batch'])
+    def test_startup_imports(self, module):
+        assert not heavy_imports(module)
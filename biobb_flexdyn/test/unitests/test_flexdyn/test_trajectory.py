@@ -0,0 +1,70 @@
+# type: ignore
+import numpy as np
+import pytest
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexdyn.flexdyn.ensemble import Ensemble, write_trajectory
+from biobb_flexdyn.flexdyn.prody_anm import ProdyANM
+from biobb_flexdyn.flexdyn import trajectory as trajectory_module
+from biobb_flexdyn.flexdyn.trajectory import count_trajectory_frames, iter_trajectory_chunks, open_trajectory_writer, read_trajectory, read_xtc
+
+
+class TestTrajectory():
+    def setup_class(self):
+        fx.test_setup(self, 'trajectory')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_trajectory(self):
+        ensemble = Ensemble.read(self.paths['input_pdb_path'])
+        for key, atol in [('output_xtc_path', 5e-3), ('output_dcd_path', 1e-5)]:
+            write_trajectory(self.paths['input_pdb_path'], self.paths[key], self.paths['output_top_path'], chunk_size=6)
+            assert fx.not_empty(self.paths[key])
+            coords = read_trajectory(self.paths[key])
+            assert coords.shape == (20, 716, 3) and coords.dtype == np.float32
+            assert np.allclose(coords, ensemble.coords, atol=atol)
+            assert count_trajectory_frames(self.paths[key]) == 20
+            assert np.array_equal(np.concatenate(list(iter_trajectory_chunks(self.paths[key], chunk_size=7))), coords)
+        top = Ensemble.read(self.paths['output_top_path'])
+        assert len(top) == 1 and np.array_equal(top.topology, ensemble.topology)
+
+    def test_trajectory_npz(self):
+        ensemble = Ensemble.read(self.paths['input_pdb_path'])
+        with open_trajectory_writer(self.paths['output_npz_path'], ensemble.num_atoms, ensemble.topology) as writer:
+            for start in range(0, len(ensemble), 6):
+                writer.write(ensemble.coords[start:start + 6])
+        assert writer.num_frames == 20
+        loaded = Ensemble.read(self.paths['output_npz_path'])
+        assert np.array_equal(loaded.coords, ensemble.coords) and np.array_equal(loaded.topology, ensemble.topology)
+
+    def test_trajectory_from_block(self):
+        block = ProdyANM(input_pdb_path=self.paths['input_structure_path'], output_pdb_path=self.paths['output_prody_path'],
+                         output_top_path=self.paths['output_top_path'], properties=self.properties)
+        assert block.launch() == 0
+        ensemble = Ensemble.from_block(block)
+        assert len(ensemble) == 6 and ensemble.num_atoms == 85
+        assert np.allclose(ensemble[0], Ensemble.read(self.paths['output_top_path'])[0], atol=5e-3)
+
+    def test_trajectory_gromacs_xtc(self, monkeypatch):
+        # First frame of a GROMACS simulation of cobrotoxin in water (MDAnalysis test data), against the same
+        # frame of the full precision TRR trajectory
+        decode_fixed, fixed_frames = trajectory_module._decode_xtc_fixed, []
+        monkeypatch.setattr(trajectory_module, '_decode_xtc_fixed', lambda *args: fixed_frames.append(decode_fixed(*args)) or fixed_frames[-1])
+        coords = read_xtc(self.paths['input_gromacs_xtc_path'])
+        # Decoded with the run-length encoding of the small differences between consecutive atoms
+        assert fixed_frames == [None]
+        assert coords.shape == (1, 19385, 3)
+        assert np.abs(coords[0] - np.load(self.paths['ref_gromacs_coords_path'])).max() <= 5e-3 + 1e-5
+
+    def test_trajectory_independent_reader(self):
+        mdtraj = pytest.importorskip('mdtraj')
+        ensemble = Ensemble.read(self.paths['input_pdb_path'])
+        write_trajectory(self.paths['input_pdb_path'], self.paths['output_xtc_path'], chunk_size=6)
+        with mdtraj.formats.XTCTrajectoryFile(self.paths['output_xtc_path']) as xtc_file:
+            coords, _, _, _ = xtc_file.read()
+        assert coords.shape == (20, 716, 3)
+        assert np.allclose(coords * 10, ensemble.coords, atol=5e-3)
+        with mdtraj.formats.XTCTrajectoryFile(self.paths['input_gromacs_xtc_path']) as xtc_file:
+            coords, _, _, _ = xtc_file.read()
+        assert np.allclose(coords * 10, read_xtc(self.paths['input_gromacs_xtc_path']), atol=1e-5)
@@ -30,7 +30,12 @@ setuptools.setup(
             "imod_imove = biobb_flexdyn.flexdyn.imod_imove:main",
             "imod_imc = biobb_flexdyn.flexdyn.imod_imc:main",
             "nolb_nma = biobb_flexdyn.flexdyn.nolb_nma:main",
-            "prody_anm = biobb_flexdyn.flexdyn.prody_anm:main"
+            "prody_anm = biobb_flexdyn.flexdyn.prody_anm:main",
+            "concoord_violations = biobb_flexdyn.flexdyn.concoord_violations:main",
+            "concoord_prune = biobb_flexdyn.flexdyn.concoord_prune:main",
+            "imod_pipeline = biobb_flexdyn.flexdyn.imod_pipeline:main",
+            "flexdyn_batch = biobb_flexdyn.flexdyn.batch:main",
+            "flexdyn_rmsd = biobb_flexdyn.flexdyn.rmsd:main"
         ]
     },
     classifiers=[